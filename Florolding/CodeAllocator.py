@@ -0,0 +1,151 @@
+import collections
+import hashlib
+import math
+import os
+from . import Scaffolding
+
+
+class BloomFilter:
+    r"""
+    可持久化的布隆过滤器
+    用于记录曾经分配过的房间码, 进程重启后依然避免重复使用; 只能添加不能删除
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))  # 位数
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def __positions(self, item: str):
+        # 双重哈希: 用一次blake2b得到两个64位哈希值, 组合出hash_count个位置
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self.__positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(item))
+
+    def save(self, path: str):
+        """原子写入磁盘"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(self.size.to_bytes(8, "big") + self.hash_count.to_bytes(2, "big") + self.bits)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        with open(path, "rb") as f:
+            data = f.read()
+        bloom = cls.__new__(cls)
+        bloom.size = int.from_bytes(data[:8], "big")
+        bloom.hash_count = int.from_bytes(data[8:10], "big")
+        bloom.bits = bytearray(data[10:])
+        if len(bloom.bits) != (bloom.size + 7) // 8:
+            raise ValueError("布隆过滤器文件已损坏")
+        return bloom
+
+
+class CodeAllocator:
+    r"""
+    房间码分配器
+    使用secrets生成房间码, 用集合记录正在使用的房间码实现O(1)冲突检查, 并预先生成一批备用房间码,
+    使创建房间时不必等待生成或处理冲突
+    """
+
+    def __init__(self, reserve_size: int = 64, bloom_path: str | None = None, bloom_capacity: int = 100000, bloom_error_rate: float = 0.001):
+        r"""
+        :param reserve_size: 备用房间码池的目标大小
+        :param bloom_path: 布隆过滤器的保存路径, 设置后跨进程重启也不会重复分配房间码; 在释放房间码与save时写入
+        :param bloom_capacity: 布隆过滤器预计容纳的房间码数量
+        :param bloom_error_rate: 布隆过滤器的误判率, 误判只会导致多生成一次
+        """
+        self.reserve_size = reserve_size
+        self.bloom_path = bloom_path
+        self.active = set()  # 正在使用的房间码
+        self.reserved = collections.deque()  # 已生成且未被使用的备用房间码
+        self.bloom = None
+        self.unsaved = False  # 布隆过滤器是否有尚未写入磁盘的房间码
+        if bloom_path is not None:
+            try:
+                self.bloom = BloomFilter.load(bloom_path)
+            except (OSError, ValueError):
+                self.bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+
+    def __len__(self) -> int:
+        return len(self.active)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.active
+
+    def __is_free(self, code: str) -> bool:
+        return code not in self.active and (self.bloom is None or code not in self.bloom)
+
+    def __mark_used(self, code: str):
+        self.active.add(code)
+        if self.bloom is not None:
+            self.bloom.add(code)
+            self.unsaved = True
+
+    def reserve(self, n: int | None = None) -> int:
+        r"""
+        预先生成备用房间码
+        :param n: 生成数量, 默认补足到reserve_size
+        :return: 实际新增的数量
+        """
+        n = self.reserve_size - len(self.reserved) if n is None else n
+        if n <= 0:
+            return 0
+        reserved = set(self.reserved)
+        added = 0
+        for code in Scaffolding.generate_codes(n):
+            if code not in reserved and self.__is_free(code):
+                self.reserved.append(code)
+                reserved.add(code)
+                added += 1
+        return added
+
+    def allocate(self) -> str:
+        """分配一个未被使用的房间码"""
+        while self.reserved:
+            code = self.reserved.popleft()
+            # 备用房间码可能已通过claim被占用
+            if self.__is_free(code):
+                self.__mark_used(code)
+                return code
+        code = Scaffolding.generate_code()
+        while not self.__is_free(code):
+            code = Scaffolding.generate_code()
+        self.__mark_used(code)
+        return code
+
+    def allocate_block(self, n: int) -> list:
+        """一次分配n个房间码"""
+        if len(self.reserved) < n:
+            self.reserve(n - len(self.reserved))
+        return [self.allocate() for _ in range(n)]
+
+    def claim(self, code: str) -> bool:
+        r"""
+        登记外部指定的房间码
+        :return: 房间码有效且未被使用时返回True
+        """
+        if not Scaffolding.validate_code(code) or code in self.active:
+            return False
+        self.__mark_used(code)
+        return True
+
+    def release(self, code: str):
+        """房间关闭后释放房间码, 并保存布隆过滤器"""
+        self.active.discard(code)
+        self.save()
+
+    def save(self):
+        """保存布隆过滤器, 自上次保存后没有新分配的房间码时跳过"""
+        if self.bloom is not None and self.bloom_path is not None and self.unsaved:
+            self.bloom.save(self.bloom_path)
+            self.unsaved = False
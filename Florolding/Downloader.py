@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import stat
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from . import HttpCache
+
+# 各系统名与GetEasyTier.get_easytier_version_list中的键对应
+_SYSTEMS = {"Windows": "Windows", "Linux": "Linux", "Darwin": "MacOS", "FreeBSD": "FreeBSD"}
+_MACHINES = {"amd64": "x86_64", "x86_64": "x86_64", "x64": "x86_64", "arm64": "aarch64", "aarch64": "aarch64", "armv7l": "armv7", "armv7": "armv7", "armv6l": "arm", "mips": "mips", "mipsel": "mipsel"}
+
+
+def platform_download_url(version_list: dict) -> str | None:
+    r"""
+    从下载地址列表中选出当前平台对应的地址
+    :param version_list: GetEasyTier.get_easytier_version_list的返回值
+    :return: 下载地址, 当前平台没有对应版本时返回None
+    """
+    system_list = version_list.get(_SYSTEMS.get(platform.system(), platform.system()), {})
+    machine = _MACHINES.get(platform.machine().lower(), platform.machine().lower())
+    if machine == "aarch64" and "aarch64" not in system_list:
+        machine = "arm64"
+    return system_list.get(machine)
+
+
+def version_from_url(url: str) -> str:
+    """从下载地址中解析版本号"""
+    match = re.search(r"-v([0-9][^/]*?)\.zip$", url)
+    return match.group(1) if match else hashlib.sha256(url.encode("utf-8")).hexdigest()[:12]
+
+
+class ChunkedDownloader:
+    r"""
+    分块并行下载器
+    服务器支持Range时按块并行下载并记录进度, 中断后再次下载只会补齐未完成的块
+    """
+
+    def __init__(self, session: requests.Session | None = None, chunk_size: int = 4 * 1024 * 1024, workers: int = 4, retries: int = 3, timeout: float | tuple = (5, 30)):
+        self.session = session or requests.Session()
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def __probe(self, url: str) -> tuple:
+        r"""
+        获取文件大小、是否支持Range请求与ETag
+        :return: (重定向后的地址, 大小, 是否支持Range, ETag)
+        """
+        response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length") or 0) or None
+        return response.url, size, response.headers.get("Accept-Ranges", "").lower() == "bytes", response.headers.get("ETag")
+
+    def __download_range(self, url: str, part_path: str, start: int, end: int):
+        """下载[start, end]区间并写入文件对应位置"""
+        headers = {"Range": f"bytes={start}-{end}"}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 206:
+                raise requests.HTTPError(f"Range request failed: {response.status_code}", response=response)
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                written = 0
+                for data in response.iter_content(64 * 1024):
+                    f.write(data)
+                    written += len(data)
+        if written != end - start + 1:
+            raise requests.HTTPError(f"Incomplete range {start}-{end}: {written} bytes")
+
+    def __download_stream(self, url: str, part_path: str):
+        """不支持Range时单线程流式下载"""
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            with open(part_path, "wb") as f:
+                for data in response.iter_content(64 * 1024):
+                    f.write(data)
+
+    def download(self, url: str, path: str, sha256: str | None = None) -> str:
+        r"""
+        下载文件到path
+        :param url: 下载地址
+        :param path: 保存路径, 下载过程中使用path.part与path.part.json记录进度
+        :param sha256: 期望的SHA256, 为None时只校验大小
+        :return: 保存路径
+        """
+        part_path = f"{path}.part"
+        state_path = f"{path}.part.json"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # GitHub等会重定向到有时效的签名地址, 每次都不同; 进度按原始地址记录, 重定向后的地址只用于本次请求
+        download_url, size, accept_ranges, etag = self.__probe(url)
+        if size is None or not accept_ranges:
+            self.__download_stream(download_url, part_path)
+        else:
+            state = self.__load_state(state_path, url, size, etag)
+            if state is None or not os.path.exists(part_path):
+                state = {"url": url, "size": size, "etag": etag, "done": []}
+                with open(part_path, "wb") as f:
+                    f.truncate(size)
+            chunks = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+            done = set(state.get("done"))
+            pending = [chunk for chunk in chunks if chunk[0] not in done]
+
+            def worker(chunk: tuple):
+                for attempt in range(self.retries):
+                    try:
+                        self.__download_range(download_url, part_path, *chunk)
+                        break
+                    except (requests.RequestException, OSError):
+                        if attempt == self.retries - 1:
+                            raise
+                with self.lock:
+                    state.get("done").append(chunk[0])
+                    self.__save_state(state_path, state)
+
+            with ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+                # list()会重新抛出任意块的异常, 已完成的块保留在进度文件中
+                list(executor.map(worker, pending))
+        self.__verify(part_path, size, sha256)
+        os.replace(part_path, path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return path
+
+    @staticmethod
+    def __load_state(state_path: str, url: str, size: int, etag: str | None) -> dict | None:
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 大小或ETag变化说明文件已更新, 重新下载
+        if state.get("url") != url or state.get("size") != size or state.get("etag") != etag:
+            return None
+        return state
+
+    @staticmethod
+    def __save_state(state_path: str, state: dict):
+        temp_path = f"{state_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, state_path)
+
+    @staticmethod
+    def __verify(part_path: str, size: int | None, sha256: str | None):
+        actual_size = os.path.getsize(part_path)
+        if size is not None and actual_size != size:
+            os.remove(part_path)
+            raise ValueError(f"文件大小不匹配: {actual_size} != {size}")
+        if sha256 is not None:
+            digest = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                for data in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(data)
+            if digest.hexdigest().lower() != sha256.lower():
+                os.remove(part_path)
+                raise ValueError("文件SHA256校验失败")
+
+
+def install_easytier(version_list: dict | None = None, cache_dir: str | None = None, url: str | None = None, sha256: str | None = None, downloader: ChunkedDownloader | None = None) -> str:
+    r"""
+    下载并解压当前平台的EasyTier, 已安装的版本直接返回
+    :param version_list: GetEasyTier.get_easytier_version_list的返回值, 为None时自动获取
+    :param cache_dir: 缓存目录, 默认使用HttpCache.default_cache_dir()
+    :param url: 直接指定下载地址, 优先于version_list
+    :param sha256: 压缩包期望的SHA256
+    :param downloader: 自定义下载器
+    :return: 包含easytier-core与easytier-cli的目录, 可直接作为create_room/join_room的easytier_path
+    """
+    if url is None:
+        if version_list is None:
+            from . import GetEasyTier
+            version_list = GetEasyTier.get_easytier_version_list()
+        url = platform_download_url(version_list)
+        if url is None:
+            raise RuntimeError(f"没有适用于 {platform.system()} {platform.machine()} 的EasyTier")
+    cache_dir = cache_dir or HttpCache.default_cache_dir()
+    install_dir = os.path.join(cache_dir, "easytier", version_from_url(url))
+    if _find_binaries(install_dir):
+        return install_dir
+    archive_path = os.path.join(cache_dir, "downloads", url.rsplit("/", 1)[-1])
+    if not os.path.exists(archive_path):
+        (downloader or ChunkedDownloader()).download(url, archive_path, sha256)
+    temp_dir = f"{install_dir}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            if archive.testzip() is not None:
+                raise zipfile.BadZipFile("压缩包CRC校验失败")
+            # 压缩包内通常只有一层目录, 其中的文件全部解压到同一目录; Windows版的wintun.dll、Packet.dll等需与easytier-core放在一起
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                if member.is_dir() or not name:
+                    continue
+                target = os.path.join(temp_dir, name)
+                with archive.open(member) as source, open(target, "wb") as f:
+                    shutil.copyfileobj(source, f, 1024 * 1024)
+                if name.startswith(("easytier-core", "easytier-cli")):
+                    os.chmod(target, os.stat(target).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        if not _find_binaries(temp_dir):
+            raise RuntimeError("压缩包中没有easytier-core与easytier-cli")
+        shutil.rmtree(install_dir, ignore_errors=True)
+        os.replace(temp_dir, install_dir)
+    except (zipfile.BadZipFile, RuntimeError):
+        # 压缩包损坏时删除, 下次重新下载
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.remove(archive_path)
+        raise
+    return install_dir
+
+
+def _find_binaries(directory: str) -> bool:
+    """目录中是否同时存在easytier-core与easytier-cli"""
+    if not os.path.isdir(directory):
+        return False
+    names = os.listdir(directory)
+    return any(name.startswith("easytier-core") for name in names) and any(name.startswith("easytier-cli") for name in names)
@@ -1,10 +1,29 @@
 import asyncio
+import collections
 import struct
 import json
+import logging
+import random
+from . import F_Frame
+
+logger = logging.getLogger(__name__)
+
+# 重复执行不会产生副作用的协议, 自动重连后可以重新发送
+IDEMPOTENT_PROTOCOLS = frozenset({
+    "c:ping",
+    "c:protocols",
+    "c:server_port",
+    "c:player_ping",
+    "c:player_profiles_list",
+    "f:player_profiles_list",
+    "f:player_profiles_delta",
+    "f:player_timeout"
+})
 
 
 class AsyncFloroldingClient:
-    def __init__(self, machine_id: str, easytier_id: str, player_name: str = "", server_host: str = "127.0.0.1", server_port: int = 3939):
+    def __init__(self, machine_id: str, easytier_id: str, player_name: str = "", server_host: str = "127.0.0.1", server_port: int = 3939, request_timeout: float | None = 10, max_body_size: int | None = F_Frame.DEFAULT_MAX_BODY_SIZE, heartbeat_interval: float | None = 5, heartbeat_jitter: float = 0.2, max_backoff: float = 30,
+                 auto_reconnect: bool = False, reconnect_attempts: int | None = None):
         self.player_name = player_name if player_name !=0 and not player_name.isspace() else f"Player_{machine_id}"
         self.machine_id = machine_id
         self.easytier_id = easytier_id
@@ -13,6 +32,19 @@ class AsyncFloroldingClient:
         self.server_port = server_port
         self.reader = None
         self.writer = None
+        self.request_timeout = request_timeout  # 默认单次请求超时时间(秒), None表示不超时
+        self.max_body_size = max_body_size  # 单个响应体的最大长度, None表示不限制
+        self.read_task = None  # 后台读取响应的任务
+        self.pending = collections.deque()  # 等待响应的请求 (Future, 请求类型, 请求体), 与请求发送顺序一致
+
+        # 自动重连: 连接断开后在后台按指数退避重连, 请求会等待重连完成而不是直接失败
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_attempts = reconnect_attempts  # 放弃前最多连续尝试的次数, None表示不限制
+        self.idempotent_protocols = set(IDEMPOTENT_PROTOCOLS)  # 断线时未完成、重连后重新发送的协议
+        self.reconnect_task = None
+        self.replay = []  # 等待重连后重新发送的请求
+        self.closing = False  # 正在主动断开, 不应自动重连
+        self.server_protocols = None  # 协议协商结果的缓存
 
         # 支持的协议列表
         self.supported_protocols = [
@@ -21,12 +53,26 @@ class AsyncFloroldingClient:
             "c:server_port",
             "c:player_easytier_id",
             "c:player_ping",
-            "c:player_profiles_list"
+            "c:player_profiles_list",
+            "f:player_profiles_list",
+            "f:player_profiles_delta",
+            "f:player_timeout"
         ]
 
         self.heartbeat_task = None
+        self.heartbeat_interval = heartbeat_interval  # 连接后自动心跳的间隔(秒), None表示不自动发送; 服务器公布超时时间后以其为准
+        self.heartbeat_jitter = heartbeat_jitter  # 心跳间隔随机缩短的最大比例, 避免大量客户端同时发送
+        self.max_backoff = max_backoff  # 心跳失败重试与重连的最长等待时间(秒)
+        self.server_player_timeout = None  # 服务器通过f:player_timeout公布的心跳超时时间(秒)
+        self.rtt = None  # 心跳往返时间的指数移动平均(秒)
+        self.__heartbeat_key = None  # 生成心跳请求体时的玩家资料
+        self.__heartbeat_body = None
         self.error_num = 0
 
+        # 房间玩家列表的本地镜像, 通过f:player_profiles_delta增量同步
+        self.roster = {}  # {machine_id: player_info}
+        self.roster_generation = None
+
     async def c_ping(self, data: bytes = b"Hello!"):
         status, response_body = await self.send_request("c:ping", data)
         print(f"状态: {status}")
@@ -51,6 +97,21 @@ class AsyncFloroldingClient:
             print(f"错误: {response_body.decode('utf-8')}")
             print("✗ 协议协商失败")
 
+    async def negotiate_protocols(self, refresh: bool = False) -> list:
+        r"""
+        与服务器协商共同支持的协议, 结果会被缓存, 重连后直接复用
+        :param refresh: 忽略缓存重新协商
+        :return: 共同支持的协议列表
+        """
+        if self.server_protocols is not None and not refresh:
+            return self.server_protocols
+        status, response_body = await self.send_request("c:protocols", "\0".join(self.supported_protocols).encode("ascii"))
+        if status != 0:
+            raise RuntimeError(f"协议协商失败: {response_body.decode('utf-8', 'replace')}")
+        server_protocols = set(response_body.decode("ascii").split("\0"))
+        self.server_protocols = [protocol for protocol in self.supported_protocols if protocol in server_protocols]
+        return self.server_protocols
+
     async def c_server_port(self):
         status, response_body = await self.send_request("c:server_port", b"")
         print(f"状态: {status}")
@@ -84,80 +145,343 @@ class AsyncFloroldingClient:
             print(f"错误: {response_body.decode('utf-8')}")
             print("✗ 玩家列表请求失败")
 
-    async def start_heartbeat(self, interval: int = 5):
-        """定时发送心跳"""
+    async def f_player_profiles_list(self, generation: int | None = None) -> tuple:
+        r"""
+        获取带代数的玩家列表
+        :param generation: 本地已知的代数, 服务器上的玩家列表未变化时不会重复传输
+        :return: (当前代数, 玩家列表), 玩家列表未变化时为None
+        """
+        request_body = struct.pack(">Q", generation) if generation is not None else b""
+        status, response_body = await self.send_request("f:player_profiles_list", request_body)
+        if status != 0:
+            raise RuntimeError(f"玩家列表请求失败: {response_body.decode('utf-8', 'replace')}")
+        current_generation = struct.unpack(">Q", response_body[:8])[0]
+        if len(response_body) == 8:
+            return current_generation, None
+        return current_generation, json.loads(response_body[8:].decode("utf-8"))
+
+    async def player_easytier_id(self, machine_id: str | None = None) -> dict:
+        r"""
+        通过c:player_easytier_id查询玩家的EasyTier节点ID
+        :param machine_id: 玩家的machine_id, 默认查询自己
+        :return: {"machine_id": machine_id, "easytier_id": 节点ID, "online": 节点是否在EasyTier网络中}
+        """
+        status, response_body = await self.send_request("c:player_easytier_id", machine_id.encode("utf-8") if machine_id else b"")
+        if status != 0:
+            raise RuntimeError(f"查询节点ID失败: {response_body.decode('utf-8', 'replace')}")
+        return json.loads(response_body.decode("utf-8"))
+
+    async def sync_roster(self) -> dict:
+        r"""
+        同步房间玩家列表到self.roster
+        服务器不支持增量协议时回退为获取完整列表并在本地比较
+        :return: 本次变化 {"added": [玩家], "updated": [玩家], "removed": [machine_id]}
+        """
+        request_body = struct.pack(">Q", self.roster_generation) if self.roster_generation is not None else b""
+        status, response_body = await self.send_request("f:player_profiles_delta", request_body)
+        if status == 0:
+            delta = json.loads(response_body.decode("utf-8"))
+            if delta.get("reset"):
+                return self.__replace_roster(delta.get("added"), delta.get("generation"))
+            for player_info in delta.get("added") + delta.get("updated"):
+                self.roster[player_info.get("machine_id")] = player_info
+            for machine_id in delta.get("removed"):
+                self.roster.pop(machine_id, None)
+            self.roster_generation = delta.get("generation")
+            return {"added": delta.get("added"), "updated": delta.get("updated"), "removed": delta.get("removed")}
+        status, response_body = await self.send_request("c:player_profiles_list", b"")
+        if status != 0:
+            raise RuntimeError(f"玩家列表请求失败: {response_body.decode('utf-8', 'replace')}")
+        return self.__replace_roster(json.loads(response_body.decode("utf-8")), None)
+
+    def __replace_roster(self, players: list, generation: int | None) -> dict:
+        """用完整玩家列表替换本地镜像, 返回与旧镜像的差异"""
+        new_roster = {player_info.get("machine_id"): player_info for player_info in players}
+        changes = {
+            "added": [player_info for machine_id, player_info in new_roster.items() if machine_id not in self.roster],
+            "updated": [player_info for machine_id, player_info in new_roster.items() if machine_id in self.roster and self.roster[machine_id] != player_info],
+            "removed": [machine_id for machine_id in self.roster if machine_id not in new_roster]
+        }
+        self.roster = new_roster
+        self.roster_generation = generation
+        return changes
+
+    def heartbeat_body(self) -> bytes:
+        """c:player_ping请求体, 只在玩家名或ID变化后重新编码"""
+        key = (self.player_name, self.machine_id, self.easytier_id, self.vendor)
+        if key != self.__heartbeat_key:
+            self.__heartbeat_body = json.dumps({
+                "name": self.player_name,
+                "machine_id": self.machine_id,
+                "easytier_id": self.easytier_id,
+                "vendor": self.vendor
+            }).encode("utf-8")
+            self.__heartbeat_key = key
+        return self.__heartbeat_body
+
+    async def fetch_player_timeout(self) -> float | None:
+        r"""
+        通过f:player_timeout查询服务器的心跳超时时间
+        :return: 超时时间(秒), 服务器不检测心跳或不支持该协议时为None
+        """
+        status, response_body = await self.send_request("f:player_timeout", b"")
+        if status != 0:
+            self.server_player_timeout = None
+        else:
+            self.server_player_timeout = json.loads(response_body.decode("utf-8")).get("player_timeout")
+        return self.server_player_timeout
+
+    def heartbeat_delay(self, interval: float) -> float:
+        r"""
+        计算下一次心跳前的等待时间
+        服务器公布了超时时间时, 保证超时窗口内至少发出三次心跳并预留一个往返时间, 再随机缩短一部分避免与其他客户端同步
+        :param interval: 服务器未公布超时时间时使用的间隔(秒)
+        """
+        if self.server_player_timeout:
+            interval = self.server_player_timeout / 3 - (self.rtt or 0)
+        interval = max(0.1, interval)
+        return interval * (1 - self.heartbeat_jitter * random.random())
+
+    def __backoff(self, failures: int) -> float:
+        """第failures次连续失败后的等待时间, 指数增长并带随机抖动"""
+        return min(self.max_backoff, 0.5 * 2 ** (failures - 1)) * (0.5 + random.random() / 2)
+
+    async def start_heartbeat(self, interval: float = 5):
+        r"""
+        定时发送心跳
+        发送失败时按指数退避重试, 连接断开时自动重连, 直到disconnect
+        :param interval: 服务器未公布超时时间时的心跳间隔(秒)
+        """
+        loop = asyncio.get_running_loop()
+
         async def heartbeat_loop():
+            failures = 0
+            negotiated = False
             while True:
                 try:
-                    player_data = {
-                        "name": self.player_name,
-                        "machine_id": self.machine_id,
-                        "easytier_id": self.easytier_id,
-                        "vendor": self.vendor
-                    }
-                    request_body = json.dumps(player_data).encode("utf-8")
-                    await self.send_request("c:player_ping", request_body)
-                    print(f"[{self.player_name}] 心跳发送成功")
-                    await asyncio.sleep(interval)
-                except Exception as e:
-                    print(f"[{self.player_name}] 心跳发送失败: {e}")
+                    if self.read_task is None or self.read_task.done():
+                        # 连接已断开, 重新连接并重新查询超时时间
+                        await self.reconnect()
+                        negotiated = False
+                    if not negotiated:
+                        await self.fetch_player_timeout()
+                        negotiated = True
+                    start = loop.time()
+                    status, response_body = await self.send_request("c:player_ping", self.heartbeat_body())
+                    if status != 0:
+                        raise RuntimeError(response_body.decode("utf-8", "replace"))
+                    elapsed = loop.time() - start
+                    self.rtt = elapsed if self.rtt is None else 0.8 * self.rtt + 0.2 * elapsed
+                    failures = 0
+                    delay = self.heartbeat_delay(interval)
+                    logger.debug("[%s] 心跳发送成功, 下一次: %.2f秒后", self.player_name, delay)
+                except (OSError, RuntimeError, ValueError, asyncio.TimeoutError) as e:
+                    failures += 1
+                    delay = self.__backoff(failures)
+                    logger.warning("[%s] 心跳发送失败(%d): %s, %.2f秒后重试", self.player_name, failures, e, delay)
+                # disconnect会先设置closing再取消任务; Python 3.11的wait_for在内部Future恰好完成时会吞掉取消, 因此在等待前检查closing
+                if self.closing:
                     break
+                await asyncio.sleep(delay)
 
+        if self.heartbeat_task and not self.heartbeat_task.done():
+            self.heartbeat_task.cancel()
         self.heartbeat_task = asyncio.create_task(heartbeat_loop())
-        print(f"[{self.player_name}] 开始定时心跳，间隔: {interval}秒")
-
-    @staticmethod
-    def __create_request(protocol_type: str, request_body: bytes = b'') -> bytes:
-        """创建TCP请求"""
-        # 编码协议类型
-        protocol_bytes = protocol_type.encode("ascii")
-        # 构建请求: [类型长度(1字节)][类型][请求体长度(4字节)][请求体]
-        request = struct.pack(">B", len(protocol_bytes))  # 类型长度
-        request += protocol_bytes  # 类型
-        request += struct.pack(">I", len(request_body))  # 请求体长度
-        request += request_body  # 请求体
-        return request
-
-    @staticmethod
-    def __parse_response(data: bytes) -> tuple:
-        """解析TCP响应"""
-        print("包长度:", len(data))
-        if len(data) < 5:
-            raise ValueError("响应数据太短")
-        status = struct.unpack(">B", data[0:1])[0]
-        body_length = struct.unpack(">I", data[1:5])[0]
-        if len(data) < 5 + body_length:
-            raise ValueError("响应体长度不匹配")
-        response_body = data[5:5 + body_length]
-        return status, response_body
+        logger.info("[%s] 开始定时心跳，间隔: %s秒", self.player_name, interval)
 
-    async def connect(self):
-        """连接到基于Scaffolding协议的服务器"""
+    async def __read_loop(self):
+        """后台读取响应, 按先进先出顺序交给等待中的请求"""
+        decoder = F_Frame.ResponseDecoder(self.max_body_size)
+        error = ConnectionError("与服务器的连接已断开")
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data: break
+                for response in decoder.feed(data):
+                    if not self.pending:
+                        raise F_Frame.FrameError("收到未对应任何请求的响应")
+                    future = self.pending.popleft()[0]
+                    # 已超时或被取消的请求直接丢弃其响应
+                    if not future.done():
+                        future.set_result(response)
+        except (OSError, F_Frame.FrameError) as e:
+            error = ConnectionError(f"与服务器的连接异常: {e}")
+        finally:
+            # 连接结束, 未完成的请求无法再从这条连接收到响应
+            resume = self.auto_reconnect and not self.closing
+            while self.pending:
+                entry = self.pending.popleft()
+                if entry[0].done():
+                    continue
+                if resume and entry[1] in self.idempotent_protocols:
+                    self.replay.append(entry)
+                else:
+                    entry[0].set_exception(error)
+            if resume:
+                logger.warning("与服务器的连接已断开, 开始自动重连")
+                self.__start_reconnect()
+
+    def __start_reconnect(self) -> asyncio.Task:
+        if self.reconnect_task is None or self.reconnect_task.done():
+            self.reconnect_task = asyncio.create_task(self.__reconnect_loop())
+            # 失败由等待重连的请求各自收到, 无人等待时不必告警
+            self.reconnect_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self.reconnect_task
+
+    async def reconnect(self):
+        """重新建立连接并恢复会话, 多个调用方共享同一次重连"""
+        await asyncio.shield(self.__start_reconnect())
+
+    async def __reconnect_loop(self):
+        failures = 0
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while True:
+            await self.__close_stream()
+            try:
+                await self.__open_stream()
+                break
+            except OSError as e:
+                failures += 1
+                if self.reconnect_attempts is not None and failures >= self.reconnect_attempts:
+                    self.__fail_replay(ConnectionError(f"重连失败: {e}"))
+                    raise ConnectionError(f"重连失败: {e}") from e
+                delay = self.__backoff(failures)
+                logger.warning("重连失败(%d): %s, %.2f秒后重试", failures, e, delay)
+                await asyncio.sleep(delay)
+        # 恢复会话: 先立即发送心跳重新登记玩家, 再按原顺序重发断线时未完成的请求; 协议协商结果沿用缓存
+        entries = []
+        if self.heartbeat_task is not None:
+            ping = loop.create_future()
+            # 结果由下一次定时心跳确认, 这里只需避免未读取的异常告警
+            ping.add_done_callback(lambda future: future.cancelled() or future.exception())
+            entries.append((ping, "c:player_ping", self.heartbeat_body()))
+        entries += [entry for entry in self.replay if not entry[0].done()]
+        self.replay.clear()
+        if entries:
+            self.__write_entries(entries)
+        logger.info("已重新连接到服务器 %s:%s, 耗时%.3f秒, 重发%d个请求", self.server_host, self.server_port, loop.time() - start, len(entries))
+
+    def __fail_replay(self, error: Exception):
+        for future, _, _ in self.replay:
+            if not future.done():
+                future.set_exception(error)
+        self.replay.clear()
+
+    async def __open_stream(self):
+        """建立TCP连接并启动读取任务"""
         self.reader, self.writer = await asyncio.open_connection(
             self.server_host, self.server_port
         )
-        print(f"已连接到服务器 {self.server_host}:{self.server_port}")
-        await self.start_heartbeat()
+        self.read_task = asyncio.create_task(self.__read_loop())
 
-    async def disconnect(self):
+    async def __close_stream(self):
+        """停止读取任务并关闭TCP连接"""
+        if self.read_task and not self.read_task.done():
+            self.read_task.cancel()
+            try:
+                await self.read_task
+            except asyncio.CancelledError:
+                pass
+        self.read_task = None
         if self.writer:
             self.writer.close()
-            await self.writer.wait_closed()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                # 服务器已先断开连接
+                pass
             self.reader = None
             self.writer = None
-            print("已断开与服务器的连接")
 
-    async def send_request(self, protocol_type: str, request_body: bytes = b"") -> tuple:
-        """发送请求并接收响应"""
+    async def connect(self):
+        """连接到基于Scaffolding协议的服务器"""
+        self.closing = False
+        await self.__open_stream()
+        logger.info("已连接到服务器 %s:%s", self.server_host, self.server_port)
+        if self.heartbeat_interval is not None:
+            await self.start_heartbeat(self.heartbeat_interval)
+
+    async def disconnect(self):
+        self.closing = True
+        for task in (self.heartbeat_task, self.reconnect_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, ConnectionError):
+                    pass
+        self.heartbeat_task = None
+        self.reconnect_task = None
+        self.__fail_replay(ConnectionError("已断开与服务器的连接"))
+        connected = self.writer is not None
+        await self.__close_stream()
+        if connected:
+            logger.info("已断开与服务器的连接")
+
+    def __write_entries(self, entries: list):
+        """写入请求并登记, 写入与登记之间没有await, 保证响应顺序与登记顺序一致"""
+        F_Frame.write_frames(self.writer, [
+            chunk for _, protocol_type, request_body in entries
+            for chunk in F_Frame.encode_request(protocol_type, request_body)
+        ])
+        self.pending.extend(entries)
+
+    def __submit(self, requests: list) -> list:
+        """写入一批请求并登记对应的Future, 不等待发送完成"""
         if not self.writer:
             raise RuntimeError("未连接到服务器")
-        # 创建并发送请求
-        self.writer.write(self.__create_request(protocol_type, request_body))
+        if self.read_task is None or self.read_task.done():
+            raise ConnectionError("与服务器的连接已断开")
+        loop = asyncio.get_running_loop()
+        entries = [(loop.create_future(), protocol_type, request_body) for protocol_type, request_body in requests]
+        self.__write_entries(entries)
+        return [entry[0] for entry in entries]
+
+    async def __resilient_request(self, requests: list) -> list:
+        """自动重连模式下发送请求: 断线时等待重连, 幂等请求在重连后自动重发"""
+        while self.reconnect_task is not None and not self.reconnect_task.done():
+            await self.reconnect()
+        if self.writer is None and not self.closing:
+            await self.reconnect()
+        futures = self.__submit(requests)
+        try:
+            await self.writer.drain()
+        except OSError:
+            # 连接已断开, 由读取任务触发重连后重发或使其失败
+            pass
+        return await asyncio.gather(*futures)
+
+    async def send_request(self, protocol_type: str, request_body: bytes = b"", timeout: float | None = None) -> tuple:
+        r"""
+        发送请求并接收响应, 可与其他请求并发调用
+        :param protocol_type: 请求类型
+        :param request_body: 请求体
+        :param timeout: 超时时间(秒), 默认使用request_timeout
+        :return: (状态, 响应体)
+        """
+        timeout = timeout if timeout is not None else self.request_timeout
+        if self.auto_reconnect:
+            return (await asyncio.wait_for(self.__resilient_request([(protocol_type, request_body)]), timeout))[0]
+        future, = self.__submit([(protocol_type, request_body)])
+        await self.writer.drain()
+        return await asyncio.wait_for(future, timeout)
+
+    async def send_many(self, requests: list, timeout: float | None = None) -> list:
+        r"""
+        一次性发送多个请求, 只需一次往返即可取得全部响应
+        :param requests: [(请求类型, 请求体), ...]
+        :param timeout: 整批请求的超时时间(秒), 默认使用request_timeout
+        :return: [(状态, 响应体), ...], 与请求顺序一致
+        """
+        if not requests:
+            return []
+        timeout = timeout if timeout is not None else self.request_timeout
+        if self.auto_reconnect:
+            return await asyncio.wait_for(self.__resilient_request(requests), timeout)
+        futures = self.__submit(requests)
         await self.writer.drain()
-        # 接收响应
-        response = await self.reader.read(4096)
-        # 正常解析响应
-        return self.__parse_response(response)
+        return await asyncio.wait_for(asyncio.gather(*futures), timeout)
 
     async def __aenter__(self):
         """进入异步上下文连接服务器"""
@@ -0,0 +1,169 @@
+import abc
+import functools
+import struct
+import sys
+
+# 默认单帧请求体/响应体上限 (1 MiB), 防止异常客户端迫使服务器无限缓存
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+
+_UINT32 = struct.Struct(">I")
+# 响应头: [状态(1字节)][响应体长度(4字节)]
+RESPONSE_HEADER = struct.Struct(">BI")
+
+
+class FrameError(ValueError):
+    """帧格式错误, 连接上的字节流已无法继续同步"""
+
+
+@functools.lru_cache(maxsize=256)
+def _request_prefix(protocol_type: str) -> bytes:
+    """[类型长度(1字节)][类型], 同一协议只编码一次"""
+    protocol_bytes = protocol_type.encode("ascii")
+    if len(protocol_bytes) > 255:
+        raise FrameError(f"Protocol type too long: {protocol_type}")
+    return bytes((len(protocol_bytes),)) + protocol_bytes
+
+
+def encode_request(protocol_type: str, body: bytes = b"") -> list:
+    r"""
+    编码请求帧: [类型长度(1字节)][类型][请求体长度(4字节)][请求体]
+    :return: 交给write_frames的分段列表, 请求体不会被拷贝
+    """
+    header = _request_prefix(protocol_type) + _UINT32.pack(len(body))
+    return [header, body] if body else [header]
+
+
+def encode_response(status: int, body: bytes = b"") -> list:
+    r"""
+    编码响应帧: [状态(1字节)][响应体长度(4字节)][响应体]
+    :return: 交给write_frames的分段列表, 响应体不会被拷贝
+    """
+    header = RESPONSE_HEADER.pack(status, len(body))
+    return [header, body] if body else [header]
+
+
+# Python 3.12起selector传输层的writelines使用sendmsg分散写, 不再合并分段
+_SCATTER_WRITELINES = sys.version_info >= (3, 12)
+# 不低于该长度的分段单独写入, 避免b"".join拷贝; 更短的分段合并写入以减少系统调用
+DIRECT_WRITE_SIZE = 16384
+
+
+def write_frames(writer, chunks: list):
+    r"""
+    发送encode_request/encode_response得到的分段
+    :param writer: asyncio.StreamWriter
+    :param chunks: 分段列表
+    """
+    if _SCATTER_WRITELINES:
+        writer.writelines(chunks)
+        return
+    # 旧版本的writelines会先拼接全部分段, 较大的请求体/响应体直接交给write, 传输层可用时不产生拷贝
+    small = []
+    for chunk in chunks:
+        if len(chunk) < DIRECT_WRITE_SIZE:
+            small.append(chunk)
+            continue
+        if small:
+            writer.write(b"".join(small))
+            small = []
+        writer.write(chunk)
+    if small:
+        writer.write(b"".join(small))
+
+
+class FrameDecoder(abc.ABC):
+    r"""
+    增量帧解码器, 可以一次喂入任意长度的字节流
+    TCP分段、粘包都会在内部缓冲区中处理, 每次feed返回本次能完整解析出的所有帧
+    """
+
+    def __init__(self, max_body_size: int | None = DEFAULT_MAX_BODY_SIZE):
+        self.max_body_size = max_body_size
+        self._buffer = bytearray()
+
+    @property
+    def pending(self) -> int:
+        """缓冲区中尚未组成完整帧的字节数"""
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> list:
+        r"""
+        喂入新收到的数据
+        :param data: 从连接中读取到的原始数据
+        :return: 本次解析出的完整帧列表
+        """
+        if not data:
+            return []
+        if self._buffer:
+            self._buffer += data
+            source = self._buffer
+        else:
+            # 缓冲区为空时直接在新数据上解析, 省去一次拷贝
+            source = data
+        frames = []
+        offset = 0
+        with memoryview(source) as view:
+            while True:
+                result = self._parse_frame(view, offset)
+                if result is None:
+                    break
+                frame, offset = result
+                frames.append(frame)
+        # 保留不完整的帧等待后续数据
+        if source is self._buffer:
+            del self._buffer[:offset]
+        elif offset < len(data):
+            self._buffer += data[offset:]
+        return frames
+
+    def _check_body_length(self, body_length: int):
+        if self.max_body_size is not None and body_length > self.max_body_size:
+            raise FrameError(f"Body too large: {body_length} > {self.max_body_size}")
+
+    @abc.abstractmethod
+    def _parse_frame(self, view: memoryview, offset: int) -> tuple | None:
+        r"""
+        从offset处解析一帧
+        :return: (帧, 下一帧的offset), 数据不足时返回None
+        """
+
+
+class RequestDecoder(FrameDecoder):
+    r"""
+    请求帧解码器: [类型长度(1字节)][类型][请求体长度(4字节)][请求体]
+    解析结果为 (类型原始字节, 请求体)
+    """
+
+    def _parse_frame(self, view: memoryview, offset: int) -> tuple | None:
+        size = len(view)
+        if size - offset < 1:
+            return None
+        type_start = offset + 1
+        body_start = type_start + view[offset] + 4
+        if size < body_start:
+            return None
+        body_length = _UINT32.unpack_from(view, body_start - 4)[0]
+        self._check_body_length(body_length)
+        body_end = body_start + body_length
+        if size < body_end:
+            return None
+        return (bytes(view[type_start:body_start - 4]), bytes(view[body_start:body_end])), body_end
+
+
+class ResponseDecoder(FrameDecoder):
+    r"""
+    响应帧解码器: [状态(1字节)][响应体长度(4字节)][响应体]
+    解析结果为 (状态, 响应体)
+    """
+
+    def _parse_frame(self, view: memoryview, offset: int) -> tuple | None:
+        size = len(view)
+        body_start = offset + 5
+        if size < body_start:
+            return None
+        status, body_length = RESPONSE_HEADER.unpack_from(view, offset)
+        self._check_body_length(body_length)
+        body_end = body_start + body_length
+        if size < body_end:
+            return None
+        return (status, bytes(view[body_start:body_end])), body_end
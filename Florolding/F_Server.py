@@ -1,16 +1,52 @@
 import asyncio
+import collections
+import math
 import struct
 import json
+import logging
 import re
+import socket
+import time
+from . import F_Frame, TimerWheel, Metrics, RateLimit, PeerTable
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_TYPE_PATTERN = re.compile(r"^[a-z0-9_]+:[a-z0-9_]+$")
+
+
+class Connection:
+    r"""
+    单个客户端连接的上下文, 作为needs_connection处理器的第二个参数
+    同时缓存该连接上已验证过的协议名, 相同的类型字节只解码与匹配一次
+    """
+
+    __slots__ = ("writer", "address", "protocol_types", "bucket", "high_water")
+
+    # 每个连接最多缓存的协议名数量, 避免客户端发送大量不同的名称占用内存
+    MAX_CACHED_TYPES = 64
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        self.protocol_types = {}  # {类型原始字节: 协议名, 无效时为None}
+        self.bucket = None  # 连接级限流令牌桶
+        self.high_water = writer.transport.get_write_buffer_limits()[1]  # 发送缓冲区超过该值时才等待drain
 
 
 class AsyncFloroldingServer:
-    def __init__(self, machine_id: str, easytier_id: int | str, player_name: str = "", server_host: str = "0.0.0.0", server_port: int = 3939, minecraft_port: int | str = 25565):
+    def __init__(self, machine_id: str, easytier_id: int | str, player_name: str = "", server_host: str = "0.0.0.0", server_port: int = 3939, minecraft_port: int | str = 25565, max_body_size: int | None = F_Frame.DEFAULT_MAX_BODY_SIZE, read_size: int = 65536, player_timeout: float | None = 15, sweep_interval: float = 1, change_log_size: int = 1024, metrics: Metrics.MetricsRegistry | None = None,
+                 max_connections: int | None = None, idle_timeout: float | None = None, rate_limit: float | None = None, rate_burst: float | None = None,
+                 player_rate_limit: float | None = None, player_rate_burst: float | None = None, write_high_water: int | None = None,
+                 peer_table: PeerTable.PeerTable | None = None):
         player_name = player_name if player_name !=0 and not player_name.isspace() else f"Player_{machine_id}"
         self.server_host = server_host
         self.server_port = server_port
         self.minecraft_port = minecraft_port
         self.server = None
+        self.machine_id = machine_id  # 房主的machine_id
+        self.max_body_size = max_body_size  # 单个请求体的最大长度, None表示不限制
+        self.read_size = read_size  # 每次从连接读取的最大字节数
+        self.metrics = metrics if metrics is not None else Metrics.MetricsRegistry()  # 可由多个服务器共享
 
         self.players = {
             machine_id: {
@@ -22,30 +58,112 @@ class AsyncFloroldingServer:
             }
         }  # {machine_id: player_info}
         self.machine_ids = {}  # {writer: machine_id}
+        self.writers = {}  # {machine_id: writer}
+        self.connections = set()  # 所有连接的writer
+
+        # 连接数、空闲与限流保护
+        self.max_connections = max_connections  # 最大同时连接数, 超出时新连接会被立即关闭, None表示不限制
+        self.idle_timeout = idle_timeout  # 连接超过该时间(秒)没有发送任何数据时关闭, None表示不限制
+        self.rate_limit = rate_limit  # 每个连接每秒允许的请求数, None表示不限制
+        self.rate_burst = rate_burst  # 每个连接允许的突发请求数, 默认等于rate_limit
+        self.player_rate_limit = player_rate_limit  # 每个machine_id每秒允许的请求数, 同一玩家的多个连接共享
+        self.player_rate_burst = player_rate_burst  # 每个machine_id允许的突发请求数, 默认等于player_rate_limit
+        self.write_high_water = write_high_water  # 发送缓冲区高水位(字节), 超过后才等待drain, None使用asyncio默认值
+        self.player_buckets = {}  # {machine_id: TokenBucket}
+        self.idle_wheel = TimerWheel.TimerWheel(sweep_interval, math.ceil((idle_timeout or 0) / sweep_interval) + 1)  # 以Connection为key
+
+        # 玩家列表的代数与预编码缓存, 玩家加入、离开或资料变化时代数加一并使缓存失效
+        self.players_generation = 0
+        self.__profiles_cache = None
+        self.__versioned_profiles_cache = None  # (代数, f:player_profiles_list响应体)
+        # 最近的玩家变化记录 (代数, machine_id, 变化类型), 用于计算增量
+        self.players_changes = collections.deque(maxlen=change_log_size)
+
+        # 心跳超时检测, 超过player_timeout秒未收到c:player_ping的玩家会被移除
+        self.player_timeout = player_timeout  # None表示只在连接断开时移除玩家
+        self.sweep_interval = sweep_interval
+        self.last_seen = {}  # {machine_id: 最后一次心跳的时间}
+        self.expiry_wheel = TimerWheel.TimerWheel(sweep_interval, math.ceil((player_timeout or 0) / sweep_interval) + 1)
+        self.expiry_listeners = []  # 玩家超时回调 callback(machine_id, player_info)
+        self.sweep_task = None
+
+        # EasyTier节点表, 用于c:player_easytier_id与玩家存活交叉检查; 由调用方负责启动刷新, 可由多个服务器共享
+        self.peer_table = peer_table
 
         self.lock = asyncio.Lock()  # 异步锁
 
-        # 支持的协议列表
-        self.supported_protocols = [
-            "c:ping",
-            "c:protocols",
-            "c:server_port",
-            "c:player_easytier_id",
-            "c:player_ping",
-            "c:player_profiles_list"
-        ]
-        # 协议处理器映射
-        self.protocol_handlers = {
-            "c:ping": self.__c_ping,
-            "c:protocols": self.__c_protocols,
-            "c:server_port": self.__c_server_port,
-            "c:player_ping": self.__c_player_ping,
-            "c:player_profiles_list": self.__c_player_profiles_list
-        }
+        # 协议处理器映射 {协议名: (处理器, 是否需要连接上下文)}
+        self.protocol_handlers = {}
+        self.register_handler("c:ping", self.__c_ping)
+        self.register_handler("c:protocols", self.__c_protocols)
+        self.register_handler("c:server_port", self.__c_server_port)
+        self.register_handler("c:player_ping", self.__c_player_ping, needs_connection=True)
+        self.register_handler("c:player_profiles_list", self.__c_player_profiles_list)
+        self.register_handler("f:player_profiles_list", self.__f_player_profiles_list)
+        self.register_handler("f:player_profiles_delta", self.__f_player_profiles_delta)
+        self.register_handler("f:player_timeout", self.__f_player_timeout)
+        if peer_table is not None:
+            self.register_handler("c:player_easytier_id", self.__c_player_easytier_id, needs_connection=True)
+
+    @property
+    def supported_protocols(self) -> list:
+        """支持的协议列表, 由已注册的处理器决定"""
+        return list(self.protocol_handlers)
+
+    def register_handler(self, protocol_type: str, handler, needs_connection: bool = False):
+        r"""
+        注册协议处理器, 同名处理器会被替换
+        :param protocol_type: 协议名, 格式为"命名空间:名称", 例如"f:my_extension"
+        :param handler: handler(request_body) 或 handler(request_body, connection), 返回(状态, 响应体), 可以是普通函数或协程函数
+        :param needs_connection: 是否需要传入连接上下文Connection
+        """
+        if not PROTOCOL_TYPE_PATTERN.match(protocol_type) or len(protocol_type) > 255:
+            raise ValueError(f"无效的协议名: {protocol_type}")
+        self.protocol_handlers[protocol_type] = (handler, needs_connection)
+
+    def unregister_handler(self, protocol_type: str) -> bool:
+        r"""
+        移除协议处理器
+        :return: 处理器是否存在
+        """
+        return self.protocol_handlers.pop(protocol_type, None) is not None
+
+    def handler(self, protocol_type: str, needs_connection: bool = False):
+        r"""
+        注册协议处理器的装饰器
+        用法:
+            @server.handler("f:my_extension")
+            async def my_extension(request_body):
+                return 0, b""
+        """
+        def decorator(func):
+            self.register_handler(protocol_type, func, needs_connection)
+            return func
+
+        return decorator
 
     def set_minecraft_port(self, minecraft_port: int | str):
         self.minecraft_port = minecraft_port
 
+    def set_easytier_id(self, easytier_id: int | str):
+        """更新房主的EasyTier节点ID, 通常在EasyTier启动完成后才能得知"""
+        host = self.players.get(self.machine_id)
+        if host is not None and host.get("easytier_id") != easytier_id:
+            # 替换而不是原地修改, 已发出的增量中的旧对象保持不变
+            self.players[self.machine_id] = dict(host, easytier_id=easytier_id)
+            self.__players_changed(self.machine_id, "update")
+
+    def add_expiry_listener(self, callback):
+        r"""
+        注册玩家心跳超时回调
+        :param callback: callback(machine_id, player_info), 可以是普通函数或协程函数
+        """
+        self.expiry_listeners.append(callback)
+
+    def remove_expiry_listener(self, callback):
+        if callback in self.expiry_listeners:
+            self.expiry_listeners.remove(callback)
+
     @staticmethod
     async def __c_ping(request_body: bytes) -> tuple:
         return 0, request_body  # 返回相同的请求体
@@ -67,7 +185,8 @@ class AsyncFloroldingServer:
     async def __c_server_port(self, request_body: bytes) -> tuple:
         return 0, struct.pack(">H", self.minecraft_port)
 
-    async def __c_player_ping(self, request_body: bytes, writer: asyncio.StreamWriter) -> tuple:
+    async def __c_player_ping(self, request_body: bytes, connection: Connection) -> tuple:
+        writer = connection.writer
         try:
             # 解析JSON请求体
             player_data = json.loads(request_body.decode("utf-8"))
@@ -75,24 +194,177 @@ class AsyncFloroldingServer:
                 return 255, b"Missing required fields"
             machine_id = player_data.get("machine_id")
             async with self.lock:
-                if writer not in self.machine_ids:
+                bound = self.machine_ids.get(writer)
+                if bound is None:
+                    error = self.__claim_error(machine_id, connection)
+                    if error is not None:
+                        self.metrics.inc("player_ping_rejected")
+                        return 255, error
+                    previous = self.writers.get(machine_id)
+                    if previous is not None:
+                        # 同一地址重连时接管玩家, 旧连接不再有用
+                        previous.close()
                     self.machine_ids.update({writer: machine_id})
-                if machine_id not in self.players:
-                    player_data.update({"kind": "GUEST"})
+                    self.writers.update({machine_id: writer})
+                elif bound != machine_id:
+                    # 连接只能代表第一次心跳登记的玩家, 否则可以替其他玩家续期
+                    self.metrics.inc("player_ping_rejected")
+                    return 255, b"machine_id cannot change on a connection"
+                player_data.update({"kind": "GUEST"})
+                current = self.players.get(machine_id)
+                if current is None or (current.get("kind") == "GUEST" and current != player_data):
+                    # 新玩家加入或玩家资料发生变化
                     self.players.update({machine_id: player_data})
+                    self.__players_changed(machine_id, "join" if current is None else "update")
+                # 记录心跳时间并续期
+                self.last_seen[machine_id] = time.monotonic()
+                if self.player_timeout is not None:
+                    self.expiry_wheel.schedule(machine_id, self.player_timeout)
             return 0, b""
         except (json.JSONDecodeError, UnicodeDecodeError) as e:
             return 255, f"Invalid JSON format: {e}".encode("utf-8")
 
+    def __claim_error(self, machine_id, connection: Connection) -> bytes | None:
+        r"""
+        检查新连接能否登记machine_id
+        房主的machine_id不能被房客使用; 已属于其他未关闭连接的machine_id只允许来自同一地址的连接接管(断线重连),
+        否则房客可以冒用他人的machine_id使其被移除
+        :return: 拒绝原因, 允许时返回None
+        """
+        if not isinstance(machine_id, str) or not machine_id:
+            return b"Invalid machine_id"
+        if machine_id == self.machine_id:
+            return b"machine_id belongs to the host"
+        owner = self.writers.get(machine_id)
+        if owner is None or owner.is_closing():
+            return None
+        owner_address = owner.get_extra_info("peername")
+        if owner_address and connection.address and owner_address[0] == connection.address[0]:
+            return None
+        return b"machine_id is in use by another connection"
+
     async def __c_player_profiles_list(self, request_body: bytes) -> tuple:
         try:
-            # 构建玩家列表
-            async with self.lock:
-                print(self.players)
-                return 0, json.dumps(list(self.players.values())).encode("utf-8")
+            return 0, self.player_profiles_snapshot()
+        except Exception as e:
+            return 255, f"Error generating player list: {str(e)}".encode("utf-8")
+
+    async def __f_player_profiles_list(self, request_body: bytes) -> tuple:
+        r"""
+        带代数的玩家列表
+        请求体: 空, 或客户端已知的代数(uint64)
+        响应体: [当前代数(uint64)][玩家列表JSON], 代数与请求一致时只返回当前代数
+        """
+        try:
+            generation = self.players_generation
+            if len(request_body) == 8 and struct.unpack(">Q", request_body)[0] == generation:
+                return 0, struct.pack(">Q", generation)
+            if self.__versioned_profiles_cache is None or self.__versioned_profiles_cache[0] != generation:
+                # 带代数的响应体同样每代只拼接一次
+                self.__versioned_profiles_cache = (generation, struct.pack(">Q", generation) + self.player_profiles_snapshot())
+            return 0, self.__versioned_profiles_cache[1]
         except Exception as e:
             return 255, f"Error generating player list: {str(e)}".encode("utf-8")
 
+    async def __f_player_profiles_delta(self, request_body: bytes) -> tuple:
+        r"""
+        玩家列表增量
+        请求体: 客户端已知的代数(uint64), 空请求体视为从未同步
+        响应体: {"generation": 当前代数, "reset": 是否需要清空本地列表, "added": [玩家], "updated": [玩家], "removed": [machine_id]}
+        """
+        if request_body and len(request_body) != 8:
+            return 255, b"Invalid generation"
+        since = struct.unpack(">Q", request_body)[0] if request_body else None
+        return 0, json.dumps(self.player_profiles_delta(since)).encode("utf-8")
+
+    async def __c_player_easytier_id(self, request_body: bytes, connection: Connection) -> tuple:
+        r"""
+        查询玩家的EasyTier节点ID, 只读取节点表缓存, 不启动easytier-cli
+        请求体: 玩家的machine_id, 为空时查询发起请求的连接自身
+        响应体: {"machine_id": machine_id, "easytier_id": 节点ID, "online": 节点是否在EasyTier网络中}
+        """
+        try:
+            machine_id = request_body.decode("utf-8") if request_body else self.machine_ids.get(connection.writer)
+        except UnicodeDecodeError:
+            return 255, b"Invalid machine_id"
+        player_info = self.players.get(machine_id) if machine_id is not None else None
+        peer = None
+        if player_info is not None and player_info.get("easytier_id"):
+            peer = self.peer_table.get(player_info.get("easytier_id"))
+        elif not request_body and connection.address:
+            # 尚未上报easytier_id的连接按来源虚拟IP匹配节点
+            peer = self.peer_table.get_by_ipv4(connection.address[0])
+        if player_info is None and peer is None:
+            return 255, b"Unknown player"
+        easytier_id = peer.get("id") if peer is not None else player_info.get("easytier_id")
+        return 0, json.dumps({"machine_id": machine_id, "easytier_id": easytier_id, "online": peer is not None}).encode("utf-8")
+
+    async def __on_peers_changed(self, changes: dict):
+        """EasyTier节点离开时立即移除对应的房客, 不必等待心跳超时"""
+        removed = {str(peer.get("id")) for peer in changes.get("removed")}
+        if not removed:
+            return
+        lost = [
+            machine_id for machine_id, player_info in self.players.items()
+            if player_info.get("kind") == "GUEST" and str(player_info.get("easytier_id")) in removed
+        ]
+        for machine_id in lost:
+            self.metrics.inc("players_peer_lost")
+            logger.info("玩家的EasyTier节点已离开: %s", machine_id)
+            await self.__expire_player(machine_id)
+
+    async def __f_player_timeout(self, request_body: bytes) -> tuple:
+        r"""
+        心跳超时策略, 客户端据此调整心跳间隔
+        响应体: {"player_timeout": 超时时间(秒), 不检测心跳时为null, "sweep_interval": 检查间隔(秒)}
+        """
+        return 0, json.dumps({"player_timeout": self.player_timeout, "sweep_interval": self.sweep_interval}).encode("utf-8")
+
+    def player_profiles_delta(self, since: int | None) -> dict:
+        r"""
+        计算自since代以来的玩家列表变化, 开销与变化数量成正比
+        :param since: 已知的代数, None或早于变化记录时返回完整列表
+        :return: 增量字典, 格式见f:player_profiles_delta
+        """
+        generation = self.players_generation
+        oldest = self.players_changes[0][0] if self.players_changes else generation + 1
+        if since is None or since > generation or since < oldest - 1:
+            return {"generation": generation, "reset": True, "added": list(self.players.values()), "updated": [], "removed": []}
+        # 从最新的变化向前遍历, 得到每个玩家在since之后的第一次变化
+        first_change = {}
+        for change_generation, machine_id, kind in reversed(self.players_changes):
+            if change_generation <= since:
+                break
+            first_change[machine_id] = kind
+        added, updated, removed = [], [], []
+        for machine_id, kind in first_change.items():
+            player_info = self.players.get(machine_id)
+            if player_info is not None:
+                (added if kind == "join" else updated).append(player_info)
+            elif kind != "join":
+                # 在since之后加入又离开的玩家对客户端不可见
+                removed.append(machine_id)
+        return {"generation": generation, "reset": False, "added": added, "updated": updated, "removed": removed}
+
+    def __players_changed(self, machine_id: str, kind: str):
+        r"""
+        玩家列表发生变化, 使预编码缓存失效并记录变化
+        :param kind: join, update 或 leave
+        """
+        self.players_generation += 1
+        self.__profiles_cache = None
+        self.players_changes.append((self.players_generation, machine_id, kind))
+
+    def player_profiles_snapshot(self) -> bytes:
+        r"""
+        获取预编码的玩家列表
+        只在玩家列表变化后的第一次调用时重新编码, 整个过程没有await, 不需要加锁
+        :return: 玩家列表JSON
+        """
+        if self.__profiles_cache is None:
+            self.__profiles_cache = json.dumps(list(self.players.values())).encode("utf-8")
+        return self.__profiles_cache
+
     async def c_player_profiles_list(self) -> list:
         try:
             # 构建玩家列表
@@ -102,116 +374,240 @@ class AsyncFloroldingServer:
             return []
 
     @staticmethod
-    def __parse_request(data: bytes) -> tuple:
-        """解析TCP请求"""
-        if len(data) < 5:  # 最小长度检查
-            return None, None, 255
+    def __parse_protocol_type(type_bytes: bytes, connection: Connection) -> str | None:
+        """解析并验证请求类型, 结果缓存在连接上"""
         try:
-            # 读取请求类型长度 (uint8)
-            type_length = struct.unpack(">B", data[0:1])[0]
-            # 检查数据长度是否足够
-            if len(data) < 1 + type_length + 4:
-                return None, None, 255
-            # 读取请求类型 (ASCII字符串)
-            protocol_type = data[1:1 + type_length].decode("ascii")
-            # 验证协议格式
-            if not bool(re.match(r"^[a-z0-9_]+:[a-z0-9_]+$", protocol_type)):
-                return None, None, 255
-            # 读取请求体长度 (uint32)
-            body_length = struct.unpack(">I", data[1 + type_length:5 + type_length])[0]
-            # 检查请求体长度是否匹配
-            if len(data) < 5 + type_length + body_length:
-                return None, None, 255
-            # 读取请求体
-            request_body = data[5 + type_length:5 + type_length + body_length]
-            return protocol_type, request_body, 0
-        except (struct.error, UnicodeDecodeError, ValueError):
-            return None, None, 255
-
-    @staticmethod
-    def __create_response(status: int, response_body: bytes = b"") -> bytes:
-        """构建请求体"""
-        body_length = len(response_body)
-        # 构建响应: [状态(1字节)][响应体长度(4字节)][响应体]
-        response = struct.pack(">B", status)  # 状态
-        response += struct.pack(">I", body_length)  # 响应体长度
-        response += response_body  # 响应体
-        return response
+            return connection.protocol_types[type_bytes]
+        except KeyError:
+            pass
+        try:
+            protocol_type = type_bytes.decode("ascii")
+        except UnicodeDecodeError:
+            protocol_type = None
+        # 验证协议格式
+        if protocol_type is not None and not PROTOCOL_TYPE_PATTERN.match(protocol_type):
+            protocol_type = None
+        if len(connection.protocol_types) < Connection.MAX_CACHED_TYPES:
+            connection.protocol_types[type_bytes] = protocol_type
+        return protocol_type
 
     async def __remove_player(self, writer: asyncio.StreamWriter):
         """移除玩家"""
         async with self.lock:
             if writer in self.machine_ids:
                 machine_id = self.machine_ids.pop(writer)
-                if machine_id in self.players:
-                    self.players.pop(machine_id)
+                if self.writers.get(machine_id) is writer:
+                    self.writers.pop(machine_id)
+                    self.last_seen.pop(machine_id, None)
+                    self.expiry_wheel.cancel(machine_id)
+                    self.player_buckets.pop(machine_id, None)
+                    # 同一玩家已通过新连接发送过心跳时, 旧连接关闭不影响玩家列表
+                    if machine_id in self.players:
+                        self.players.pop(machine_id)
+                        self.__players_changed(machine_id, "leave")
+
+    async def __expire_player(self, machine_id: str):
+        """移除心跳超时的玩家并关闭其连接"""
+        async with self.lock:
+            player_info = self.players.pop(machine_id, None)
+            if player_info is not None:
+                self.__players_changed(machine_id, "leave")
+            self.last_seen.pop(machine_id, None)
+            self.player_buckets.pop(machine_id, None)
+            writer = self.writers.pop(machine_id, None)
+            if writer is not None:
+                self.machine_ids.pop(writer, None)
+        if writer is not None:
+            # 半开连接不会再有数据, 主动关闭以结束对应的处理协程
+            writer.close()
+        if player_info is None:
+            return
+        self.metrics.inc("players_expired")
+        logger.info("玩家心跳超时: %s", machine_id)
+        for callback in list(self.expiry_listeners):
+            try:
+                result = callback(machine_id, player_info)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception("超时回调异常")
+
+    async def __sweep_loop(self):
+        """定时推进时间轮, 只处理到期的玩家与空闲连接"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            for machine_id in self.expiry_wheel.advance():
+                await self.__expire_player(machine_id)
+            for connection in self.idle_wheel.advance():
+                self.metrics.inc("idle_timeouts")
+                logger.info("连接空闲超时: %s", connection.address)
+                connection.writer.close()
+
+    def __rate_limited(self, connection: Connection) -> bool:
+        """请求是否超出连接或玩家的限流"""
+        if connection.bucket is not None and not connection.bucket.consume():
+            self.metrics.inc("rate_limited_connection")
+            return True
+        if self.player_rate_limit is not None:
+            machine_id = self.machine_ids.get(connection.writer)
+            if machine_id is not None:
+                bucket = self.player_buckets.get(machine_id)
+                if bucket is None:
+                    bucket = self.player_buckets[machine_id] = RateLimit.TokenBucket(self.player_rate_limit, self.player_rate_burst)
+                if not bucket.consume():
+                    self.metrics.inc("rate_limited_player")
+                    return True
+        return False
 
     async def __handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        address = writer.get_extra_info("peername")
-        print("新的连接:", address)
+        if self.max_connections is not None and len(self.connections) >= self.max_connections:
+            # 超出连接数上限, 直接关闭
+            self.metrics.inc("connections_rejected")
+            logger.warning("连接数已达上限, 拒绝连接: %s", writer.get_extra_info("peername"))
+            writer.close()
+            return
+        if self.write_high_water is not None:
+            writer.transport.set_write_buffer_limits(high=self.write_high_water)
+        connection = Connection(writer)
+        if self.rate_limit is not None:
+            connection.bucket = RateLimit.TokenBucket(self.rate_limit, self.rate_burst)
+        address = connection.address
+        logger.info("新的连接: %s", address)
+        self.metrics.inc("connections_total")
+        self.metrics.inc("connections_active")
+        self.connections.add(writer)
+        decoder = F_Frame.RequestDecoder(self.max_body_size)
         try:
             while True:
-                data = await reader.read(4096)
+                if self.idle_timeout is not None:
+                    self.idle_wheel.schedule(connection, self.idle_timeout)
+                data = await reader.read(self.read_size)
                 if not data: break
-                protocol_type, request_body, parse_status = self.__parse_request(data)
-                if parse_status != 0:
-                    # 解析错误
-                    error_msg = f"Parse error: {parse_status}".encode("utf-8")
-                    writer.write(self.__create_response(255, error_msg))
+                try:
+                    frames = decoder.feed(data)
+                except F_Frame.FrameError as e:
+                    # 帧长度非法, 字节流已无法同步, 回复错误后关闭连接
+                    self.metrics.inc("parse_errors")
+                    F_Frame.write_frames(writer, F_Frame.encode_response(255, f"Parse error: {e}".encode("utf-8")))
                     await writer.drain()
-                    continue
-                print(self.machine_ids.get(writer), "调用:", protocol_type)
-                if protocol_type in self.protocol_handlers:
-                    if protocol_type == "c:player_ping":
-                        # 特殊处理玩家心跳，需要传入writer
-                        status, response_body = await self.protocol_handlers[protocol_type](request_body, writer)
+                    break
+                # 同一批次的响应分段一起发送, 响应体不再拼接拷贝
+                chunks = []
+                for type_bytes, request_body in frames:
+                    protocol_type = self.__parse_protocol_type(type_bytes, connection)
+                    if protocol_type is None:
+                        # 解析错误
+                        self.metrics.inc("parse_errors")
+                        chunks.extend(F_Frame.encode_response(255, b"Parse error: 255"))
+                        continue
+                    start = time.perf_counter()
+                    entry = self.protocol_handlers.get(protocol_type)
+                    if self.__rate_limited(connection):
+                        status, response_body = 255, b"Rate limited"
+                    elif entry is not None:
+                        handler, needs_connection = entry
+                        try:
+                            result = handler(request_body, connection) if needs_connection else handler(request_body)
+                            if asyncio.iscoroutine(result):
+                                result = await result
+                            status, response_body = result
+                        except Exception:
+                            # 处理器异常只影响本次请求, 连接继续可用
+                            logger.exception("处理协议 %s 时出现异常", protocol_type)
+                            status, response_body = 255, f"Internal error: {protocol_type}".encode("utf-8")
                     else:
-                        status, response_body = await self.protocol_handlers[protocol_type](request_body)
-                    response = self.__create_response(status, response_body)
-                else:
-                    # 不支持的协议
-                    error_msg = f"Unsupported protocol: {protocol_type}".encode("utf-8")
-                    response = self.__create_response(255, error_msg)
+                        # 不支持的协议
+                        status, response_body = 255, f"Unsupported protocol: {protocol_type}".encode("utf-8")
+                    chunks.extend(F_Frame.encode_response(status, response_body))
+                    response_size = F_Frame.RESPONSE_HEADER.size + len(response_body)
+                    # 不支持的协议统一计入unsupported, 避免任意协议名使指标无限增长
+                    self.metrics.observe_request(
+                        protocol_type if entry is not None else "unsupported",
+                        5 + len(type_bytes) + len(request_body), response_size,
+                        time.perf_counter() - start, status != 0
+                    )
+                    logger.debug("%s 调用: %s, 响应长度: %d", self.machine_ids.get(writer), protocol_type, response_size)
                 # 发送响应
-                print("响应长度:", len(response))
-                writer.write(response)
-                await writer.drain()
+                F_Frame.write_frames(writer, chunks)
+                if writer.transport.is_closing():
+                    break
+                # 发送缓冲区超过高水位时才等待drain, 让读取慢的客户端只拖慢自己
+                if writer.transport.get_write_buffer_size() > connection.high_water:
+                    self.metrics.inc("drain_waits")
+                    await writer.drain()
         except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
             # 客户端断开连接
             pass
-        except Exception as e:
-            print("异常:", e)
+        except Exception:
+            logger.exception("处理连接 %s 时出现异常", address)
         finally:
             # 客户端断开连接，立即移除相关玩家
+            self.metrics.inc("connections_active", -1)
+            self.connections.discard(writer)
+            self.idle_wheel.cancel(connection)
             await self.__remove_player(writer)
             writer.close()
             await writer.wait_closed()
-            print(f"连接关闭:", address)
+            logger.info("连接关闭: %s", address)
 
-    async def start(self):
-        """启动Florolding TCP服务器, 基于Scaffolding协议"""
-        self.server = await asyncio.start_server(
-            self.__handle_client,
-            self.server_host,
-            self.server_port
-        )
+    async def listen(self, sock: socket.socket | None = None):
+        r"""
+        绑定端口并开始接受连接, 不阻塞
+        :param sock: 已绑定的套接字(例如PortAllocator分配的), 传入时忽略server_host与server_port
+        """
+        if sock is not None:
+            self.server = await asyncio.start_server(self.__handle_client, sock=sock)
+            self.server_host, self.server_port = sock.getsockname()[:2]
+        else:
+            self.server = await asyncio.start_server(
+                self.__handle_client,
+                self.server_host,
+                self.server_port
+            )
+        if not self.server_port:
+            # 端口为0时由系统分配, 记录实际端口
+            self.server_port = self.server.sockets[0].getsockname()[1]
 
-        print(f"异步TCP服务器启动在 {self.server_host}:{self.server_port}")
-        print(f"支持的协议: {', '.join(self.supported_protocols)}")
-        print(f"Minecraft服务器端口: {self.minecraft_port}")
+        logger.info("异步TCP服务器启动在 %s:%s", self.server_host, self.server_port)
+        logger.info("支持的协议: %s", ", ".join(self.supported_protocols))
+        logger.info("Minecraft服务器端口: %s", self.minecraft_port)
 
+        if self.player_timeout is not None or self.idle_timeout is not None:
+            self.sweep_task = asyncio.create_task(self.__sweep_loop())
+        if self.peer_table is not None:
+            self.peer_table.add_listener(self.__on_peers_changed)
+
+    async def start(self, sock: socket.socket | None = None):
+        r"""
+        启动Florolding TCP服务器, 基于Scaffolding协议
+        :param sock: 已绑定的套接字, 见listen
+        """
+        await self.listen(sock)
         try:
             async with self.server:
                 await self.server.serve_forever()
         except asyncio.exceptions.CancelledError:
             pass
+        finally:
+            self.__stop_sweep()
+
+    def __stop_sweep(self):
+        if self.sweep_task and not self.sweep_task.done():
+            self.sweep_task.cancel()
+        self.sweep_task = None
 
     async def stop(self):
         """停止Florolding TCP服务器"""
+        self.__stop_sweep()
+        if self.peer_table is not None:
+            self.peer_table.remove_listener(self.__on_peers_changed)
         if self.server:
             self.server.close()
+            # 关闭仍然存在的连接, 否则wait_closed会一直等待
+            for writer in list(self.connections):
+                writer.close()
             await self.server.wait_closed()
-        print("服务器已停止")
+        logger.info("服务器已停止")
 
     async def __aenter__(self):
         return self
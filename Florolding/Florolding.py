@@ -1,28 +1,40 @@
-from . import Scaffolding, F_Server, F_Client
+from . import Scaffolding, F_Server, F_Client, PortAllocator, PeerTable, Relay, Supervisor
 import atexit
 import json
 import os.path
+import struct
 import subprocess
-import random
-import socket
 import asyncio
+import time
 
 
 class EasyTier:
     def __init__(self):
         self.process = None
 
-    def launch_easytier(self, et_core_path: str, code: str, become_host: bool = False, server_port: int | str = 3939, nodes: list | None = None, minecraft_port: int | str = 25565):
-        if not Scaffolding.validate_code(code):
-            return
+    @staticmethod
+    def build_params(et_core_path: str, code: str, become_host: bool = False, server_port: int | str = 3939, nodes: list | None = None, minecraft_port: int | str = 25565, tun: bool = False, socks5_port: int | str | None = None) -> list:
+        r"""
+        构建easytier-core启动参数
+        :param tun: 是否创建TUN虚拟网卡, 创建后本机可以直接访问其他节点的虚拟IP(需要管理员权限与TUN驱动); 默认不创建, 通过easytier-cli port-forward访问
+        :param socks5_port: 在该端口开启EasyTier的SOCKS5代理, 不创建TUN虚拟网卡也能经由代理访问其他节点的虚拟IP
+        """
+        room_code = Scaffolding.parse_code(code)
+        if room_code is None:
+            raise ValueError(f"无效的房间码: {code}")
         nodes = [
             "tcp://public.easytier.cn:11010"
         ] if nodes is None else nodes
         et_params = [
-            et_core_path, "--no-tun", "--multi-thread", "--latency-first", "--enable-kcp-proxy", "-d",
-            "--network-name", f"scaffolding-mc-{code[2:11]}",
-            "--network-secret", code[12:21]
+            et_core_path, "--multi-thread", "--latency-first", "--enable-kcp-proxy", "-d",
+            "--network-name", room_code.network_name,
+            "--network-secret", room_code.network_secret
         ]
+        if not tun:
+            et_params.insert(1, "--no-tun")
+        if socks5_port is not None:
+            et_params.append("--socks5")
+            et_params.append(str(socks5_port))
         if become_host:
             et_params.append("--hostname")
             et_params.append(f"scaffolding-mc-server-{server_port}")
@@ -35,6 +47,12 @@ class EasyTier:
         for a_node in nodes:
             et_params.append("-p")
             et_params.append(a_node)
+        return et_params
+
+    def launch_easytier(self, et_core_path: str, code: str, become_host: bool = False, server_port: int | str = 3939, nodes: list | None = None, minecraft_port: int | str = 25565, tun: bool = False, socks5_port: int | str | None = None):
+        if not Scaffolding.validate_code(code):
+            return
+        et_params = self.build_params(et_core_path, code, become_host, server_port, nodes, minecraft_port, tun, socks5_port)
         # EasyTier, Launch!
         self.process = subprocess.Popen(et_params, encoding="utf-8")
         # 注册清理函数，确保程序退出时终止子进程
@@ -70,26 +88,161 @@ class EasyTier:
         except json.JSONDecodeError:
             return []
 
+    @staticmethod
+    async def async_easytier_peer(et_cli_path: str, timeout: float | None = None) -> list:
+        r"""
+        异步获取EasyTier节点列表, 不阻塞事件循环
+        :param et_cli_path: easytier-cli路径
+        :param timeout: easytier-cli最长运行时间(秒), 超时返回空列表
+        :return: 节点列表
+        """
+        try:
+            process = await asyncio.create_subprocess_exec(
+                et_cli_path, "-o", "json", "peer",
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError:
+            return []
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            # 超时或被取消时不留下easytier-cli进程
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        try:
+            return json.loads(stdout.decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return []
+
+    @staticmethod
+    def find_room_host(peers: list) -> tuple | None:
+        r"""
+        从节点列表中找出联机中心与本机
+        :param peers: easytier-cli peer 的解析结果
+        :return: (联机中心虚拟IP, 联机中心端口, 本机easytier_id), 任一未出现时返回None
+        """
+        virtual_ip = ""
+        server_port = 0
+        easytier_id = None
+        for get_peer in peers:
+            hostname = get_peer.get("hostname") or ""
+            if hostname.startswith("scaffolding-mc-server-"):
+                try:
+                    server_port = int(hostname.replace("scaffolding-mc-server-", ""))
+                except ValueError:
+                    continue
+                # ipv4可能带有前缀长度, 例如10.126.126.1/24
+                virtual_ip = (get_peer.get("ipv4") or "").split("/", 1)[0]
+            if get_peer.get("cost") == "Local":
+                easytier_id = get_peer.get("id")
+        if not virtual_ip or server_port == 0 or easytier_id is None:
+            return None
+        return virtual_ip, server_port, easytier_id
+
+    @staticmethod
+    async def discover_room_host(et_cli_path: str, timeout: float = 60, initial_interval: float = 0.25, max_interval: float = 4) -> tuple | None:
+        r"""
+        以指数退避轮询EasyTier节点, 联机中心与本机都出现后立即返回
+        :param et_cli_path: easytier-cli路径
+        :param timeout: 总等待时间(秒)
+        :param initial_interval: 首次轮询间隔(秒)
+        :param max_interval: 最大轮询间隔(秒)
+        :return: (联机中心虚拟IP, 联机中心端口, 本机easytier_id), 超时返回None
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = initial_interval
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            room_host = EasyTier.find_room_host(await EasyTier.async_easytier_peer(et_cli_path, remaining))
+            if room_host is not None:
+                return room_host
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
+
+    @staticmethod
+    async def local_easytier_id(et_cli_path: str, timeout: float = 30, initial_interval: float = 0.1, max_interval: float = 2) -> int | None:
+        r"""
+        以指数退避轮询EasyTier节点, 本机节点出现后立即返回其ID
+        :param et_cli_path: easytier-cli路径
+        :param timeout: 总等待时间(秒)
+        :return: 本机easytier_id, 超时返回None
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = initial_interval
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            for get_peer in await EasyTier.async_easytier_peer(et_cli_path, remaining):
+                if get_peer.get("cost") == "Local" and get_peer.get("id") is not None:
+                    return get_peer.get("id")
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
+
     @staticmethod
     def bind_address(et_cli_path: str, local_address: str, virtual_address: str):
         subprocess.run([et_cli_path, "port-forward", "add", "tcp", local_address, virtual_address])
 
-
-def get_available_port():
-    """简单获取可用随机端口"""
-    while True:
-        port = random.randint(1025, 65535)
+    @staticmethod
+    async def async_bind_address(et_cli_path: str, local_address: str, virtual_address: str) -> bool:
+        """异步添加端口转发, 返回easytier-cli是否执行成功"""
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                s.bind(("", port))
-                return port
+            process = await asyncio.create_subprocess_exec(
+                et_cli_path, "port-forward", "add", "tcp", local_address, virtual_address,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
         except OSError:
-            continue
+            return False
+        try:
+            return await process.wait() == 0
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+class StageTimer:
+    r"""
+    记录房间启动各阶段的耗时
+    timings: {阶段: 耗时(秒)}, 另有ready表示从开始到房间可用的总时间
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    async def run(self, stage: str, awaitable):
+        """等待awaitable并记录耗时, 可与其他阶段并发"""
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+
+    def mark(self, stage: str):
+        """记录从开始到现在的时间"""
+        self.timings[stage] = time.perf_counter() - self.started
 
 
-def create_room(easytier_path: str):
-    easytier_path = easytier_path.replace("\\", "/").strip("/")
+def find_easytier(easytier_path: str) -> tuple | None:
+    r"""
+    在目录中查找EasyTier可执行文件
+    :return: (easytier-core路径, easytier-cli路径), 未找到时返回None
+    """
+    easytier_path = easytier_path.replace("\\", "/").rstrip("/")
     et_cli_path = ""
     et_core_path = ""
     if os.path.isdir(easytier_path):
@@ -99,19 +252,204 @@ def create_room(easytier_path: str):
             elif "core" in et_name:
                 et_core_path = f"{easytier_path}/{et_name}"
     if et_cli_path == "" or et_core_path == "":
+        return None
+    return et_core_path, et_cli_path
+
+
+class RoomSession:
+    r"""
+    async_create_room / async_join_room 的结果
+    timings在后台阶段(例如获取easytier_id)完成后继续更新; easytier为守护easytier-core的Supervisor.EasyTierSupervisor
+    """
+
+    __slots__ = ("code", "easytier", "server", "client", "peer_table", "relays", "timings", "tasks")
+
+    def __init__(self, code: str, easytier: "Supervisor.EasyTierSupervisor", timings: dict):
+        self.code = code
+        self.easytier = easytier
+        self.server = None  # 房主的AsyncFloroldingServer
+        self.client = None  # 房客的AsyncFloroldingClient
+        self.peer_table = None  # 房主的EasyTier节点表
+        self.relays = {}  # 房客的进程内转发 {"scaffolding": TcpRelay, "minecraft": TcpRelay}
+        self.timings = timings
+        self.tasks = []  # 后台任务
+
+    async def close(self):
+        """结束后台任务、断开连接并终止EasyTier"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.peer_table is not None:
+            await self.peer_table.stop()
+        if self.client is not None:
+            await self.client.disconnect()
+        await asyncio.gather(*(relay.stop() for relay in self.relays.values()))
+        if self.server is not None:
+            await self.server.stop()
+        await self.easytier.stop()
+
+
+async def async_create_room(easytier_path: str, nodes: list | None = None, player_name: str = "", minecraft_port: int | str = 25565, server_host: str = "0.0.0.0", code: str | None = None, supervisor_options: dict | None = None, **server_options) -> RoomSession | None:
+    r"""
+    异步创建房间, 各阶段尽量并发:
+    查找EasyTier与绑定Scaffolding服务器同时进行, 绑定得到端口后立即启动EasyTier;
+    easytier_id在后台获取, 得知后再更新到玩家列表中, 不阻塞房间可用; 之后由节点表定期刷新, 供c:player_easytier_id与存活检查使用
+    easytier-core由EasyTierSupervisor守护, 崩溃或健康检查失败时自动重启, 重启后重新获取easytier_id
+    :param easytier_path: EasyTier所在目录
+    :param nodes: EasyTier公共节点列表
+    :param code: 房间码, 默认自动生成
+    :param supervisor_options: 传给EasyTierSupervisor的其他参数, 例如health_interval
+    :param server_options: 传给AsyncFloroldingServer的其他参数
+    :return: RoomSession, timings包含 locate, bind, launch, ready, easytier_id; 房间码无效或未找到EasyTier时返回None
+    """
+    code = code or Scaffolding.generate_code()
+    if Scaffolding.parse_code(code) is None:
+        return None
+    timer = StageTimer()
+    peer_table = PeerTable.PeerTable()
+    server = F_Server.AsyncFloroldingServer(Scaffolding.machine_id(), 0, player_name, server_host, 0, minecraft_port, peer_table=peer_table, **server_options)
+    paths, _ = await asyncio.gather(
+        timer.run("locate", asyncio.to_thread(find_easytier, easytier_path)),
+        # 端口为0时由系统分配, 不再需要先探测可用端口
+        timer.run("bind", server.listen())
+    )
+    if paths is None:
+        await server.stop()
+        return None
+    et_core_path, et_cli_path = paths
+    peer_table.et_cli_path = et_cli_path
+    easytier = Supervisor.EasyTierSupervisor(et_core_path, code, True, server.server_port, nodes, minecraft_port, et_cli_path=et_cli_path, **(supervisor_options or {}))
+    try:
+        await timer.run("launch", easytier.start())
+    except BaseException:
+        await server.stop()
+        await peer_table.stop()
+        raise
+    timer.mark("ready")
+    session = RoomSession(code, easytier, timer.timings)
+    session.server = server
+    session.peer_table = peer_table
+
+    async def resolve_easytier_id():
+        easytier_id = await timer.run("easytier_id", EasyTier.local_easytier_id(et_cli_path))
+        if easytier_id is not None:
+            server.set_easytier_id(easytier_id)
+        peer_table.start()
+
+    def on_easytier_event(event: str, info: dict):
+        # 重启后的easytier-core可能使用新的节点ID
+        if event == "started" and easytier.restarts:
+            session.tasks.append(asyncio.create_task(resolve_easytier_id()))
+
+    easytier.add_listener(on_easytier_event)
+    session.tasks.append(asyncio.create_task(resolve_easytier_id()))
+    return session
+
+
+async def async_join_room(easytier_path: str, code: str, nodes: list | None = None, player_name: str = "", discover_timeout: float = 60, relay: bool = False, supervisor_options: dict | None = None, **client_options) -> RoomSession | None:
+    r"""
+    异步加入房间, 各阶段尽量并发:
+    EasyTier启动后轮询联机中心, 同时准备本地转发端口; 找到联机中心后添加转发并连接
+    easytier-core由EasyTierSupervisor守护, 重启后重新添加端口转发
+    :param easytier_path: EasyTier所在目录
+    :param code: 房间码
+    :param nodes: EasyTier公共节点列表
+    :param discover_timeout: 等待联机中心出现的最长时间(秒)
+    :param relay: 使用进程内的Relay.TcpRelay代替easytier-cli port-forward, 并同时转发房主的Minecraft端口,
+                  本地端口见session.relays; 转发经由easytier-core在本机开启的SOCKS5代理访问房主的虚拟IP, 不需要TUN与管理员权限
+    :param supervisor_options: 传给EasyTierSupervisor的其他参数, 例如health_interval
+    :param client_options: 传给AsyncFloroldingClient的其他参数
+    :return: RoomSession, timings包含 locate, launch, discover, forward, connect, ready, 使用relay时另有minecraft_forward;
+             房间码无效、未找到EasyTier或联机中心、easytier-cli添加端口转发失败时返回None
+    """
+    if not Scaffolding.validate_code(code):
+        return None
+    timer = StageTimer()
+    paths = await timer.run("locate", asyncio.to_thread(find_easytier, easytier_path))
+    if paths is None:
+        return None
+    et_core_path, et_cli_path = paths
+    # 进程内转发经由SOCKS5代理连接房主, 重启后的easytier-core沿用同一端口
+    proxy = ("127.0.0.1", await asyncio.to_thread(get_available_port)) if relay else None
+    easytier = Supervisor.EasyTierSupervisor(et_core_path, code, False, 3939, nodes, et_cli_path=et_cli_path, socks5_port=proxy[1] if proxy else None, **(supervisor_options or {}))
+    await timer.run("launch", easytier.start())
+    # 轮询联机中心期间同时选好本地端口; 进程内转发自行绑定端口
+    room_host, local_port = await asyncio.gather(
+        timer.run("discover", EasyTier.discover_room_host(et_cli_path, discover_timeout)),
+        asyncio.sleep(0) if relay else asyncio.to_thread(get_available_port)
+    )
+    if room_host is None:
+        await easytier.stop()
+        return None
+    virtual_ip, server_port, easytier_id = room_host
+    session = RoomSession(code, easytier, timer.timings)
+    if relay:
+        session.relays["scaffolding"] = Relay.TcpRelay(virtual_ip, server_port, proxy=proxy)
+        await timer.run("forward", session.relays["scaffolding"].start())
+        local_port = session.relays["scaffolding"].local_port
+    elif not await timer.run("forward", EasyTier.async_bind_address(et_cli_path, f"127.0.0.1:{local_port}", f"{virtual_ip}:{server_port}")):
+        await session.close()
+        return None
+    else:
+        restore_task = None
+
+        async def restore_forward():
+            # 新进程的RPC就绪前添加会失败, 按指数退避重试
+            delay = 0.25
+            while not await EasyTier.async_bind_address(et_cli_path, f"127.0.0.1:{local_port}", f"{virtual_ip}:{server_port}"):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 4)
+
+        def on_easytier_event(event: str, info: dict):
+            # 端口转发保存在easytier-core进程中, 重启后需要重新添加
+            nonlocal restore_task
+            if event == "started" and easytier.restarts:
+                if restore_task is not None:
+                    restore_task.cancel()
+                restore_task = asyncio.create_task(restore_forward())
+                session.tasks.append(restore_task)
+
+        easytier.add_listener(on_easytier_event)
+    client = F_Client.AsyncFloroldingClient(Scaffolding.machine_id(), easytier_id, player_name, server_port=local_port, **client_options)
+    session.client = client
+    try:
+        await timer.run("connect", client.connect())
+        if relay:
+            status, response_body = await client.send_request("c:server_port")
+            if status == 0 and len(response_body) == 2:
+                session.relays["minecraft"] = Relay.TcpRelay(virtual_ip, struct.unpack(">H", response_body)[0], proxy=proxy)
+                await timer.run("minecraft_forward", session.relays["minecraft"].start())
+    except BaseException:
+        await session.close()
+        raise
+    timer.mark("ready")
+    return session
+
+
+def get_available_port() -> int:
+    r"""
+    获取可用端口, 由系统分配, 不需要随机重试
+    只用于交给其他进程绑定的场景; 本进程内监听请使用PortAllocator分配的套接字, 避免检查与绑定之间被占用
+    """
+    return PortAllocator.PortAllocator("").acquire_port()
+
+
+def create_room(easytier_path: str, nodes: list | None = None):
+    asyncio.run(serve_room(easytier_path, nodes))
+
+
+async def serve_room(easytier_path: str, nodes: list | None = None):
+    session = await async_create_room(easytier_path, nodes, "AEAE")
+    if session is None:
         return
-    easytier = EasyTier()
-    server_port = get_available_port()
-    code = Scaffolding.generate_code()
-    print("房间码:", code)
-    easytier_id = 0
-    easytier.launch_easytier(et_core_path, code, True, server_port)
-    for get_peer in easytier.easytier_peer(et_cli_path):
-        if get_peer.get("hostname") == f"scaffolding-mc-server-{server_port}":
-            easytier_id = get_peer.get("id")
-    # easytier.bind_address(et_cli_path, f"127.0.0.1:{server_port}", f"{virtual_host}:{server_port}")
-    machine_id = Scaffolding.machine_id()
-    asyncio.run(start_server(machine_id, easytier_id, "AEAE", server_port=server_port))
+    print("房间码:", session.code)
+    print("启动耗时:", {stage: f"{seconds:.3f}s" for stage, seconds in session.timings.items()})
+    try:
+        await session.server.server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await session.close()
 
 
 async def start_server(machine_id: str, easytier_id: int | str, player_name: str = "", server_host: str = "0.0.0.0", server_port: int = 3939, minecraft_port: int | str = 25565):
@@ -119,58 +457,32 @@ async def start_server(machine_id: str, easytier_id: int | str, player_name: str
         await server.start()
 
 
-def join_room(easytier_path: str, code: str):
+def join_room(easytier_path: str, code: str, nodes: list | None = None):
     if not Scaffolding.validate_code(code):
         return
-    easytier_path = easytier_path.replace("\\", "/").strip("/")
-    et_cli_path = ""
-    et_core_path = ""
-    if os.path.isdir(easytier_path):
-        for et_name in os.listdir(easytier_path):
-            if "cli" in et_name:
-                et_cli_path = f"{easytier_path}/{et_name}"
-            elif "core" in et_name:
-                et_core_path = f"{easytier_path}/{et_name}"
-    if et_cli_path == "" or et_core_path == "":
-        return
-    easytier = EasyTier()
-    easytier.launch_easytier(et_core_path, code)
-    import time
-    time.sleep(20)
-    virtual_ip = ""
-    server_port = 0
-    easytier_id = 0
-    peer = easytier.easytier_peer(et_cli_path)
-    print(peer)
-    for get_peer in peer:
-        if get_peer.get("hostname").startswith("scaffolding-mc-server-"):
-            server_port = int(get_peer.get("hostname").replace("scaffolding-mc-server-", ""))
-            virtual_ip = get_peer.get("ipv4")
-        if get_peer.get("cost") == "Local":
-            easytier_id = get_peer.get("id")
-    if virtual_ip == "" or server_port == 0:
+    asyncio.run(join_and_run(easytier_path, code, nodes))
+
+
+async def join_and_run(easytier_path: str, code: str, nodes: list | None = None):
+    session = await async_join_room(easytier_path, code, nodes, "AE233")
+    if session is None:
         print("未找到联机中心")
         return
-    get_port = get_available_port()
-    easytier.bind_address(et_cli_path, f"127.0.0.1:{get_port}", f"{virtual_ip}:{server_port}")
-    # time.sleep(5)
-    machine_id = Scaffolding.machine_id()
-    # client = F_Client.AsyncFloroldingClient(machine_id, easytier_id, "AE233", server_port=get_port)
-    # asyncio.run(client.connect())
-    asyncio.run(main(machine_id, easytier_id, get_port))
-
-
-async def main(machine_id, easytier_id, get_port):
-    async with F_Client.AsyncFloroldingClient(machine_id, easytier_id, "AE233", server_port=get_port) as client:
-        # 等待连接稳定
-        await asyncio.sleep(5)
-        await client.c_protocols()
-        # 执行所有操作
-        for _ in range(10):
-            # await client.c_protocols()
-            # await client.c_ping(b"Test connect")
-            await client.c_server_port()
-            # await client.c_player_profiles_list()
-        await client.c_player_profiles_list()
-
-        print("获取端口错误次数:", client.error_num)
+    print("加入耗时:", {stage: f"{seconds:.3f}s" for stage, seconds in session.timings.items()})
+    try:
+        await run_client(session.client)
+    finally:
+        await session.close()
+
+
+async def run_client(client: F_Client.AsyncFloroldingClient):
+    await client.c_protocols()
+    # 执行所有操作
+    for _ in range(10):
+        # await client.c_protocols()
+        # await client.c_ping(b"Test connect")
+        await client.c_server_port()
+        # await client.c_player_profiles_list()
+    await client.c_player_profiles_list()
+
+    print("获取端口错误次数:", client.error_num)
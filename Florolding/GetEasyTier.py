@@ -1,6 +1,11 @@
-import requests
-from urllib3.exceptions import InsecureRequestWarning
-import warnings
+from . import HttpCache
+
+# 节点列表与版本号的缓存有效期(秒)
+NODES_TTL = 600
+VERSION_TTL = 6 * 3600
+
+# 共享的磁盘缓存与连接池, 可替换为自定义的HttpCache实例
+http_cache = HttpCache.HttpCache()
 
 
 def get_easytier_version_list(get_github: bool =False, github_proxy: str ="") -> dict:
@@ -53,11 +58,11 @@ def get_easytier_version(get_github: bool =False, github_proxy: str ="") -> str:
     else:
         github_proxy += "/" if github_proxy != "" and (not github_proxy.endswith("/")) else ""
         try:
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", category=InsecureRequestWarning)
-                return requests.get(f"{github_proxy}https://api.github.com/repos/EasyTier/EasyTier/releases/latest", verify=False).json().get("tag_name").replace("v", "", 1).replace("V", "", 1)
+            release = http_cache.get_json(f"{github_proxy}https://api.github.com/repos/EasyTier/EasyTier/releases/latest", VERSION_TTL, verify=False)
+            return release.get("tag_name").replace("v", "", 1).replace("V", "", 1)
         except Exception:
-            return get_easytier_version()
+            # GitHub不可用时改为从节点状态中获取
+            return get_easytier_version(False)
 
 
 def get_easytier_nodes(number: int =100) -> list:
@@ -66,7 +71,7 @@ def get_easytier_nodes(number: int =100) -> list:
     :param number: 获取EasyTier节点的最大数量
     :return: EasyTier节点列表
     """
-    return requests.get(f"https://uptime.easytier.cn/api/nodes?page=1&per_page={number}").json().get("data").get("items")
+    return http_cache.get_json(f"https://uptime.easytier.cn/api/nodes?page=1&per_page={number}", NODES_TTL).get("data").get("items")
 
 
 def get_easytier_nodes_address(number: int =100) -> dict:
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InsecureRequestWarning
+
+
+def default_cache_dir() -> str:
+    """默认缓存目录: Windows为%LOCALAPPDATA%/Florolding, 其他系统为$XDG_CACHE_HOME/Florolding"""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "Florolding")
+
+
+class HttpCache:
+    r"""
+    带TTL的磁盘JSON缓存
+    过期后先返回旧数据并在后台用ETag/If-Modified-Since重新验证, 网络不可用时继续使用最后一次成功获取的数据
+    """
+
+    def __init__(self, cache_dir: str | None = None, ttl: float = 3600, timeout: float | tuple = (5, 15), stale_while_revalidate: bool = True, session: requests.Session | None = None):
+        r"""
+        :param cache_dir: 缓存目录, 默认使用default_cache_dir()
+        :param ttl: 默认缓存有效期(秒)
+        :param timeout: 请求超时时间, 同requests的timeout参数
+        :param stale_while_revalidate: 过期后是否先返回旧数据再在后台刷新
+        :param session: 复用连接的requests会话, 默认新建
+        """
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.ttl = ttl
+        self.timeout = timeout
+        self.stale_while_revalidate = stale_while_revalidate
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.lock = threading.Lock()
+        self.refreshing = set()  # 正在后台刷新的缓存文件
+
+    def __cache_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32] + ".json")
+
+    @staticmethod
+    def __load(path: str) -> dict | None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry if isinstance(entry, dict) and "data" in entry else None
+        except (OSError, ValueError):
+            return None
+
+    def __store(self, path: str, entry: dict):
+        """原子写入缓存, 写入失败时只放弃缓存"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+
+    def __fetch(self, url: str, path: str, entry: dict | None, verify: bool) -> dict:
+        """发送(条件)请求并更新缓存, 返回新的缓存条目"""
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry.get("etag")
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry.get("last_modified")
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=InsecureRequestWarning)
+            response = self.session.get(url, headers=headers, timeout=self.timeout, verify=verify)
+        if response.status_code == 304 and entry is not None:
+            # 数据未变化, 只刷新时间
+            entry = dict(entry, fetched_at=time.time())
+        else:
+            response.raise_for_status()
+            entry = {
+                "url": url,
+                "fetched_at": time.time(),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "data": response.json()
+            }
+        self.__store(path, entry)
+        return entry
+
+    def __refresh_in_background(self, url: str, path: str, entry: dict, verify: bool):
+        with self.lock:
+            if path in self.refreshing:
+                return
+            self.refreshing.add(path)
+
+        def refresh():
+            try:
+                self.__fetch(url, path, entry, verify)
+            except (requests.RequestException, ValueError):
+                # 离线或源站异常时保留旧数据
+                pass
+            finally:
+                with self.lock:
+                    self.refreshing.discard(path)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def get_json(self, url: str, ttl: float | None = None, verify: bool = True):
+        r"""
+        获取JSON数据, 优先使用缓存
+        :param url: 请求地址
+        :param ttl: 本次使用的缓存有效期(秒), 默认使用self.ttl
+        :param verify: 是否验证HTTPS证书
+        :return: 解析后的JSON数据
+        """
+        ttl = self.ttl if ttl is None else ttl
+        path = self.__cache_path(url)
+        entry = self.__load(path)
+        if entry is not None:
+            if time.time() - entry.get("fetched_at", 0) < ttl:
+                return entry.get("data")
+            if self.stale_while_revalidate:
+                self.__refresh_in_background(url, path, entry, verify)
+                return entry.get("data")
+        try:
+            return self.__fetch(url, path, entry, verify).get("data")
+        except (requests.RequestException, ValueError):
+            if entry is not None:
+                return entry.get("data")
+            raise
+
+    def invalidate(self, url: str):
+        """删除url对应的缓存"""
+        try:
+            os.remove(self.__cache_path(url))
+        except OSError:
+            pass
@@ -0,0 +1,180 @@
+import asyncio
+import bisect
+
+# 默认延迟直方图的桶上界(秒)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """固定桶直方图, observe为O(log 桶数)"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        r"""
+        估算分位数, 返回所在桶的上界
+        :param q: 0~1之间的分位
+        :return: 分位数上界, 没有数据或落在+Inf桶时返回None
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self.buckets[index] if index < len(self.buckets) else None
+        return None
+
+    def snapshot(self) -> dict:
+        return {
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+            "sum": self.sum,
+            "count": self.count
+        }
+
+
+class ProtocolStats:
+    """单个协议类型的统计"""
+
+    __slots__ = ("requests", "errors", "bytes_in", "bytes_out", "handler_time")
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.handler_time = Histogram(buckets)
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "handler_time": self.handler_time.snapshot()
+        }
+
+
+class MetricsRegistry:
+    r"""
+    进程内指标
+    按协议类型统计请求数、错误数、收发字节数与处理耗时, 另有通用计数器
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.protocols = {}  # {protocol_type: ProtocolStats}
+        self.counters = {}  # {name: value}
+
+    def protocol(self, protocol_type: str) -> ProtocolStats:
+        stats = self.protocols.get(protocol_type)
+        if stats is None:
+            stats = self.protocols[protocol_type] = ProtocolStats(self.buckets)
+        return stats
+
+    def observe_request(self, protocol_type: str, bytes_in: int, bytes_out: int, seconds: float, error: bool = False):
+        r"""
+        记录一次请求
+        :param protocol_type: 协议类型
+        :param bytes_in: 请求帧长度
+        :param bytes_out: 响应帧长度
+        :param seconds: 处理耗时(秒)
+        :param error: 是否返回了错误状态
+        """
+        stats = self.protocol(protocol_type)
+        stats.requests += 1
+        stats.bytes_in += bytes_in
+        stats.bytes_out += bytes_out
+        stats.handler_time.observe(seconds)
+        if error:
+            stats.errors += 1
+
+    def inc(self, name: str, value: int | float = 1):
+        """增加通用计数器"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: int | float):
+        """设置通用计量值"""
+        self.counters[name] = value
+
+    def merge(self, snapshot: dict):
+        r"""
+        累加另一个注册表导出的snapshot, 用于汇总多个进程的指标
+        计量值(例如connections_active)同样相加, 即所有进程的总和; 直方图要求使用相同的桶
+        """
+        for name, value in snapshot.get("counters").items():
+            self.inc(name, value)
+        for protocol_type, data in snapshot.get("protocols").items():
+            stats = self.protocol(protocol_type)
+            stats.requests += data.get("requests")
+            stats.errors += data.get("errors")
+            stats.bytes_in += data.get("bytes_in")
+            stats.bytes_out += data.get("bytes_out")
+            histogram = stats.handler_time
+            for index, count in enumerate(data.get("handler_time").get("buckets").values()):
+                histogram.counts[index] += count
+            histogram.sum += data.get("handler_time").get("sum")
+            histogram.count += data.get("handler_time").get("count")
+
+    def snapshot(self) -> dict:
+        """以字典形式导出全部指标"""
+        return {
+            "counters": dict(self.counters),
+            "protocols": {protocol_type: stats.snapshot() for protocol_type, stats in self.protocols.items()}
+        }
+
+    def render_prometheus(self, prefix: str = "florolding") -> str:
+        """导出Prometheus文本格式"""
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{prefix}_{name} {value}")
+        for metric in ("requests", "errors", "bytes_in", "bytes_out"):
+            lines.append(f"# TYPE {prefix}_{metric}_total counter")
+            for protocol_type, stats in sorted(self.protocols.items()):
+                lines.append(f'{prefix}_{metric}_total{{protocol="{protocol_type}"}} {getattr(stats, metric)}')
+        lines.append(f"# TYPE {prefix}_handler_seconds histogram")
+        for protocol_type, stats in sorted(self.protocols.items()):
+            histogram = stats.handler_time
+            cumulative = 0
+            for bound, count in zip([*map(str, histogram.buckets), "+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_handler_seconds_bucket{{protocol="{protocol_type}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_handler_seconds_sum{{protocol="{protocol_type}"}} {histogram.sum}')
+            lines.append(f'{prefix}_handler_seconds_count{{protocol="{protocol_type}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464) -> asyncio.Server:
+    r"""
+    启动Prometheus文本格式的指标HTTP端点, 任意路径都返回全部指标
+    :param registry: 要导出的指标
+    :return: asyncio.Server, 调用close()停止
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # 读取并丢弃请求头
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            body = registry.render_prometheus().encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
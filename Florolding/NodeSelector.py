@@ -0,0 +1,117 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+# EasyTier各协议的默认监听端口
+DEFAULT_PORTS = {
+    "tcp": 11010,
+    "udp": 11010,
+    "wg": 11011,
+    "quic": 11012,
+    "ws": 80,
+    "wss": 443
+}
+# 同一端口上有TCP监听、可以用TCP连接测量延迟的协议; EasyTier节点的udp与tcp监听通常共用端口, wg与quic只监听UDP
+TCP_PROBE_SCHEMES = {"tcp", "udp", "ws", "wss"}
+
+
+def parse_node_address(address: str) -> tuple | None:
+    r"""
+    解析EasyTier节点地址
+    :param address: 例如 tcp://public.easytier.cn:11010
+    :return: (协议, 主机, 端口), 无法解析时返回None
+    """
+    try:
+        parts = urlsplit(address.strip())
+        scheme = parts.scheme.lower()
+        port = parts.port or DEFAULT_PORTS.get(scheme)
+    except (AttributeError, ValueError):
+        return None
+    if not parts.hostname or port is None:
+        return None
+    return scheme, parts.hostname, port
+
+
+async def probe_node(address: str, timeout: float = 2, attempts: int = 2) -> dict:
+    r"""
+    测量单个节点的连接延迟
+    通过连接同一端口的TCP来测量, 只适用于TCP_PROBE_SCHEMES中的协议
+    :param address: 节点地址
+    :param timeout: 单次连接超时时间(秒)
+    :param attempts: 连接次数
+    :return: {"address": 地址, "rtt": 延迟中位数(毫秒)或None, "success": 成功次数, "attempts": 连接次数, "probed": 是否进行了测量}
+    """
+    result = {"address": address, "rtt": None, "success": 0, "attempts": attempts, "probed": False}
+    parsed = parse_node_address(address)
+    if parsed is None:
+        return result
+    scheme, host, port = parsed
+    if scheme not in TCP_PROBE_SCHEMES:
+        # 只监听UDP的协议用TCP测量必然失败, 不测量, 也不应被当作无法连接
+        result["attempts"] = 0
+        return result
+    result["probed"] = True
+    rtts = []
+    for _ in range(attempts):
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            continue
+        rtts.append((time.perf_counter() - start) * 1000)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    if rtts:
+        result["rtt"] = statistics.median(rtts)
+        result["success"] = len(rtts)
+    return result
+
+
+async def rank_nodes(addresses: list, concurrency: int = 16, timeout: float = 2, attempts: int = 2) -> list:
+    r"""
+    并发测量所有节点并按成功率和延迟排序
+    无法用TCP测量的协议(wg, quic)与无法解析的地址不参与排序, 也不出现在结果中
+    :param addresses: 节点地址列表
+    :param concurrency: 同时测量的最大节点数
+    :param timeout: 单次连接超时时间(秒)
+    :param attempts: 每个节点的连接次数
+    :return: probe_node结果列表, 最优节点在前, 无法连接的节点在最后
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def limited_probe(address: str) -> dict:
+        async with semaphore:
+            return await probe_node(address, timeout, attempts)
+
+    results = await asyncio.gather(*(limited_probe(address) for address in dict.fromkeys(addresses)))
+    return sorted((result for result in results if result["probed"]), key=lambda result: (
+        -result["success"] / result["attempts"] if result["attempts"] else 0,
+        result["rtt"] if result["rtt"] is not None else float("inf")
+    ))
+
+
+async def select_nodes(addresses: list, top_k: int = 3, concurrency: int = 16, timeout: float = 2, attempts: int = 2) -> list:
+    r"""
+    选出延迟最低的top_k个节点, 可直接作为EasyTier.launch_easytier的nodes参数
+    :return: 节点地址列表, 全部无法连接时按原顺序返回前top_k个
+    """
+    ranked = await rank_nodes(addresses, concurrency, timeout, attempts)
+    reachable = [result["address"] for result in ranked if result["success"]]
+    return reachable[:top_k] if reachable else list(dict.fromkeys(addresses))[:top_k]
+
+
+async def select_public_nodes(top_k: int = 3, number: int = 100, concurrency: int = 16, timeout: float = 2, attempts: int = 2) -> list:
+    r"""
+    从EasyTier节点状态中获取公共节点并选出延迟最低的top_k个
+    :param number: 获取EasyTier节点的最大数量
+    :return: 节点地址列表
+    """
+    from . import GetEasyTier
+    nodes_address = await asyncio.to_thread(GetEasyTier.get_easytier_nodes_address, number)
+    # 官方节点在前, 延迟相同时优先使用
+    addresses = nodes_address.get("Official") + nodes_address.get("Other")
+    return await select_nodes(addresses, top_k, concurrency, timeout, attempts)
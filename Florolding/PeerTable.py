@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ROOM_HOST_PREFIX = "scaffolding-mc-server-"
+# 判断节点信息是否变化时比较的字段; 延迟、流量、丢包率等每次刷新都会变化, 不视为更新
+TRACKED_FIELDS = ("hostname", "ipv4", "cost", "version")
+
+
+class PeerTable:
+    r"""
+    EasyTier节点表缓存
+    在后台按固定间隔调用easytier-cli刷新, 按节点ID、主机名、虚拟IPv4建立索引, 查询均为O(1)且不启动子进程;
+    节点加入、离开或信息变化时通知订阅者
+    """
+
+    def __init__(self, et_cli_path: str | None = None, refresh_interval: float = 5, timeout: float = 5, fetch=None):
+        r"""
+        :param et_cli_path: easytier-cli路径
+        :param refresh_interval: 刷新间隔(秒)
+        :param timeout: 单次easytier-cli最长运行时间(秒)
+        :param fetch: 获取节点列表的协程函数 fetch() -> list, 默认调用easytier-cli peer
+        """
+        self.et_cli_path = et_cli_path
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.fetch = fetch
+        self.peers = {}  # {节点ID(str): peer}
+        self.by_hostname = {}  # {主机名: peer}
+        self.by_ipv4 = {}  # {虚拟IPv4(不含前缀长度): peer}
+        self.room_hosts = {}  # {联机中心端口: peer}
+        self.local = None  # 本机节点
+        self.updated_at = None  # 最近一次成功刷新的时间
+        self.listeners = []  # 变化回调 callback(changes)
+        self.refresh_task = None
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    def __contains__(self, peer_id) -> bool:
+        return str(peer_id) in self.peers
+
+    def get(self, peer_id) -> dict | None:
+        """按节点ID查询"""
+        return self.peers.get(str(peer_id))
+
+    def get_by_hostname(self, hostname: str) -> dict | None:
+        return self.by_hostname.get(hostname)
+
+    def get_by_ipv4(self, ipv4: str) -> dict | None:
+        return self.by_ipv4.get(ipv4.split("/", 1)[0])
+
+    @property
+    def local_id(self):
+        """本机节点ID, 尚未出现时为None"""
+        return self.local.get("id") if self.local else None
+
+    def room_host(self) -> tuple | None:
+        r"""
+        当前可见的联机中心
+        :return: (虚拟IP, 端口), 没有时返回None
+        """
+        for server_port, peer in self.room_hosts.items():
+            return peer.get("ipv4").split("/", 1)[0], server_port
+        return None
+
+    def add_listener(self, callback):
+        r"""
+        订阅节点变化
+        :param callback: callback({"added": [peer], "updated": [peer], "removed": [peer]}), 可以是普通函数或协程函数
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    @staticmethod
+    def changed(old: dict, new: dict) -> bool:
+        """节点的TRACKED_FIELDS是否有变化"""
+        return any(old.get(field) != new.get(field) for field in TRACKED_FIELDS)
+
+    def update(self, peers: list) -> dict:
+        r"""
+        用新的节点列表替换缓存并重建索引
+        :return: 与旧缓存的差异 {"added": [peer], "updated": [peer], "removed": [peer]}, updated只包含TRACKED_FIELDS变化的节点
+        """
+        new_peers = {}
+        by_hostname = {}
+        by_ipv4 = {}
+        room_hosts = {}
+        local = None
+        for peer in peers:
+            if peer.get("id") is None:
+                continue
+            new_peers[str(peer.get("id"))] = peer
+            hostname = peer.get("hostname") or ""
+            if hostname:
+                by_hostname[hostname] = peer
+                if hostname.startswith(ROOM_HOST_PREFIX) and peer.get("ipv4"):
+                    try:
+                        room_hosts[int(hostname[len(ROOM_HOST_PREFIX):])] = peer
+                    except ValueError:
+                        pass
+            if peer.get("ipv4"):
+                by_ipv4[peer.get("ipv4").split("/", 1)[0]] = peer
+            if peer.get("cost") == "Local":
+                local = peer
+        changes = {
+            "added": [peer for peer_id, peer in new_peers.items() if peer_id not in self.peers],
+            "updated": [peer for peer_id, peer in new_peers.items() if peer_id in self.peers and self.changed(self.peers[peer_id], peer)],
+            "removed": [peer for peer_id, peer in self.peers.items() if peer_id not in new_peers]
+        }
+        self.peers = new_peers
+        self.by_hostname = by_hostname
+        self.by_ipv4 = by_ipv4
+        self.room_hosts = room_hosts
+        self.local = local
+        self.updated_at = time.time()
+        return changes
+
+    async def __fetch(self) -> list | None:
+        if self.fetch is not None:
+            return await self.fetch()
+        from .Florolding import EasyTier
+        return await EasyTier.async_easytier_peer(self.et_cli_path, self.timeout)
+
+    async def refresh(self) -> dict:
+        r"""
+        立即刷新一次并通知订阅者
+        easytier-cli失败(返回空列表)时保留旧缓存, 避免一次失败被当成所有节点离开
+        :return: 本次变化
+        """
+        peers = await self.__fetch()
+        if not peers and self.peers:
+            return {"added": [], "updated": [], "removed": []}
+        changes = self.update(peers or [])
+        if changes["added"] or changes["updated"] or changes["removed"]:
+            for callback in list(self.listeners):
+                try:
+                    result = callback(changes)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception:
+                    logger.exception("节点变化回调异常")
+        return changes
+
+    async def __refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("刷新EasyTier节点失败")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """开始后台刷新"""
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self.__refresh_loop())
+
+    async def stop(self):
+        """停止后台刷新"""
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            try:
+                await self.refresh_task
+            except asyncio.CancelledError:
+                pass
+            self.refresh_task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
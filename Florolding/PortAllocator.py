@@ -0,0 +1,91 @@
+import collections
+import os
+import socket
+import sys
+
+# 与asyncio.start_server的默认行为一致, 只在POSIX上设置SO_REUSEADDR (Windows上该选项允许抢占端口)
+# 由系统分配的端口不设置: 未监听的套接字之间SO_REUSEADDR允许重复绑定, 预留的端口会被同样设置了该选项的套接字抢走
+_REUSE_ADDRESS = os.name == "posix" and sys.platform != "cygwin"
+
+
+def bind_socket(host: str = "0.0.0.0", port: int = 0) -> socket.socket:
+    r"""
+    创建并绑定TCP套接字, 不开始监听
+    :param port: 0表示由系统分配, 不会与已占用的端口冲突, 监听之前其他套接字也无法绑定该端口
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if _REUSE_ADDRESS and port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class PortAllocator:
+    r"""
+    端口分配器
+    分配的是已经绑定好的套接字而不是端口号, 从分配到开始监听之间端口不会被其他程序占用;
+    端口由系统分配, 无需随机尝试, 池中预先保留若干套接字, 分配与归还均为O(1)
+    """
+
+    def __init__(self, host: str = "0.0.0.0", pool_size: int = 8):
+        r"""
+        :param host: 绑定地址
+        :param pool_size: 预先保留的套接字数量上限
+        """
+        self.host = host
+        self.pool_size = pool_size
+        self.pool = collections.deque()  # 已绑定、未监听的套接字
+
+    def __len__(self) -> int:
+        return len(self.pool)
+
+    def fill(self) -> int:
+        r"""
+        预先绑定套接字直到池满
+        :return: 新增的数量
+        """
+        added = 0
+        while len(self.pool) < self.pool_size:
+            self.pool.append(bind_socket(self.host))
+            added += 1
+        return added
+
+    def acquire(self) -> socket.socket:
+        """取出一个已绑定的套接字, 池为空时立即绑定新的套接字, 之后由调用方负责关闭"""
+        if self.pool:
+            return self.pool.popleft()
+        return bind_socket(self.host)
+
+    def release(self, sock: socket.socket):
+        """归还未使用的套接字, 池已满或套接字已关闭时直接关闭"""
+        if sock.fileno() != -1 and len(self.pool) < self.pool_size:
+            self.pool.append(sock)
+        else:
+            sock.close()
+
+    def acquire_port(self) -> int:
+        r"""
+        为其他进程(例如easytier-cli port-forward)分配端口号
+        套接字在返回前才关闭, 只留下交给对方绑定之前的极短窗口
+        """
+        sock = self.acquire()
+        try:
+            return sock.getsockname()[1]
+        finally:
+            sock.close()
+
+    def close(self):
+        """关闭池中全部套接字"""
+        while self.pool:
+            self.pool.popleft().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
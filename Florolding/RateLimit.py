@@ -0,0 +1,36 @@
+import time
+
+
+class TokenBucket:
+    r"""
+    令牌桶限流
+    以rate个/秒的速度补充令牌, 最多积累burst个, 每个请求消耗一个令牌; 补充在取令牌时按经过的时间一次性计算, 不需要定时任务
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "clock")
+
+    def __init__(self, rate: float, burst: float | None = None, clock=time.monotonic):
+        r"""
+        :param rate: 每秒补充的令牌数
+        :param burst: 令牌上限, 即允许的突发请求数, 默认等于rate且不少于1
+        :param clock: 单调时钟函数
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.clock = clock
+        self.updated = clock()
+
+    def consume(self, tokens: float = 1) -> bool:
+        r"""
+        尝试取出令牌
+        :param tokens: 需要的令牌数
+        :return: 令牌足够时扣除并返回True, 否则返回False且不扣除
+        """
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
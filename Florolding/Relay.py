@@ -0,0 +1,346 @@
+import asyncio
+import ipaddress
+import itertools
+import logging
+import math
+import os
+import socket
+import time
+from . import TimerWheel, Metrics, PortAllocator
+
+logger = logging.getLogger(__name__)
+
+# Linux上可用os.splice经管道在内核中搬运数据, 不复制到用户空间
+_SPLICE = hasattr(os, "splice")
+
+
+async def _wait_fd(add, remove, fd: int):
+    """等待fd可读或可写, add/remove为loop.add_reader/remove_reader或add_writer/remove_writer"""
+    future = asyncio.get_running_loop().create_future()
+    add(fd, lambda: future.done() or future.set_result(None))
+    try:
+        await future
+    finally:
+        remove(fd)
+
+
+async def _recv_exactly(loop: asyncio.AbstractEventLoop, sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = await loop.sock_recv(sock, size - len(data))
+        if not chunk:
+            raise ConnectionError("SOCKS5代理关闭了连接")
+        data += chunk
+    return data
+
+
+async def _socks5_connect(loop: asyncio.AbstractEventLoop, sock: socket.socket, host: str, port: int):
+    """在已连接代理的套接字上完成无认证的SOCKS5 CONNECT握手(RFC 1928)"""
+    await loop.sock_sendall(sock, b"\x05\x01\x00")
+    if await _recv_exactly(loop, sock, 2) != b"\x05\x00":
+        raise ConnectionError("SOCKS5代理不接受无认证连接")
+    try:
+        address = ipaddress.ip_address(host)
+        destination = (b"\x01" if address.version == 4 else b"\x04") + address.packed
+    except ValueError:
+        encoded = host.encode("idna")
+        destination = b"\x03" + bytes([len(encoded)]) + encoded
+    await loop.sock_sendall(sock, b"\x05\x01\x00" + destination + int(port).to_bytes(2, "big"))
+    version, reply, _, address_type = await _recv_exactly(loop, sock, 4)
+    if version != 5 or reply != 0:
+        raise ConnectionError(f"SOCKS5代理连接{host}:{port}失败: {reply}")
+    # 跳过代理绑定的地址与端口
+    if address_type == 1:
+        await _recv_exactly(loop, sock, 4 + 2)
+    elif address_type == 4:
+        await _recv_exactly(loop, sock, 16 + 2)
+    elif address_type == 3:
+        await _recv_exactly(loop, sock, (await _recv_exactly(loop, sock, 1))[0] + 2)
+    else:
+        raise ConnectionError(f"SOCKS5代理返回了未知的地址类型: {address_type}")
+
+
+class RelayConnection:
+    """单个转发连接的状态与统计"""
+
+    __slots__ = ("id", "client", "upstream", "address", "started_at", "connect_time", "bytes_up", "bytes_down", "last_active", "task")
+
+    def __init__(self, connection_id: int, client: socket.socket, address):
+        self.id = connection_id
+        self.client = client
+        self.upstream = None
+        self.address = address  # 客户端地址
+        self.started_at = time.time()
+        self.connect_time = None  # 建立上游连接的耗时(秒)
+        self.bytes_up = 0  # 客户端 -> 远程
+        self.bytes_down = 0  # 远程 -> 客户端
+        self.last_active = time.monotonic()
+        self.task = None
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "address": self.address,
+            "started_at": self.started_at,
+            "connect_ms": self.connect_time * 1000 if self.connect_time is not None else None,
+            "bytes_up": self.bytes_up,
+            "bytes_down": self.bytes_down,
+            "idle": time.monotonic() - self.last_active
+        }
+
+
+class TcpRelay:
+    r"""
+    进程内TCP转发
+    把本地端口收到的连接转发到远程地址(通常是房主的EasyTier虚拟IP), 代替easytier-cli port-forward;
+    每个连接的字节数与建立上游连接的耗时都可以查看, 空闲连接自动关闭, stop后监听与所有连接都被关闭
+    Linux上使用os.splice在内核中搬运数据, 其他平台每个方向复用一块预先分配的缓冲区(sock_recv_into), 转发过程中不产生新的bytes对象
+    本机访问虚拟IP需要EasyTier以TUN模式运行(build_params的tun参数, 需要管理员权限), 或者经由EasyTier的SOCKS5代理(proxy参数与build_params的socks5_port)
+    """
+
+    def __init__(self, remote_host: str, remote_port: int, local_host: str = "127.0.0.1", local_port: int = 0, buffer_size: int = 65536,
+                 idle_timeout: float | None = 300, connect_timeout: float = 10, sweep_interval: float = 1, zero_copy: bool = True, metrics: Metrics.MetricsRegistry | None = None, proxy: tuple | None = None):
+        r"""
+        :param remote_host: 转发目标地址
+        :param remote_port: 转发目标端口
+        :param local_host: 本地监听地址
+        :param local_port: 本地监听端口, 0表示由系统分配, 启动后从local_port读取
+        :param buffer_size: 每个方向的缓冲区大小, 使用splice时为单次搬运的上限
+        :param idle_timeout: 连接两个方向都超过该时间(秒)没有数据时关闭, None表示不限制
+        :param connect_timeout: 连接远程地址的超时时间(秒)
+        :param sweep_interval: 检查空闲连接的间隔(秒)
+        :param zero_copy: 可用时是否使用os.splice
+        :param metrics: 共享的指标, 默认新建
+        :param proxy: SOCKS5代理地址(host, port), 经由代理连接远程地址, 例如easytier-core的--socks5; 默认直接连接
+        """
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.local_host = local_host
+        self.local_port = local_port
+        self.buffer_size = buffer_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.sweep_interval = sweep_interval
+        self.zero_copy = zero_copy and _SPLICE
+        self.metrics = metrics if metrics is not None else Metrics.MetricsRegistry()
+        self.proxy = proxy
+        self.connections = {}  # {连接ID: RelayConnection}
+        self.connection_ids = itertools.count(1)
+        self.bytes_up = 0  # 已关闭连接的累计字节数
+        self.bytes_down = 0
+        # 收发数据时只更新last_active, 到期时再按last_active判断是否真的空闲, 避免每次收发都重新调度
+        self.idle_wheel = TimerWheel.TimerWheel(sweep_interval, math.ceil((idle_timeout or 0) / sweep_interval) + 1)  # 以连接ID为key
+        self.sock = None
+        self.accept_task = None
+        self.sweep_task = None
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def info(self) -> dict:
+        """转发概况, 累计字节数包含仍在进行的连接"""
+        return {
+            "local": f"{self.local_host}:{self.local_port}",
+            "remote": f"{self.remote_host}:{self.remote_port}",
+            "proxy": f"{self.proxy[0]}:{self.proxy[1]}" if self.proxy else None,
+            "zero_copy": self.zero_copy,
+            "connections": len(self.connections),
+            "bytes_up": self.bytes_up + sum(connection.bytes_up for connection in self.connections.values()),
+            "bytes_down": self.bytes_down + sum(connection.bytes_down for connection in self.connections.values())
+        }
+
+    def list_connections(self) -> list:
+        """所有连接的统计信息"""
+        return [connection.info() for connection in self.connections.values()]
+
+    async def start(self, sock: socket.socket | None = None):
+        r"""
+        开始监听并转发
+        :param sock: 已绑定的套接字(例如PortAllocator.acquire()的结果), 默认按local_host与local_port绑定
+        """
+        self.sock = sock if sock is not None else PortAllocator.bind_socket(self.local_host, self.local_port)
+        self.sock.listen(socket.SOMAXCONN)
+        self.sock.setblocking(False)
+        self.local_port = self.sock.getsockname()[1]
+        self.accept_task = asyncio.create_task(self.__accept_loop())
+        if self.idle_timeout is not None:
+            self.sweep_task = asyncio.create_task(self.__sweep_loop())
+        logger.info("TCP转发已启动: %s:%s -> %s:%s, splice: %s", self.local_host, self.local_port, self.remote_host, self.remote_port, self.zero_copy)
+
+    async def __accept_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                client, address = await loop.sock_accept(self.sock)
+            except OSError as e:
+                # 文件描述符耗尽等情况下稍后重试, 不结束监听
+                logger.warning("接受转发连接失败: %s", e)
+                await asyncio.sleep(0.1)
+                continue
+            client.setblocking(False)
+            connection = RelayConnection(next(self.connection_ids), client, address)
+            self.connections[connection.id] = connection
+            connection.task = asyncio.create_task(self.__relay(connection))
+
+    async def __connect(self) -> socket.socket:
+        loop = asyncio.get_running_loop()
+        host, port = self.proxy if self.proxy else (self.remote_host, self.remote_port)
+        family, type_, proto, _, address = (await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM))[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            if self.proxy:
+                await _socks5_connect(loop, sock, self.remote_host, self.remote_port)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def __relay(self, connection: RelayConnection):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            try:
+                connection.upstream = await asyncio.wait_for(self.__connect(), self.connect_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.metrics.inc("relay_connect_errors")
+                logger.warning("连接转发目标%s:%s失败: %r", self.remote_host, self.remote_port, e)
+                return
+            connection.connect_time = loop.time() - start
+            for sock in (connection.client, connection.upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.metrics.inc("relay_connections_total")
+            self.metrics.set("relay_connections_active", len(self.connections))
+            if self.idle_timeout is not None:
+                self.idle_wheel.schedule(connection.id, self.idle_timeout)
+            await asyncio.gather(
+                self.__pump(connection, connection.client, connection.upstream, True),
+                self.__pump(connection, connection.upstream, connection.client, False)
+            )
+        finally:
+            self.idle_wheel.cancel(connection.id)
+            connection.client.close()
+            if connection.upstream is not None:
+                connection.upstream.close()
+            self.connections.pop(connection.id, None)
+            self.bytes_up += connection.bytes_up
+            self.bytes_down += connection.bytes_down
+            self.metrics.inc("relay_bytes_up", connection.bytes_up)
+            self.metrics.inc("relay_bytes_down", connection.bytes_down)
+            self.metrics.set("relay_connections_active", len(self.connections))
+            logger.debug("转发连接%s已关闭: %s", connection.id, connection.info())
+
+    async def __pump(self, connection: RelayConnection, src: socket.socket, dst: socket.socket, upstream: bool):
+        """单方向转发, 读到EOF时半关闭另一端, 出错时关闭两个方向使另一方向随之结束"""
+        try:
+            if self.zero_copy:
+                await self.__splice(connection, src, dst, upstream)
+            else:
+                await self.__copy(connection, src, dst, upstream)
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    async def __copy(self, connection: RelayConnection, src: socket.socket, dst: socket.socket, upstream: bool):
+        loop = asyncio.get_running_loop()
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        while True:
+            size = await loop.sock_recv_into(src, buffer)
+            if not size:
+                return
+            await loop.sock_sendall(dst, view[:size])
+            if upstream:
+                connection.bytes_up += size
+            else:
+                connection.bytes_down += size
+            connection.last_active = time.monotonic()
+
+    async def __splice(self, connection: RelayConnection, src: socket.socket, dst: socket.socket, upstream: bool):
+        loop = asyncio.get_running_loop()
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        read_fd, write_fd = os.pipe()
+        try:
+            while True:
+                try:
+                    size = os.splice(src_fd, write_fd, self.buffer_size, flags=flags)
+                except BlockingIOError:
+                    # 每次都会把管道清空, 这里只可能是套接字暂无数据
+                    await _wait_fd(loop.add_reader, loop.remove_reader, src_fd)
+                    continue
+                if not size:
+                    return
+                remaining = size
+                while remaining:
+                    try:
+                        remaining -= os.splice(read_fd, dst_fd, remaining, flags=flags)
+                    except BlockingIOError:
+                        await _wait_fd(loop.add_writer, loop.remove_writer, dst_fd)
+                if upstream:
+                    connection.bytes_up += size
+                else:
+                    connection.bytes_down += size
+                connection.last_active = time.monotonic()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    async def __sweep_loop(self):
+        """定时推进时间轮, 到期时仍有数据往来的连接按剩余时间重新调度"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            now = time.monotonic()
+            for connection_id in self.idle_wheel.advance():
+                connection = self.connections.get(connection_id)
+                if connection is None:
+                    continue
+                idle = now - connection.last_active
+                if idle < self.idle_timeout:
+                    self.idle_wheel.schedule(connection_id, self.idle_timeout - idle)
+                    continue
+                self.metrics.inc("relay_idle_timeouts")
+                logger.info("转发连接空闲超时: %s", connection.address)
+                connection.task.cancel()
+
+    async def close_connection(self, connection_id: int) -> bool:
+        r"""
+        关闭单个转发连接
+        :return: 连接是否存在
+        """
+        connection = self.connections.get(connection_id)
+        if connection is None:
+            return False
+        connection.task.cancel()
+        await asyncio.gather(connection.task, return_exceptions=True)
+        return True
+
+    async def stop(self):
+        """停止监听并关闭所有转发连接"""
+        for task in (self.accept_task, self.sweep_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(task for task in (self.accept_task, self.sweep_task) if task is not None), return_exceptions=True)
+        self.accept_task = None
+        self.sweep_task = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        tasks = [connection.task for connection in self.connections.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("TCP转发已停止: %s:%s -> %s:%s", self.local_host, self.local_port, self.remote_host, self.remote_port)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
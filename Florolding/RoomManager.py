@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from . import Scaffolding, F_Server, Metrics, CodeAllocator, PortAllocator
+
+logger = logging.getLogger(__name__)
+
+
+class Room:
+    """单个房间的运行状态"""
+
+    __slots__ = ("code", "server", "minecraft_port", "created_at", "easytier")
+
+    def __init__(self, code: str, server: F_Server.AsyncFloroldingServer, minecraft_port: int | str):
+        self.code = code
+        self.server = server
+        self.minecraft_port = minecraft_port
+        self.created_at = time.time()
+        self.easytier = None  # launcher返回的EasyTier句柄
+
+    @property
+    def server_port(self) -> int:
+        return self.server.server_port
+
+    def info(self) -> dict:
+        return {
+            "code": self.code,
+            "server_port": self.server.server_port,
+            "minecraft_port": self.minecraft_port,
+            "players": len(self.server.players),
+            "created_at": self.created_at
+        }
+
+
+class RoomManager:
+    r"""
+    在同一个事件循环中托管多个房间
+    每个房间拥有独立的Scaffolding服务器端口、玩家列表与Minecraft端口, 所有房间共享同一份指标;
+    EasyTier的网络名与密钥由房间码决定, 每个房间都是独立的EasyTier网络, 无法共用一个easytier-core,
+    因此由launcher为每个房间各自启动(例如Supervisor.room_launcher为每个房间启动一个受守护的easytier-core)
+    """
+
+    def __init__(self, machine_id: str | None = None, player_name: str = "", server_host: str = "0.0.0.0", metrics: Metrics.MetricsRegistry | None = None, launcher=None, code_allocator: CodeAllocator.CodeAllocator | None = None, port_allocator: PortAllocator.PortAllocator | None = None, **server_options):
+        r"""
+        :param machine_id: 房主的machine_id, 默认使用Scaffolding.machine_id()
+        :param player_name: 房主玩家名
+        :param server_host: Scaffolding服务器监听地址
+        :param metrics: 共享的指标, 默认新建
+        :param launcher: 房间创建后调用的协程函数 launcher(room), 返回值保存为room.easytier,
+                         关闭房间时若其拥有stop()协程方法则会被调用; 通常用于为房间启动EasyTier
+        :param code_allocator: 房间码分配器, 默认新建
+        :param port_allocator: 端口分配器, 未指定端口的房间使用其预先绑定的套接字, 默认新建
+        :param server_options: 传给AsyncFloroldingServer的其他参数
+        """
+        self.machine_id = machine_id or Scaffolding.machine_id()
+        self.player_name = player_name
+        self.server_host = server_host
+        self.metrics = metrics if metrics is not None else Metrics.MetricsRegistry()
+        self.launcher = launcher
+        self.code_allocator = code_allocator if code_allocator is not None else CodeAllocator.CodeAllocator()
+        self.code_allocator.reserve()
+        self.port_allocator = port_allocator if port_allocator is not None else PortAllocator.PortAllocator(server_host)
+        self.server_options = server_options
+        self.rooms = {}  # {code: Room}
+        self.lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def get_room(self, code: str) -> Room | None:
+        return self.rooms.get(code)
+
+    def list_rooms(self) -> list:
+        """所有房间的概要信息"""
+        return [room.info() for room in self.rooms.values()]
+
+    async def create_room(self, minecraft_port: int | str = 25565, code: str | None = None, server_port: int = 0, easytier_id: int | str = 0) -> Room:
+        r"""
+        创建并启动一个房间
+        :param minecraft_port: 该房间的Minecraft服务器端口
+        :param code: 房间码, 默认自动生成
+        :param server_port: Scaffolding服务器端口, 0表示使用端口分配器预先绑定的套接字
+        :param easytier_id: 房主的EasyTier节点ID
+        :return: Room
+        """
+        async with self.lock:
+            if code is None:
+                code = self.code_allocator.allocate()
+                # 备用房间码不足一半时在下一轮事件循环中补充
+                if len(self.code_allocator.reserved) < self.code_allocator.reserve_size // 2:
+                    asyncio.get_running_loop().call_soon(self.code_allocator.reserve)
+            elif not Scaffolding.validate_code(code):
+                raise ValueError(f"无效的房间码: {code}")
+            elif code in self.rooms or not self.code_allocator.claim(code):
+                raise ValueError(f"房间已存在: {code}")
+            server = F_Server.AsyncFloroldingServer(
+                self.machine_id, easytier_id, self.player_name, self.server_host, server_port, minecraft_port,
+                metrics=self.metrics, **self.server_options
+            )
+            sock = None
+            try:
+                if not server_port:
+                    sock = self.port_allocator.acquire()
+                    # 池中套接字在下一轮事件循环中补充
+                    asyncio.get_running_loop().call_soon(self.port_allocator.fill)
+                await server.listen(sock)
+            except OSError:
+                if sock is not None:
+                    sock.close()
+                self.code_allocator.release(code)
+                raise
+            room = Room(code, server, minecraft_port)
+            self.rooms[code] = room
+            self.metrics.set("rooms", len(self.rooms))
+        if self.launcher is not None:
+            try:
+                room.easytier = await self.launcher(room)
+            except Exception:
+                await self.close_room(code)
+                raise
+        logger.info("房间已创建: %s, 端口: %s", code, room.server_port)
+        return room
+
+    async def close_room(self, code: str) -> bool:
+        r"""
+        关闭房间并断开该房间的所有连接
+        :return: 房间是否存在
+        """
+        async with self.lock:
+            room = self.rooms.pop(code, None)
+            self.metrics.set("rooms", len(self.rooms))
+        if room is None:
+            return False
+        self.code_allocator.release(room.code)
+        await room.server.stop()
+        stop = getattr(room.easytier, "stop", None)
+        if stop is not None:
+            await stop()
+        logger.info("房间已关闭: %s", code)
+        return True
+
+    async def close_all(self):
+        """关闭全部房间, 释放预先绑定的端口并保存房间码分配记录"""
+        await asyncio.gather(*(self.close_room(code) for code in list(self.rooms)))
+        self.port_allocator.close()
+        self.code_allocator.save()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close_all()
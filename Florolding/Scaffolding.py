@@ -1,26 +1,79 @@
-import random
+import secrets
 import uuid
 import hashlib
+from typing import NamedTuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHARSET = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+# 预计算的查找表
+_CHAR_VALUES = {char: index for index, char in enumerate(CHARSET)}
+_PAIRS = [CHARSET[low] + CHARSET[high] for high in range(34) for low in range(34)]  # 34进制两位(小端序)
+_WEIGHTS = tuple(34 ** i % 7 for i in range(16))  # 校验只需要 34^i mod 7
+_MAX_VALUE = 34 ** 16
+_MULTIPLES = -(-_MAX_VALUE // 7)  # [0, 34^16)中7的倍数的个数
+# 批量操作超过该数量且安装了NumPy时使用向量化实现
+NUMPY_THRESHOLD = 1024
+
+
+class RoomCode(NamedTuple):
+    code: str
+    network_name: str
+    network_secret: str
+
+
+def _format_code(value: int) -> str:
+    """将数值按34进制小端序格式化为 U/NNNN-NNNN-SSSS-SSSS"""
+    pairs = []
+    for _ in range(8):
+        value, pair = divmod(value, 1156)
+        pairs.append(_PAIRS[pair])
+    return f"U/{pairs[0]}{pairs[1]}-{pairs[2]}{pairs[3]}-{pairs[4]}{pairs[5]}-{pairs[6]}{pairs[7]}"
 
 
 def generate_code() -> str:
     r"""
     :return: Scaffolding协议标准联机房间码
     """
-    charset: str = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
-    # 生成能被7整除的随机数
-    max_value = 34 ** 16
-    value = random.randrange(0, max_value, 7)
-    # 转换为34进制（小端序）
-    code_chars = []
-    temp_value = value
-    for i in range(16):
-        code_chars.append(charset[temp_value % 34])
-        temp_value //= 34
-    code_str = "".join(code_chars)
-    # 格式化为 U/NNNN-NNNN-SSSS-SSSS
-    formatted_code = f"U/{code_str[0:4]}-{code_str[4:8]}-{code_str[8:12]}-{code_str[12:16]}"
-    return formatted_code
+    # 使用密码学安全的随机数生成能被7整除的数, 并转换为34进制（小端序）
+    return _format_code(7 * secrets.randbelow(_MULTIPLES))
+
+
+def generate_codes(n: int, use_numpy: bool | None = None) -> list:
+    r"""
+    批量生成联机房间码
+    :param n: 数量
+    :param use_numpy: 是否使用NumPy, 默认在数量较大且已安装NumPy时使用
+    :return: 房间码列表
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None and n >= NUMPY_THRESHOLD
+    if not use_numpy:
+        return [_format_code(7 * secrets.randbelow(_MULTIPLES)) for _ in range(n)]
+    if numpy is None:
+        raise RuntimeError("未安装NumPy")
+    # 34^16超出uint64范围, 改为逐位均匀采样后保留校验和为0的结果, 与在7的倍数中均匀采样等价
+    charset = numpy.frombuffer(CHARSET.encode("ascii"), dtype=numpy.uint8)
+    weights = numpy.array(_WEIGHTS, dtype=numpy.int64)
+    template = numpy.frombuffer(b"U/0000-0000-0000-0000", dtype=numpy.uint8)
+    positions = numpy.array([2, 3, 4, 5, 7, 8, 9, 10, 12, 13, 14, 15, 17, 18, 19, 20])
+    codes = []
+    while len(codes) < n:
+        # 随机字节来自secrets, 只保留小于238(34*7)的字节以保证每一位均匀分布
+        rows = (n - len(codes)) * 8 + 16
+        random_bytes = numpy.frombuffer(secrets.token_bytes(rows * 16 * 2), dtype=numpy.uint8)
+        random_bytes = random_bytes[random_bytes < 238]
+        rows = len(random_bytes) // 16
+        digits = (random_bytes[:rows * 16] % 34).astype(numpy.int64).reshape(rows, 16)
+        # 约1/7的样本满足校验
+        digits = digits[(digits @ weights) % 7 == 0][:n - len(codes)]
+        chars = numpy.tile(template, (len(digits), 1))
+        chars[:, positions] = charset[digits]
+        codes.extend(chars.view("S21").ravel().astype(str).tolist())
+    return codes
 
 
 def validate_code(code: str) -> bool:
@@ -29,27 +82,66 @@ def validate_code(code: str) -> bool:
     :param code: 联机房间码
     :return: bool
     """
-    charset = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
-    # 解析代码
-    if not code.startswith("U/"):
-        return False
-    parts = code[2:].split("-")
-    if len(parts) != 4 or any(len(part) != 4 for part in parts):
+    # 格式为 U/NNNN-NNNN-SSSS-SSSS
+    if not isinstance(code, str) or len(code) != 21 or not code.startswith("U/") or code[6] != "-" or code[11] != "-" or code[16] != "-":
         return False
-    # 合并所有字符（小端序序列）
-    all_chars = "".join(parts)
-    # 检查字符是否合法
-    for char in all_chars:
-        if char not in charset:
-            return False
-    # 按小端序计算数值（第一个字符对应最低位）
+    # 按小端序计算数值（第一个字符对应最低位）, 只需要模7的结果
     total = 0
-    for i, char in enumerate(all_chars):
-        char_value = charset.index(char)
-        total += char_value * (34 ** i)
+    try:
+        for char, weight in zip(code[2:6] + code[7:11] + code[12:16] + code[17:21], _WEIGHTS):
+            total += _CHAR_VALUES[char] * weight
+    except KeyError:
+        # 字符不合法
+        return False
     return total % 7 == 0
 
 
+def validate_codes(codes, use_numpy: bool | None = None) -> list:
+    r"""
+    批量验证联机房间码
+    :param codes: 房间码可迭代对象
+    :param use_numpy: 是否使用NumPy, 默认在数量较大且已安装NumPy时使用
+    :return: 与输入顺序一致的bool列表
+    """
+    codes = list(codes)
+    if use_numpy is None:
+        use_numpy = numpy is not None and len(codes) >= NUMPY_THRESHOLD
+    if not use_numpy:
+        return [validate_code(code) for code in codes]
+    if numpy is None:
+        raise RuntimeError("未安装NumPy")
+    results = numpy.zeros(len(codes), dtype=bool)
+    # 长度不是21的字符串与非字符串直接判定为无效
+    candidates = [index for index, code in enumerate(codes) if isinstance(code, str) and len(code) == 21]
+    if candidates:
+        chars = numpy.array([codes[index] for index in candidates], dtype="U21").view(numpy.uint32).reshape(-1, 21)
+        lookup = numpy.full(128, -1, dtype=numpy.int64)
+        lookup[numpy.frombuffer(CHARSET.encode("ascii"), dtype=numpy.uint8)] = numpy.arange(34)
+        positions = numpy.array([2, 3, 4, 5, 7, 8, 9, 10, 12, 13, 14, 15, 17, 18, 19, 20])
+        digit_chars = chars[:, positions]
+        ascii_mask = (digit_chars < 128).all(axis=1)
+        digits = lookup[numpy.where(digit_chars < 128, digit_chars, 0)]
+        valid = (
+            ascii_mask & (digits >= 0).all(axis=1)
+            & (chars[:, 0] == ord("U")) & (chars[:, 1] == ord("/"))
+            & (chars[:, 6] == ord("-")) & (chars[:, 11] == ord("-")) & (chars[:, 16] == ord("-"))
+            & ((digits @ numpy.array(_WEIGHTS, dtype=numpy.int64)) % 7 == 0)
+        )
+        results[candidates] = valid
+    return results.tolist()
+
+
+def parse_code(code: str) -> RoomCode | None:
+    r"""
+    解析联机房间码
+    :param code: 联机房间码
+    :return: RoomCode(房间码, EasyTier网络名, EasyTier网络密钥), 房间码无效时返回None
+    """
+    if not validate_code(code):
+        return None
+    return RoomCode(code, f"scaffolding-mc-{code[2:11]}", code[12:21])
+
+
 def machine_id() -> str:
     r"""
     这里使用MAC地址进行MD5加密作为machine_id, MAC地址虽然可以修改, 但是非常难遇到两个相同MAC地址的人一起联机
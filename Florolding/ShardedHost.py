@@ -0,0 +1,421 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from . import RoomManager, Metrics, CodeAllocator, Supervisor
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+
+def shard_score(code: str, index: int) -> int:
+    r"""
+    房间码与工作进程的哈希权重, 房间分配给权重最高的存活进程(最高随机权重哈希)
+    进程退出时只有其上的房间需要迁移, 其他房间的归属不变
+    """
+    return int.from_bytes(hashlib.blake2b(f"{index}:{code}".encode("ascii"), digest_size=8).digest(), "little")
+
+
+def _worker_main(index: int, commands, results, manager_options: dict, launcher_options: dict | None, use_uvloop: bool):
+    """工作进程入口, 每个进程运行一个事件循环与一个RoomManager"""
+    if hasattr(os, "setpgid"):
+        # 自成进程组, 启动的easytier-core随之加入; 工作进程意外退出时主进程结束整个进程组, 不留下孤儿进程
+        os.setpgid(0, 0)
+    if use_uvloop and uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    try:
+        asyncio.run(_serve_worker(commands, results, manager_options, launcher_options))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve_worker(commands, results, manager_options: dict, launcher_options: dict | None):
+    if launcher_options is not None:
+        manager_options = dict(manager_options, launcher=Supervisor.room_launcher(**launcher_options))
+    manager = RoomManager.RoomManager(**manager_options)
+    tasks = set()
+
+    async def handle(request_id: int, command: str, args: dict):
+        try:
+            if command == "create":
+                result = (await manager.create_room(**args)).info()
+            elif command == "close":
+                result = await manager.close_room(args.get("code"))
+            elif command == "list":
+                result = manager.list_rooms()
+            elif command == "metrics":
+                result = manager.metrics.snapshot()
+            else:
+                raise ValueError(f"未知命令: {command}")
+            results.send((request_id, True, result))
+        except Exception as e:
+            results.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+    try:
+        while True:
+            try:
+                message = await asyncio.to_thread(commands.recv)
+            except (EOFError, OSError):
+                # 主进程已退出
+                break
+            if message is None:
+                break
+            task = asyncio.create_task(handle(*message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        await manager.close_all()
+
+
+def _kill_process_group(pid: int | None):
+    """结束工作进程所在进程组中剩余的进程, 仅POSIX; 进程组已不存在时忽略"""
+    if pid is None or not hasattr(os, "killpg"):
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class Worker:
+    """主进程中的工作进程句柄"""
+
+    __slots__ = ("index", "process", "commands", "results", "pending", "reader", "exited", "watch_task", "rooms")
+
+    def __init__(self, index: int, process, commands, results):
+        self.index = index
+        self.process = process
+        self.commands = commands  # 发送命令的管道端
+        self.results = results  # 接收结果的管道端
+        self.pending = {}  # {请求ID: Future}
+        self.reader = None  # 接收结果的线程
+        self.exited = None  # 结果管道关闭时完成的Future
+        self.watch_task = None
+        self.rooms = set()  # 该进程上的房间码
+
+
+class ShardedRoomHost:
+    r"""
+    多进程房间托管
+    主进程只负责调度, 房间按房间码哈希分配到若干工作进程, 每个工作进程运行独立的事件循环(可用时使用uvloop)与RoomManager,
+    因此吞吐量随CPU核心数增长; 工作进程退出时其上的房间在存活进程上以相同房间码重新创建, 并按需重启该进程;
+    在POSIX上每个工作进程自成进程组, 迁移前先结束其遗留的easytier-core
+
+    事件: worker_started, worker_exited, room_moved, room_lost
+    """
+
+    def __init__(self, workers: int | None = None, use_uvloop: bool = True, restart: bool = True, request_timeout: float = 30,
+                 code_allocator: CodeAllocator.CodeAllocator | None = None, launcher_options: dict | None = None, mp_context: str | None = None, **manager_options):
+        r"""
+        :param workers: 工作进程数, 默认为CPU核心数
+        :param use_uvloop: 安装了uvloop时工作进程是否使用它
+        :param restart: 工作进程意外退出后是否重启
+        :param request_timeout: 等待工作进程响应的时间(秒)
+        :param code_allocator: 房间码分配器, 在主进程中保证房间码在所有进程间唯一, 默认新建
+        :param launcher_options: 传给Supervisor.room_launcher的参数, 在工作进程中生成launcher;
+                                 launcher本身是闭包, 无法传给使用spawn方式启动的进程
+        :param mp_context: multiprocessing启动方式, 默认使用平台默认值
+        :param manager_options: 传给工作进程中RoomManager的其他参数, 必须可以pickle
+        """
+        self.worker_count = workers or os.cpu_count() or 1
+        self.use_uvloop = use_uvloop
+        self.restart = restart
+        self.request_timeout = request_timeout
+        self.code_allocator = code_allocator if code_allocator is not None else CodeAllocator.CodeAllocator()
+        self.launcher_options = launcher_options
+        self.context = multiprocessing.get_context(mp_context)
+        self.manager_options = manager_options
+        self.workers = {}  # {序号: Worker}, 只包含存活的进程
+        self.rooms = {}  # {code: (工作进程序号, 创建参数)}
+        self.listeners = []  # 事件回调 callback(event, info)
+        self.request_ids = itertools.count()
+        self.control_server = None
+        self.stopping = False
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def add_listener(self, callback):
+        r"""
+        注册事件回调
+        :param callback: callback(event, info), 可以是普通函数或协程函数
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    async def __emit(self, event: str, **info):
+        logger.info("ShardedRoomHost %s %s", event, info)
+        for callback in list(self.listeners):
+            try:
+                result = callback(event, info)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception("事件回调异常")
+
+    async def start(self):
+        """启动全部工作进程"""
+        self.stopping = False
+        self.code_allocator.reserve()
+        for index in range(self.worker_count):
+            if index not in self.workers:
+                await self.__spawn(index)
+
+    async def __spawn(self, index: int) -> Worker:
+        command_reader, command_writer = self.context.Pipe(duplex=False)
+        result_reader, result_writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=_worker_main, name=f"florolding-worker-{index}", daemon=True,
+            args=(index, command_reader, result_writer, self.manager_options, self.launcher_options, self.use_uvloop)
+        )
+        await asyncio.to_thread(process.start)
+        # 子进程持有的管道端在主进程中关闭, 子进程退出时主进程的recv才能收到EOF
+        command_reader.close()
+        result_writer.close()
+        worker = Worker(index, process, command_writer, result_reader)
+        loop = asyncio.get_running_loop()
+        worker.exited = loop.create_future()
+        # 每个进程使用独立的线程阻塞接收结果, 不占用事件循环默认线程池(其大小与核心数相关, 进程较多时会被占满)
+        worker.reader = threading.Thread(target=self.__read_results, args=(worker, loop), name=f"florolding-worker-{index}-reader", daemon=True)
+        worker.reader.start()
+        worker.watch_task = asyncio.create_task(self.__watch(worker))
+        self.workers[index] = worker
+        await self.__emit("worker_started", worker=index, pid=process.pid)
+        return worker
+
+    @staticmethod
+    def __read_results(worker: Worker, loop: asyncio.AbstractEventLoop):
+        """在接收线程中运行, 结果交回事件循环处理"""
+        try:
+            while True:
+                try:
+                    message = worker.results.recv()
+                except (EOFError, OSError):
+                    break
+                loop.call_soon_threadsafe(ShardedRoomHost.__resolve, worker, *message)
+            loop.call_soon_threadsafe(worker.exited.set_result, None)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    @staticmethod
+    def __resolve(worker: Worker, request_id: int, ok: bool, result):
+        future = worker.pending.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+
+    async def __watch(self, worker: Worker):
+        await worker.exited
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"工作进程{worker.index}已退出"))
+        worker.pending.clear()
+        if not self.stopping:
+            await self.__worker_exited(worker)
+
+    async def __worker_exited(self, worker: Worker):
+        await asyncio.to_thread(worker.process.join)
+        # 先结束遗留的easytier-core, 否则迁移后同一房间会有两个easytier-core加入同一网络
+        _kill_process_group(worker.process.pid)
+        if self.workers.get(worker.index) is worker:
+            del self.workers[worker.index]
+        worker.commands.close()
+        worker.results.close()
+        await self.__emit("worker_exited", worker=worker.index, exitcode=worker.process.exitcode, rooms=len(worker.rooms))
+        if self.restart and not self.stopping:
+            try:
+                await self.__spawn(worker.index)
+            except Exception:
+                logger.exception("重启工作进程%s失败", worker.index)
+        # 在存活进程上重新创建房间, 房间码不变, Scaffolding端口会变化
+        for code in list(worker.rooms):
+            _, args = self.rooms.pop(code, (None, None))
+            if args is None:
+                continue
+            try:
+                info = await self.__create_on(self.pick_worker(code), args)
+            except Exception as e:
+                self.code_allocator.release(code)
+                await self.__emit("room_lost", code=code, error=str(e))
+            else:
+                await self.__emit("room_moved", code=code, worker=info.get("worker"), server_port=info.get("server_port"))
+
+    async def request(self, worker: Worker, command: str, **args):
+        r"""
+        向工作进程发送命令并等待结果
+        :return: 命令结果
+        :raise RuntimeError: 命令执行失败
+        :raise ConnectionError: 工作进程已退出
+        """
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        try:
+            worker.commands.send((request_id, command, args))
+        except (OSError, ValueError) as e:
+            worker.pending.pop(request_id, None)
+            raise ConnectionError(f"工作进程{worker.index}已退出") from e
+        try:
+            return await asyncio.wait_for(future, self.request_timeout)
+        finally:
+            worker.pending.pop(request_id, None)
+
+    def pick_worker(self, code: str) -> Worker:
+        """按房间码选择存活的工作进程"""
+        if not self.workers:
+            raise RuntimeError("没有可用的工作进程")
+        return self.workers[max(self.workers, key=lambda index: shard_score(code, index))]
+
+    async def __create_on(self, worker: Worker, args: dict) -> dict:
+        info = await self.request(worker, "create", **args)
+        worker.rooms.add(args.get("code"))
+        self.rooms[args.get("code")] = (worker.index, args)
+        info["worker"] = worker.index
+        return info
+
+    async def create_room(self, minecraft_port: int | str = 25565, code: str | None = None, easytier_id: int | str = 0) -> dict:
+        r"""
+        在房间码对应的工作进程上创建房间
+        :param code: 房间码, 默认自动生成
+        :return: 房间信息, 额外包含所在工作进程序号worker
+        """
+        if code is None:
+            code = self.code_allocator.allocate()
+            if len(self.code_allocator.reserved) < self.code_allocator.reserve_size // 2:
+                asyncio.get_running_loop().call_soon(self.code_allocator.reserve)
+        elif code in self.rooms or not self.code_allocator.claim(code):
+            raise ValueError(f"房间已存在: {code}")
+        try:
+            return await self.__create_on(self.pick_worker(code), {"minecraft_port": minecraft_port, "code": code, "easytier_id": easytier_id})
+        except Exception:
+            self.code_allocator.release(code)
+            raise
+
+    async def close_room(self, code: str) -> bool:
+        r"""
+        关闭房间
+        :return: 房间是否存在
+        """
+        index, _ = self.rooms.pop(code, (None, None))
+        worker = self.workers.get(index)
+        if worker is None:
+            return False
+        worker.rooms.discard(code)
+        self.code_allocator.release(code)
+        return await self.request(worker, "close", code=code)
+
+    async def list_rooms(self) -> list:
+        """所有工作进程上的房间概要信息"""
+        rooms = []
+        for index, result in zip(list(self.workers), await asyncio.gather(
+            *(self.request(worker, "list") for worker in list(self.workers.values())), return_exceptions=True
+        )):
+            if isinstance(result, BaseException):
+                continue
+            for info in result:
+                info["worker"] = index
+                rooms.append(info)
+        return rooms
+
+    async def aggregate_metrics(self) -> Metrics.MetricsRegistry:
+        r"""
+        汇总所有工作进程的指标
+        :return: 新的MetricsRegistry, 可直接render_prometheus
+        """
+        registry = Metrics.MetricsRegistry()
+        for snapshot in await asyncio.gather(
+            *(self.request(worker, "metrics") for worker in list(self.workers.values())), return_exceptions=True
+        ):
+            if not isinstance(snapshot, BaseException):
+                registry.merge(snapshot)
+        registry.set("workers", len(self.workers))
+        return registry
+
+    async def start_control_server(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.Server:
+        r"""
+        启动控制通道, 每行一个JSON命令, 每行返回一个JSON结果:
+        {"cmd": "create", "minecraft_port": 25565, "code": null}, {"cmd": "close", "code": "..."}, {"cmd": "list"}, {"cmd": "metrics"}
+        结果为{"ok": true, "result": ...}或{"ok": false, "error": "..."}; 控制通道没有认证, 默认只监听本机
+        :return: asyncio.Server
+        """
+        async def execute(request: dict):
+            command = request.pop("cmd", None)
+            if command == "create":
+                return await self.create_room(**request)
+            if command == "close":
+                return await self.close_room(request.get("code"))
+            if command == "list":
+                return await self.list_rooms()
+            if command == "metrics":
+                return (await self.aggregate_metrics()).snapshot()
+            raise ValueError(f"未知命令: {command}")
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                while line := await reader.readline():
+                    try:
+                        response = {"ok": True, "result": await execute(json.loads(line))}
+                    except Exception as e:
+                        response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                    writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                    await writer.drain()
+            except (ConnectionError, ValueError):
+                pass
+            finally:
+                writer.close()
+
+        self.control_server = await asyncio.start_server(handle, host, port)
+        return self.control_server
+
+    async def stop(self, timeout: float = 5):
+        r"""
+        关闭全部房间, 停止工作进程并保存房间码分配记录
+        :param timeout: 等待工作进程退出的时间(秒), 超时后强制结束
+        """
+        self.stopping = True
+        if self.control_server is not None:
+            self.control_server.close()
+            self.control_server = None
+        workers = list(self.workers.values())
+        self.workers.clear()
+        for worker in workers:
+            try:
+                worker.commands.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            await asyncio.to_thread(worker.process.join, timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                await asyncio.to_thread(worker.process.join)
+            _kill_process_group(worker.process.pid)
+            await worker.watch_task
+            worker.commands.close()
+            worker.results.close()
+        for code in self.rooms:
+            self.code_allocator.release(code)
+        self.rooms.clear()
+        self.code_allocator.save()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+from . import Florolding, PortAllocator
+
+logger = logging.getLogger(__name__)
+
+
+class EasyTierSupervisor:
+    r"""
+    基于asyncio的easytier-core守护
+    监视进程退出并定期通过easytier-cli检查健康状态, 异常时按指数退避使用相同的网络名与密钥重启
+
+    生命周期事件: starting, started, exited, unhealthy, restarting, stopped, failed
+    """
+
+    def __init__(self, et_core_path: str, code: str, become_host: bool = False, server_port: int | str = 3939, nodes: list | None = None, minecraft_port: int | str = 25565,
+                 et_cli_path: str | None = None, rpc_portal: str | None = None, listen_addresses: list | None = None, tun: bool = False, socks5_port: int | None = None, health_interval: float = 10, health_timeout: float = 5, max_health_failures: int = 3,
+                 min_backoff: float = 1, max_backoff: float = 30, stable_time: float = 60, max_restarts: int | None = None, stop_timeout: float = 5):
+        r"""
+        :param et_core_path: easytier-core路径
+        :param code: 房间码, 决定网络名与密钥
+        :param become_host: 是否作为联机中心启动
+        :param server_port: Scaffolding服务器端口
+        :param nodes: EasyTier公共节点列表
+        :param minecraft_port: Minecraft服务器端口
+        :param et_cli_path: easytier-cli路径, 为None时不进行健康检查
+        :param rpc_portal: easytier-core的RPC地址, 同一台机器运行多个easytier-core时需要各不相同
+        :param listen_addresses: 监听地址列表, 例如["tcp://0.0.0.0:11010", "udp://0.0.0.0:11010"]; None使用EasyTier默认的11010等端口, 空列表表示不监听
+        :param tun: 是否创建TUN虚拟网卡, 见EasyTier.build_params
+        :param socks5_port: EasyTier的SOCKS5代理端口, 见EasyTier.build_params
+        :param health_interval: 健康检查间隔(秒)
+        :param health_timeout: 单次健康检查超时时间(秒)
+        :param max_health_failures: 连续失败多少次后重启
+        :param min_backoff: 首次重启前等待时间(秒)
+        :param max_backoff: 最长重启等待时间(秒)
+        :param stable_time: 进程运行超过该时间后重置退避时间(秒)
+        :param max_restarts: 最大重启次数, None表示不限制
+        :param stop_timeout: 停止时等待进程退出的时间(秒), 超时后强制结束
+        """
+        self.params = Florolding.EasyTier.build_params(et_core_path, code, become_host, server_port, nodes, minecraft_port, tun, socks5_port)
+        if rpc_portal is not None:
+            self.params += ["--rpc-portal", rpc_portal]
+        if listen_addresses is not None:
+            self.params += [item for address in listen_addresses for item in ("-l", address)] if listen_addresses else ["--no-listener"]
+        self.et_cli_path = et_cli_path
+        self.rpc_portal = rpc_portal
+        self.listen_addresses = listen_addresses
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.max_health_failures = max_health_failures
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.max_restarts = max_restarts
+        self.stop_timeout = stop_timeout
+
+        self.process = None
+        self.restarts = 0
+        self.listeners = []  # 生命周期事件回调 callback(event, info)
+        self.supervise_task = None
+        self.stopping = False
+
+    @property
+    def pid(self) -> int | None:
+        return self.process.pid if self.process else None
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def add_listener(self, callback):
+        r"""
+        注册生命周期事件回调
+        :param callback: callback(event, info), 可以是普通函数或协程函数
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    async def __emit(self, event: str, **info):
+        logger.info("EasyTier %s %s", event, info)
+        for callback in list(self.listeners):
+            try:
+                result = callback(event, info)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logger.exception("EasyTier事件回调异常")
+
+    async def start(self):
+        """启动easytier-core并开始守护, 进程启动后返回"""
+        if self.supervise_task is not None and not self.supervise_task.done():
+            return
+        self.stopping = False
+        started = asyncio.get_running_loop().create_future()
+        self.supervise_task = asyncio.create_task(self.__supervise(started))
+        await started
+
+    async def __spawn(self):
+        await self.__emit("starting", restarts=self.restarts)
+        self.process = await asyncio.create_subprocess_exec(*self.params, stdin=asyncio.subprocess.DEVNULL)
+        await self.__emit("started", pid=self.process.pid)
+
+    async def __supervise(self, started: asyncio.Future):
+        loop = asyncio.get_running_loop()
+        backoff = self.min_backoff
+        while not self.stopping:
+            try:
+                await self.__spawn()
+            except OSError as e:
+                if not started.done():
+                    started.set_exception(e)
+                    return
+                await self.__emit("failed", error=str(e))
+                return
+            if not started.done():
+                started.set_result(None)
+            if self.stopping:
+                # 启动期间收到了停止请求
+                self.process.terminate()
+            spawned_at = loop.time()
+            health_task = asyncio.create_task(self.__health_loop()) if self.et_cli_path else None
+            try:
+                returncode = await self.process.wait()
+            finally:
+                if health_task is not None:
+                    health_task.cancel()
+                    await asyncio.gather(health_task, return_exceptions=True)
+            if self.stopping:
+                break
+            await self.__emit("exited", returncode=returncode)
+            if self.max_restarts is not None and self.restarts >= self.max_restarts:
+                await self.__emit("failed", error="too many restarts")
+                return
+            if loop.time() - spawned_at >= self.stable_time:
+                backoff = self.min_backoff
+            await self.__emit("restarting", delay=backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+            self.restarts += 1
+
+    async def check_health(self) -> bool:
+        """通过easytier-cli node查询本机节点, 能正常返回JSON即视为健康"""
+        args = [self.et_cli_path]
+        if self.rpc_portal is not None:
+            args += ["-p", self.rpc_portal]
+        args += ["-o", "json", "node"]
+        try:
+            process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return False
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), self.health_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # 超时或守护停止时取消了检查, 不留下easytier-cli进程
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        if process.returncode != 0:
+            return False
+        try:
+            json.loads(stdout.decode("utf-8"))
+            return True
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return False
+
+    async def __health_loop(self):
+        failures = 0
+        while True:
+            await asyncio.sleep(self.health_interval)
+            if await self.check_health():
+                failures = 0
+                continue
+            failures += 1
+            if failures >= self.max_health_failures:
+                await self.__emit("unhealthy", failures=failures)
+                # 结束进程, 由守护循环负责重启
+                if self.is_running():
+                    self.process.kill()
+                return
+
+    async def stop(self):
+        """停止守护并结束easytier-core, 不阻塞事件循环"""
+        self.stopping = True
+        process = self.process
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), self.stop_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        if self.supervise_task is not None:
+            self.supervise_task.cancel()
+            try:
+                await self.supervise_task
+            except asyncio.CancelledError:
+                pass
+            self.supervise_task = None
+        # 停止期间守护循环可能刚启动了新进程
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        await self.__emit("stopped")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+
+def room_launcher(et_core_path: str, et_cli_path: str | None = None, nodes: list | None = None, rpc_portal=None, listen_addresses=None, port_allocator: PortAllocator.PortAllocator | None = None, **supervisor_options):
+    r"""
+    生成RoomManager的launcher, 为每个房间启动一个受守护的easytier-core
+    同一台机器上的easytier-core必须使用不同的RPC地址与监听端口, 否则后启动的进程无法监听, 健康检查也会查询到其他房间的进程
+    :param rpc_portal: rpc_portal(room) -> str, 为每个房间分配RPC地址, 默认在127.0.0.1上分配空闲端口
+    :param listen_addresses: listen_addresses(room) -> list, 为每个房间分配监听地址, 默认分配一个空闲端口同时用于TCP与UDP
+    :param port_allocator: 默认分配端口时使用的端口分配器, 默认新建
+    :return: 协程函数 launcher(room) -> EasyTierSupervisor
+    """
+    if rpc_portal is None or listen_addresses is None:
+        port_allocator = port_allocator if port_allocator is not None else PortAllocator.PortAllocator("0.0.0.0", pool_size=0)
+    if rpc_portal is None:
+        def rpc_portal(room) -> str:
+            return f"127.0.0.1:{port_allocator.acquire_port()}"
+    if listen_addresses is None:
+        def listen_addresses(room) -> list:
+            port = port_allocator.acquire_port()
+            return [f"tcp://0.0.0.0:{port}", f"udp://0.0.0.0:{port}"]
+
+    async def launcher(room) -> EasyTierSupervisor:
+        supervisor = EasyTierSupervisor(
+            et_core_path, room.code, True, room.server_port, nodes, room.minecraft_port,
+            et_cli_path=et_cli_path, rpc_portal=rpc_portal(room), listen_addresses=listen_addresses(room), **supervisor_options
+        )
+        await supervisor.start()
+        return supervisor
+
+    return launcher
@@ -0,0 +1,67 @@
+import math
+import time
+
+
+class TimerWheel:
+    r"""
+    哈希时间轮
+    调度、续期、取消均为O(1), 推进时只访问经过的槽位, 开销与到期条目数量成正比
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, clock=time.monotonic):
+        r"""
+        :param tick: 每个槽位代表的时间跨度(秒)
+        :param slots: 槽位数量, tick * slots 不小于常用超时时间时效率最高
+        :param clock: 单调时钟函数
+        """
+        self.tick = tick
+        self.clock = clock
+        self.slots = [{} for _ in range(max(1, slots))]  # [{key: 到期刻度}]
+        self.entries = {}  # {key: 到期刻度}
+        self.current_tick = int(clock() / tick)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def schedule(self, key, delay: float):
+        r"""
+        在delay秒后使key到期, 已存在的key会被重新调度
+        :param key: 可哈希的条目标识
+        :param delay: 延迟时间(秒)
+        """
+        self.cancel(key)
+        deadline = max(math.ceil((self.clock() + delay) / self.tick), self.current_tick + 1)
+        self.slots[deadline % len(self.slots)][key] = deadline
+        self.entries[key] = deadline
+
+    def cancel(self, key) -> bool:
+        """取消key的调度, 返回key是否存在"""
+        deadline = self.entries.pop(key, None)
+        if deadline is None:
+            return False
+        del self.slots[deadline % len(self.slots)][key]
+        return True
+
+    def advance(self, now: float | None = None) -> list:
+        r"""
+        推进时间轮到当前时间
+        :param now: 当前时间, 默认读取clock
+        :return: 已到期的key列表
+        """
+        now_tick = int((self.clock() if now is None else now) / self.tick)
+        steps = min(now_tick - self.current_tick, len(self.slots))
+        expired = []
+        for tick in range(now_tick - steps + 1, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            due = [key for key, deadline in slot.items() if deadline <= now_tick]
+            for key in due:
+                del slot[key]
+                del self.entries[key]
+            expired.extend(due)
+        self.current_tick = max(self.current_tick, now_tick)
+        return expired
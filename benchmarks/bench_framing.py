@@ -0,0 +1,144 @@
+r"""
+帧编解码内存分配基准测试
+使用tracemalloc对比旧实现(bytes拼接构建帧、切片解析)与F_Frame(预编译struct头、writelines分段、memoryview解析)的内存分配
+运行: python -m benchmarks.bench_framing --body-size 65536 --batch 64
+"""
+import argparse
+import struct
+import time
+import tracemalloc
+from Florolding import F_Frame
+
+
+def legacy_create_response(status: int, response_body: bytes = b"") -> bytes:
+    """旧实现"""
+    response = struct.pack(">B", status)
+    response += struct.pack(">I", len(response_body))
+    response += response_body
+    return response
+
+
+def legacy_create_request(protocol_type: str, request_body: bytes = b"") -> bytes:
+    """旧实现"""
+    protocol_bytes = protocol_type.encode("ascii")
+    request = struct.pack(">B", len(protocol_bytes))
+    request += protocol_bytes
+    request += struct.pack(">I", len(request_body))
+    request += request_body
+    return request
+
+
+def legacy_parse_stream(data: bytes) -> list:
+    """旧实现的解析方式: 逐帧切片并把剩余数据切片保留"""
+    frames = []
+    while len(data) >= 5:
+        type_length = struct.unpack(">B", data[0:1])[0]
+        body_length = struct.unpack(">I", data[1 + type_length:5 + type_length])[0]
+        end = 5 + type_length + body_length
+        frames.append((data[1:1 + type_length], data[5 + type_length:end]))
+        data = data[end:]
+    return frames
+
+
+class NullTransport:
+    r"""
+    模拟可写状态下的asyncio传输层: write直接"发送"不保留数据, writelines使用Python 3.11的默认实现(b"".join后write)
+    只用于统计帧构建与写入阶段产生的分配, 不实际发送
+    """
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data: bytes):
+        self.written += len(data)
+
+    def writelines(self, chunks: list):
+        self.write(b"".join(chunks))
+
+
+def traced(func) -> tuple:
+    r"""
+    执行func并统计内存分配, func的返回值在统计结束前保持引用
+    :return: (峰值内存增量字节数, 耗时秒)
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    del result
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="帧编解码内存分配基准测试")
+    parser.add_argument("--body-size", type=int, default=65536, help="每帧响应体字节数")
+    parser.add_argument("--batch", type=int, default=64, help="每批帧数, 对应服务器一次读取解析出的请求数")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    body = b"x" * args.body_size
+    batch = args.batch
+
+    def legacy_encode():
+        # 保留整批帧, 峰值即为编码阶段的分配总量
+        return [legacy_create_response(0, body) for _ in range(batch)]
+
+    def framed_encode():
+        return [F_Frame.encode_response(0, body) for _ in range(batch)]
+
+    def legacy_request():
+        return [legacy_create_request("c:ping", body) for _ in range(batch)]
+
+    def framed_request():
+        return [F_Frame.encode_request("c:ping", body) for _ in range(batch)]
+
+    def legacy_send():
+        # 旧实现: 每个响应拼接后write
+        for _ in range(args.rounds):
+            transport = NullTransport()
+            for _ in range(batch):
+                transport.write(legacy_create_response(0, body))
+
+    def framed_send():
+        # 新实现: 与服务器相同, 整批分段交给write_frames
+        for _ in range(args.rounds):
+            transport = NullTransport()
+            chunks = []
+            for _ in range(batch):
+                chunks.extend(F_Frame.encode_response(0, body))
+            F_Frame.write_frames(transport, chunks)
+
+    stream = b"".join(legacy_create_request("c:ping", body) for _ in range(batch))
+    assert legacy_parse_stream(stream) == F_Frame.RequestDecoder(None).feed(stream)
+    assert b"".join(F_Frame.encode_response(0, body)) == legacy_create_response(0, body)
+    assert b"".join(F_Frame.encode_request("c:ping", body)) == legacy_create_request("c:ping", body)
+
+    def legacy_parse():
+        for _ in range(args.rounds):
+            legacy_parse_stream(stream)
+
+    def framed_parse():
+        for _ in range(args.rounds):
+            F_Frame.RequestDecoder(None).feed(stream)
+
+    print(f"body {args.body_size} B x batch {batch} x {args.rounds} rounds, writelines scatter: {F_Frame._SCATTER_WRITELINES}")
+    # 响应体短于DIRECT_WRITE_SIZE时write_frames会有意合并分段以减少系统调用, send一行的峰值因此可能高于旧实现
+    print(f"{'':>16}  {'legacy peak':>12} {'new peak':>12} {'reduction':>10} {'speedup':>8}")
+    for name, legacy, framed in (
+        ("response encode", legacy_encode, framed_encode),
+        ("request encode", legacy_request, framed_request),
+        ("response send", legacy_send, framed_send),
+        ("request decode", legacy_parse, framed_parse)
+    ):
+        legacy_peak, legacy_time = traced(legacy)
+        framed_peak, framed_time = traced(framed)
+        print(f"{name:>16}: {legacy_peak / 1024:>9.0f} KiB {framed_peak / 1024:>9.0f} KiB "
+              f"{(1 - framed_peak / legacy_peak) * 100:>9.1f}% {legacy_time / framed_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+r"""
+玩家列表序列化基准测试
+对比旧实现(每次请求加锁并重新json.dumps)与预编码缓存的吞吐量
+运行: python -m benchmarks.bench_profiles_list --players 200
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import struct
+import time
+from Florolding import F_Server, F_Client
+
+
+def player_data(index: int) -> dict:
+    return {
+        "name": f"Player_{index}",
+        "machine_id": f"{index:032x}",
+        "easytier_id": 100000 + index,
+        "vendor": "Florolding"
+    }
+
+
+async def measure(func, seconds: float, batch: int = 1) -> float:
+    """在seconds秒内反复执行func, 返回每秒请求数"""
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        await func()
+        count += batch
+    return count / (time.perf_counter() - start)
+
+
+async def run(players: int, seconds: float, batch: int):
+    server = F_Server.AsyncFloroldingServer("0" * 32, 1, "Host", "127.0.0.1", 0)
+    server_task = asyncio.create_task(server.start())
+    while server.server is None:
+        await asyncio.sleep(0.01)
+    port = server.server.sockets[0].getsockname()[1]
+
+    client = F_Client.AsyncFloroldingClient("f" * 32, 2, "Bench", server_port=port)
+    await client.connect()
+    # 通过真实心跳请求让服务器上有players个玩家(包括房主与测试客户端自身), 每个连接只能登记一个玩家
+    guests = {i: F_Client.AsyncFloroldingClient(f"{i:032x}", 100000 + i, f"Player_{i}", server_port=port, heartbeat_interval=None) for i in range(2, players)}
+    for guest in guests.values():
+        await guest.connect()
+    await asyncio.gather(*(guest.send_request("c:player_ping", json.dumps(player_data(i)).encode("utf-8")) for i, guest in guests.items()))
+
+    # 旧实现: 每次请求都加锁并重新编码整个玩家列表
+    async def legacy_handler():
+        async with server.lock:
+            return 0, json.dumps(list(server.players.values())).encode("utf-8")
+
+    async def cached_handler():
+        return 0, server.player_profiles_snapshot()
+
+    generation, _ = await client.f_player_profiles_list()
+    requests = [("c:player_profiles_list", b"")] * batch
+    not_modified = [("f:player_profiles_list", struct.pack(">Q", generation))] * batch
+
+    results = {
+        "players": len(server.players),
+        "payload_bytes": len(server.player_profiles_snapshot()),
+        "handler_before_rps": await measure(legacy_handler, seconds),
+        "handler_after_rps": await measure(cached_handler, seconds),
+        "tcp_profiles_list_rps": await measure(lambda: client.send_many(requests), seconds, batch),
+        "tcp_not_modified_rps": await measure(lambda: client.send_many(not_modified), seconds, batch)
+    }
+
+    await client.disconnect()
+    for guest in guests.values():
+        await guest.disconnect()
+    # 等待服务器处理完连接关闭
+    await asyncio.sleep(0.1)
+    await server.stop()
+    server_task.cancel()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="玩家列表序列化基准测试")
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--batch", type=int, default=32, help="每批流水线请求数")
+    args = parser.parse_args()
+    # 屏蔽服务器与客户端的控制台输出, 避免影响测量
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = asyncio.run(run(args.players, args.seconds, args.batch))
+    for key, value in results.items():
+        print(f"{key:>24}: {value:,.0f}")
+    print(f"{'handler speedup':>24}: {results['handler_after_rps'] / results['handler_before_rps']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+r"""
+TCP转发CPU占用基准测试
+转发运行在单独的进程中, 客户端经转发向接收端单向发送数据, 统计转发进程每GiB数据消耗的CPU时间;
+对比asyncio流式转发(每块数据产生新的bytes对象)、Relay复用缓冲区与Relay使用os.splice
+运行: python -m benchmarks.bench_relay --size 1024 --connections 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import time
+from Florolding import Relay
+
+
+async def stream_relay(remote_port: int, ready, done):
+    """旧方式的参照: asyncio流读取后写入"""
+    async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", remote_port)
+        await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer), return_exceptions=True)
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    ready.send(server.sockets[0].getsockname()[1])
+    await asyncio.to_thread(done.recv)
+    server.close()
+
+
+async def relay_process_main(mode: str, remote_port: int, ready, done):
+    if mode == "stream":
+        await stream_relay(remote_port, ready, done)
+        return
+    relay = Relay.TcpRelay("127.0.0.1", remote_port, zero_copy=mode == "splice", idle_timeout=None)
+    await relay.start()
+    ready.send(relay.local_port)
+    await asyncio.to_thread(done.recv)
+    await relay.stop()
+
+
+def relay_process(mode: str, remote_port: int, ready, done):
+    asyncio.run(relay_process_main(mode, remote_port, ready, done))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    ready.send(usage.ru_utime + usage.ru_stime)
+
+
+async def transfer(port: int, size: int, connections: int):
+    chunk = b"x" * 65536
+    per_connection = size // connections
+
+    async def send():
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        for _ in range(per_connection // len(chunk)):
+            writer.write(chunk)
+            await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*(send() for _ in range(connections)))
+
+
+async def run(mode: str, size: int, connections: int) -> tuple:
+    received = 0
+    finished = asyncio.Event()
+
+    async def sink(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        nonlocal received
+        while data := await reader.read(262144):
+            received += len(data)
+        writer.close()
+        if received >= size:
+            finished.set()
+
+    server = await asyncio.start_server(sink, "127.0.0.1", 0)
+    ready_reader, ready_writer = multiprocessing.Pipe(duplex=False)
+    done_reader, done_writer = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=relay_process, args=(mode, server.sockets[0].getsockname()[1], ready_writer, done_reader))
+    process.start()
+    port = await asyncio.to_thread(ready_reader.recv)
+    start = time.perf_counter()
+    await transfer(port, size, connections)
+    await finished.wait()
+    elapsed = time.perf_counter() - start
+    done_writer.send(None)
+    cpu = await asyncio.to_thread(ready_reader.recv)
+    await asyncio.to_thread(process.join)
+    server.close()
+    return cpu, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP转发CPU占用基准测试")
+    parser.add_argument("--size", type=int, default=1024, help="传输的数据量(MiB)")
+    parser.add_argument("--connections", type=int, default=4, help="并发连接数")
+    args = parser.parse_args()
+    size = args.size * 1024 * 1024 // (65536 * args.connections) * 65536 * args.connections
+
+    modes = ["stream", "buffer"] + (["splice"] if Relay._SPLICE else [])
+    print(f"{size / 2 ** 20:.0f} MiB over {args.connections} connections")
+    print(f"{'mode':>8} {'relay cpu s':>12} {'cpu s/GiB':>10} {'MiB/s':>8}")
+    for mode in modes:
+        cpu, elapsed = asyncio.run(run(mode, size, args.connections))
+        print(f"{mode:>8} {cpu:>12.2f} {cpu / (size / 2 ** 30):>10.2f} {size / 2 ** 20 / elapsed:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+r"""
+房间码生成与验证基准测试
+对比旧的逐字符实现与查找表/批量/NumPy实现, 并验证编码与验证结果一致
+运行: python -m benchmarks.bench_room_codes --count 100000
+"""
+import argparse
+import random
+import time
+from Florolding import Scaffolding
+
+
+def legacy_generate_code() -> str:
+    """旧实现"""
+    charset: str = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+    max_value = 34 ** 16
+    value = random.randrange(0, max_value, 7)
+    code_chars = []
+    temp_value = value
+    for i in range(16):
+        code_chars.append(charset[temp_value % 34])
+        temp_value //= 34
+    code_str = "".join(code_chars)
+    return f"U/{code_str[0:4]}-{code_str[4:8]}-{code_str[8:12]}-{code_str[12:16]}"
+
+
+def legacy_validate_code(code: str) -> bool:
+    """旧实现"""
+    charset = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+    if not code.startswith("U/"):
+        return False
+    parts = code[2:].split("-")
+    if len(parts) != 4 or any(len(part) != 4 for part in parts):
+        return False
+    all_chars = "".join(parts)
+    for char in all_chars:
+        if char not in charset:
+            return False
+    total = 0
+    for i, char in enumerate(all_chars):
+        char_value = charset.index(char)
+        total += char_value * (34 ** i)
+    return total % 7 == 0
+
+
+def mutate(code: str) -> str:
+    """随机改动一个字符, 得到多数无效的样本"""
+    index = random.randrange(len(code))
+    return code[:index] + random.choice("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ-/u") + code[index + 1:]
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def legacy_format_code(value: int) -> str:
+    """旧实现的数值转房间码部分"""
+    charset: str = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+    code_chars = []
+    for i in range(16):
+        code_chars.append(charset[value % 34])
+        value //= 34
+    code_str = "".join(code_chars)
+    return f"U/{code_str[0:4]}-{code_str[4:8]}-{code_str[8:12]}-{code_str[12:16]}"
+
+
+def check_compatibility(count: int):
+    """相同数值得到相同房间码, 新生成的房间码都能通过验证, 且新旧验证结果一致"""
+    values = [random.randrange(0, 34 ** 16, 7) for _ in range(count)]
+    assert [Scaffolding._format_code(value) for value in values] == [legacy_format_code(value) for value in values]
+    legacy_codes = [legacy_generate_code() for _ in range(count)]
+    assert all(legacy_validate_code(code) for code in Scaffolding.generate_codes(count, use_numpy=False))
+    assert all(legacy_validate_code(code) for code in (Scaffolding.generate_code() for _ in range(count)))
+    samples = legacy_codes + [mutate(code) for code in legacy_codes] + ["", "U/", "U/0000-0000-0000-000", "U/0000-0000-0000-0000-"]
+    expected = [legacy_validate_code(code) for code in samples]
+    assert [Scaffolding.validate_code(code) for code in samples] == expected
+    assert Scaffolding.validate_codes(samples, use_numpy=False) == expected
+    if Scaffolding.numpy is not None:
+        assert Scaffolding.validate_codes(samples, use_numpy=True) == expected
+        assert all(Scaffolding.validate_codes(Scaffolding.generate_codes(count, use_numpy=True), use_numpy=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="房间码生成与验证基准测试")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    count = args.count
+
+    check_compatibility(min(count, 20000))
+    print("✓ 新旧实现结果一致")
+
+    codes = [legacy_generate_code() for _ in range(count)]
+    samples = codes + [mutate(code) for code in codes]
+    results = {
+        "generate legacy": timed(lambda: [legacy_generate_code() for _ in range(count)]),
+        "generate single": timed(lambda: [Scaffolding.generate_code() for _ in range(count)]),
+        "generate batch": timed(lambda: Scaffolding.generate_codes(count, use_numpy=False)),
+        "validate legacy": timed(lambda: [legacy_validate_code(code) for code in samples]),
+        "validate single": timed(lambda: [Scaffolding.validate_code(code) for code in samples]),
+        "validate batch": timed(lambda: Scaffolding.validate_codes(samples, use_numpy=False))
+    }
+    if Scaffolding.numpy is not None:
+        results["generate numpy"] = timed(lambda: Scaffolding.generate_codes(count, use_numpy=True))
+        results["validate numpy"] = timed(lambda: Scaffolding.validate_codes(samples, use_numpy=True))
+    for name, seconds in results.items():
+        operations = count if name.startswith("generate") else len(samples)
+        legacy = results["generate legacy" if name.startswith("generate") else "validate legacy"]
+        print(f"{name:>16}: {operations / seconds:>12,.0f} ops/s  {legacy / seconds:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+r"""
+多进程房间托管扩展性基准测试
+分别以不同的工作进程数启动ShardedRoomHost, 每个工作进程至少托管一个房间, 再为每个房间启动一个客户端进程,
+以闭环方式(每个连接收到响应后立即发送下一个请求)发送c:ping, 统计总吞吐量与相对单进程的扩展效率
+客户端同样占用CPU, 核心数不少于工作进程数的两倍时结果才有参考意义
+
+运行: python -m benchmarks.bench_sharded --workers 1 2 4 --connections 32 --duration 10
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from Florolding import ShardedHost, F_Client
+
+
+async def drive_room(host: str, port: int, connections: int, duration: float) -> int:
+    """向一个房间发送c:ping直到测试结束, 返回成功的请求数"""
+    deadline = time.perf_counter() + duration
+    completed = 0
+
+    async def connection(index: int):
+        nonlocal completed
+        client = F_Client.AsyncFloroldingClient(f"{index:032x}", index, f"Bench_{index}", host, port, heartbeat_interval=None)
+        await client.connect()
+        try:
+            while time.perf_counter() < deadline:
+                status, _ = await client.send_request("c:ping", b"bench")
+                if status == 0:
+                    completed += 1
+        finally:
+            await client.disconnect()
+
+    await asyncio.gather(*(connection(index + 1) for index in range(connections)))
+    return completed
+
+
+def client_process(host: str, port: int, connections: int, duration: float) -> int:
+    return asyncio.run(drive_room(host, port, connections, duration))
+
+
+async def run(workers: int, args: argparse.Namespace) -> float:
+    async with ShardedHost.ShardedRoomHost(workers=workers, server_host=args.host, player_name="BenchHost") as host:
+        # 房间按房间码哈希分配, 创建房间直到每个工作进程都至少有一个
+        rooms = {}
+        for _ in range(workers * 64):
+            info = await host.create_room()
+            rooms.setdefault(info["worker"], info["server_port"])
+            if len(rooms) == workers:
+                break
+        loop = asyncio.get_running_loop()
+        with multiprocessing.Pool(len(rooms)) as pool:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(
+                loop.run_in_executor(None, pool.apply, client_process, (args.host, port, args.connections, args.duration))
+                for port in rooms.values()
+            ))
+            elapsed = time.perf_counter() - start
+        return sum(results) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程房间托管扩展性基准测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="依次测试的工作进程数")
+    parser.add_argument("--connections", type=int, default=32, help="每个房间的并发连接数")
+    parser.add_argument("--duration", type=float, default=10, help="每轮测试时长(秒)")
+    parser.add_argument("--host", default="127.0.0.1")
+    args = parser.parse_args()
+
+    print(f"cpu: {os.cpu_count()}, uvloop: {ShardedHost.uvloop is not None}, connections per room: {args.connections}")
+    print(f"{'workers':>8} {'rps':>12} {'speedup':>8} {'efficiency':>10}")
+    baseline = None
+    for workers in args.workers:
+        rps = asyncio.run(run(workers, args))
+        baseline = baseline or rps / workers
+        print(f"{workers:>8} {rps:>12.0f} {rps / baseline:>7.2f}x {rps / baseline / workers * 100:>9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+r"""
+Scaffolding服务器压力测试
+模拟N个客户端按配置的频率混合发送c:ping、c:player_ping、c:server_port与c:player_profiles_list,
+统计吞吐量、p50/p99延迟与服务器内存占用, 结果保存为JSON便于在版本之间比较
+
+运行:
+    python -m benchmarks.loadtest --clients 200 --duration 30 --output result.json
+    python -m benchmarks.loadtest --mode subprocess --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from Florolding import F_Server, F_Client
+
+# 各类请求的默认频率(每个客户端每秒)
+DEFAULT_RATES = {
+    "c:ping": 1.0,
+    "c:player_ping": 0.2,
+    "c:server_port": 0.2,
+    "c:player_profiles_list": 0.5
+}
+
+
+def read_rss_kb(pid: int | None = None) -> dict | None:
+    r"""
+    读取进程内存占用
+    :param pid: 进程ID, 默认为当前进程
+    :return: {"rss_kb": 当前占用, "peak_kb": 峰值}, 无法读取时返回None
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/status", "r", encoding="utf-8") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"rss_kb": int(fields["VmRSS"].split()[0]), "peak_kb": int(fields["VmHWM"].split()[0])}
+    except (OSError, KeyError, ValueError):
+        pass
+    if pid is None:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS的ru_maxrss单位为字节
+            peak = peak // 1024 if sys.platform == "darwin" else peak
+            return {"rss_kb": None, "peak_kb": peak}
+        except ImportError:
+            pass
+    return None
+
+
+def percentile(sorted_values: list, q: float) -> float | None:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(latencies: list, errors: int, duration: float) -> dict:
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None
+    }
+
+
+class SimulatedClient:
+    """单个模拟客户端, 心跳按固定间隔发送, 其他请求按泊松过程独立发送"""
+
+    def __init__(self, index: int, host: str, port: int, rates: dict, timeout: float):
+        self.machine_id = f"{index:032x}"
+        self.client = F_Client.AsyncFloroldingClient(
+            self.machine_id, index, f"Load_{index}", host, port,
+            request_timeout=timeout, heartbeat_interval=None
+        )
+        self.rates = rates
+        self.latencies = {protocol_type: [] for protocol_type in rates}
+        self.errors = {protocol_type: 0 for protocol_type in rates}
+        self.player_ping_body = json.dumps({
+            "name": f"Load_{index}",
+            "machine_id": self.machine_id,
+            "easytier_id": index,
+            "vendor": "Florolding"
+        }).encode("utf-8")
+
+    def request_body(self, protocol_type: str) -> bytes:
+        if protocol_type == "c:player_ping":
+            return self.player_ping_body
+        if protocol_type == "c:ping":
+            return b"load test"
+        return b""
+
+    async def drive(self, protocol_type: str, rate: float, deadline: float):
+        # 心跳与真实客户端一样按固定间隔发送(起始相位随机), 泊松间隔偶尔会超过服务器的玩家超时时间而被当成掉线
+        periodic = protocol_type == "c:player_ping"
+        delay = random.uniform(0, 1 / rate) if periodic else None
+        while True:
+            if not periodic:
+                delay = random.expovariate(rate)
+            if time.perf_counter() + delay >= deadline:
+                # 下一次请求已超出测试时间, 不必等待
+                return
+            await asyncio.sleep(delay)
+            if periodic:
+                delay = 1 / rate
+            start = time.perf_counter()
+            try:
+                status, _ = await self.client.send_request(protocol_type, self.request_body(protocol_type))
+            except (OSError, RuntimeError, asyncio.TimeoutError):
+                self.errors[protocol_type] += 1
+                continue
+            if status != 0:
+                self.errors[protocol_type] += 1
+            else:
+                self.latencies[protocol_type].append(time.perf_counter() - start)
+
+    async def run(self, deadline: float):
+        await self.client.connect()
+        # 先注册玩家, 使玩家列表规模与客户端数一致
+        await self.client.send_request("c:player_ping", self.player_ping_body)
+        try:
+            await asyncio.gather(*(
+                self.drive(protocol_type, rate, deadline)
+                for protocol_type, rate in self.rates.items() if rate > 0
+            ))
+        finally:
+            await self.client.disconnect()
+
+
+async def start_inprocess_server(host: str) -> tuple:
+    server = F_Server.AsyncFloroldingServer("0" * 32, 0, "LoadHost", host, 0)
+    task = asyncio.create_task(server.start())
+    while server.server is None:
+        await asyncio.sleep(0.01)
+    return server, task, server.server.sockets[0].getsockname()[1]
+
+
+def start_subprocess_server(host: str) -> tuple:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.loadtest", "--serve", "--host", host],
+        stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    # 子进程启动后第一行输出监听端口
+    return process, int(process.stdout.readline())
+
+
+async def run_load(args: argparse.Namespace, rates: dict) -> dict:
+    server = server_task = process = None
+    port = args.port
+    if args.port is None:
+        if args.mode == "subprocess":
+            process, port = start_subprocess_server(args.host)
+        else:
+            server, server_task, port = await start_inprocess_server(args.host)
+    try:
+        clients = [SimulatedClient(index + 1, args.host, port, rates, args.timeout) for index in range(args.clients)]
+        # 分批建立连接, 避免瞬间打满监听队列
+        start = time.perf_counter()
+        deadline = start + args.ramp_up + args.duration
+        tasks = []
+        for client in clients:
+            tasks.append(asyncio.create_task(client.run(deadline)))
+            await asyncio.sleep(args.ramp_up / max(1, args.clients))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = min(time.perf_counter(), deadline) - start - args.ramp_up
+        memory = read_rss_kb(process.pid if process else None) if args.port is None else None
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if server is not None:
+            await asyncio.sleep(0.1)
+            await server.stop()
+            server_task.cancel()
+
+    per_protocol = {}
+    all_latencies = []
+    total_errors = 0
+    for protocol_type in rates:
+        latencies = [latency for client in clients for latency in client.latencies[protocol_type]]
+        errors = sum(client.errors[protocol_type] for client in clients)
+        all_latencies.extend(latencies)
+        total_errors += errors
+        per_protocol[protocol_type] = summarize(latencies, errors, elapsed)
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "mode": args.mode if args.port is None else "external",
+            "clients": args.clients,
+            "duration": args.duration,
+            "rates": rates
+        },
+        "failed_clients": sum(1 for result in results if isinstance(result, Exception)),
+        "total": summarize(all_latencies, total_errors, elapsed),
+        "protocols": per_protocol,
+        "server_memory": memory
+    }
+
+
+def compare(result: dict, baseline: dict):
+    """打印与基准结果的差异"""
+    print("\n与基准结果比较:")
+    for name in ["total", *result.get("protocols")]:
+        current = result.get("total") if name == "total" else result.get("protocols").get(name)
+        previous = baseline.get("total") if name == "total" else baseline.get("protocols", {}).get(name)
+        if not previous:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p99_ms"):
+            if current.get(key) and previous.get(key):
+                changes.append(f"{key} {(current.get(key) / previous.get(key) - 1) * 100:+.1f}%")
+        print(f"{name:>24}: {', '.join(changes)}")
+
+
+def print_result(result: dict):
+    print(f"{'':>24}  {'requests':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, summary in [("total", result.get("total")), *result.get("protocols").items()]:
+        p50 = f"{summary['p50_ms']:.2f}" if summary["p50_ms"] is not None else "-"
+        p99 = f"{summary['p99_ms']:.2f}" if summary["p99_ms"] is not None else "-"
+        print(f"{name:>24}: {summary['requests']:>9} {summary['errors']:>7} {summary['throughput_rps']:>10.1f} {p50:>8} {p99:>8}")
+    if result.get("server_memory"):
+        print(f"{'server memory':>24}: {result['server_memory']}")
+
+
+async def serve(host: str):
+    """--serve模式: 只运行服务器, 供subprocess模式使用; inprocess模式的内存为整个测试进程的占用"""
+    server, task, port = await start_inprocess_server(host)
+    print(port, flush=True)
+    await task
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaffolding服务器压力测试")
+    parser.add_argument("--clients", type=int, default=100, help="模拟客户端数量")
+    parser.add_argument("--duration", type=float, default=10, help="测试时长(秒)")
+    parser.add_argument("--ramp-up", type=float, default=1, help="建立全部连接所用时间(秒)")
+    parser.add_argument("--mode", choices=("inprocess", "subprocess"), default="subprocess", help="服务器运行方式")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="测试已经运行的服务器, 不再自行启动")
+    parser.add_argument("--timeout", type=float, default=10, help="单次请求超时时间(秒)")
+    for protocol_type, rate in DEFAULT_RATES.items():
+        option = protocol_type.split(":", 1)[1].replace("_", "-")
+        parser.add_argument(f"--{option}-rate", type=float, default=rate, help=f"每个客户端每秒发送{protocol_type}的次数")
+    parser.add_argument("--output", help="保存JSON结果的路径")
+    parser.add_argument("--compare", help="与之前保存的JSON结果比较")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.host))
+        return
+    rates = {
+        protocol_type: getattr(args, protocol_type.split(":", 1)[1] + "_rate")
+        for protocol_type in DEFAULT_RATES
+    }
+    result = asyncio.run(run_load(args, rates))
+    print_result(result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
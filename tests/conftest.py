@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import socket
+import pytest
+
+FAKE_EASYTIER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_easytier")
+
+
+@pytest.fixture
+def fake_easytier(tmp_path, monkeypatch) -> dict:
+    r"""
+    tests/fake_easytier中的easytier-core与easytier-cli替身
+    :return: {"core": 路径, "cli": 路径, "log": 启动记录, "cli_log": easytier-cli调用记录, "unhealthy": 存在时健康检查失败的文件}
+    """
+    paths = {
+        "core": os.path.join(FAKE_EASYTIER_DIR, "easytier-core"),
+        "cli": os.path.join(FAKE_EASYTIER_DIR, "easytier-cli"),
+        "log": str(tmp_path / "core.log"),
+        "cli_log": str(tmp_path / "cli.log"),
+        "unhealthy": str(tmp_path / "unhealthy")
+    }
+    monkeypatch.setenv("FAKE_ET_LOG", paths["log"])
+    monkeypatch.setenv("FAKE_ET_CLI_LOG", paths["cli_log"])
+    monkeypatch.setenv("FAKE_ET_UNHEALTHY", paths["unhealthy"])
+    return paths
+
+
+def read_log(path: str) -> list:
+    """读取替身的JSON行记录"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+async def start_socks5_proxy(targets: list, resolve=None, reply: int = 0) -> asyncio.Server:
+    r"""
+    最小的SOCKS5代理, 只支持无认证与IPv4/域名的CONNECT
+    :param targets: 收到的CONNECT目标(host, port)追加到此列表
+    :param resolve: resolve(host, port) -> (host, port), 实际连接的地址, 默认把目标换成127.0.0.1
+    :param reply: 非0时以该应答码拒绝CONNECT
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readexactly(3)
+            writer.write(b"\x05\x00")
+            _, _, _, address_type = await reader.readexactly(4)
+            if address_type == 1:
+                host = socket.inet_ntoa(await reader.readexactly(4))
+            else:
+                host = (await reader.readexactly((await reader.readexactly(1))[0])).decode("idna")
+            port = int.from_bytes(await reader.readexactly(2), "big")
+            targets.append((host, port))
+            if reply:
+                writer.write(bytes([5, reply, 0, 1, 0, 0, 0, 0, 0, 0]))
+                await writer.drain()
+                return
+            upstream_reader, upstream_writer = await asyncio.open_connection(*(resolve(host, port) if resolve else ("127.0.0.1", port)))
+            writer.write(b"\x05\x00\x00\x01" + socket.inet_aton("127.0.0.1") + (0).to_bytes(2, "big"))
+
+            async def pipe(src: asyncio.StreamReader, dst: asyncio.StreamWriter):
+                while data := await src.read(65536):
+                    dst.write(data)
+                    await dst.drain()
+                dst.write_eof()
+
+            await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer), return_exceptions=True)
+            upstream_writer.close()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from Florolding import F_Client, F_Server
+
+
+async def start_server(port: int = 0, **options) -> F_Server.AsyncFloroldingServer:
+    server = F_Server.AsyncFloroldingServer("host", 1, "Host", "127.0.0.1", port, **options)
+    await server.listen()
+    return server
+
+
+def drop_connections(server: F_Server.AsyncFloroldingServer):
+    """服务器端直接断开全部连接"""
+    for writer in list(server.connections):
+        writer.transport.abort()
+
+
+def test_idempotent_requests_are_replayed_after_reconnect():
+    async def main():
+        server = await start_server()
+        gate = asyncio.Event()
+        calls = []
+
+        async def slow(request_body):
+            calls.append(request_body)
+            if len(calls) == 1:
+                # 第一次调用一直等待, 期间连接被断开
+                await gate.wait()
+            return 0, request_body
+
+        server.register_handler("f:slow", slow)
+        server.register_handler("f:once", slow)
+        client = F_Client.AsyncFloroldingClient("guest", 2, server_port=server.server_port, heartbeat_interval=None, auto_reconnect=True)
+        client.idempotent_protocols.add("f:slow")
+        await client.connect()
+        try:
+            replayed = asyncio.create_task(client.send_request("f:slow", b"replayed"))
+            # f:once排在f:slow之后, 断线时尚未得到响应
+            not_replayed = asyncio.create_task(client.send_request("f:once", b"once"))
+            while not calls:
+                await asyncio.sleep(0.01)
+            drop_connections(server)
+            result = await replayed
+            with pytest.raises(ConnectionError):
+                await not_replayed
+            # 重连后的连接可以继续使用
+            after = await client.send_request("c:ping", b"after")
+            return result, after, list(calls)
+        finally:
+            gate.set()
+            await client.disconnect()
+            await server.stop()
+
+    result, after, calls = asyncio.run(main())
+    assert result == (0, b"replayed")
+    assert after == (0, b"after")
+    assert calls == [b"replayed", b"replayed"]
+
+
+def test_requests_wait_for_server_restart():
+    async def main():
+        server = await start_server()
+        port = server.server_port
+        client = F_Client.AsyncFloroldingClient("guest", 2, server_port=port, heartbeat_interval=None, auto_reconnect=True, max_backoff=0.2)
+        await client.connect()
+        try:
+            await server.stop()
+            request = asyncio.create_task(client.send_request("c:ping", b"restart"))
+            await asyncio.sleep(0.5)
+            assert not request.done()
+            server = await start_server(port)
+            return await request
+        finally:
+            await client.disconnect()
+            await server.stop()
+
+    assert asyncio.run(main()) == (0, b"restart")
+
+
+def test_reconnect_gives_up_after_attempts():
+    async def main():
+        server = await start_server()
+        client = F_Client.AsyncFloroldingClient("guest", 2, server_port=server.server_port, heartbeat_interval=None, auto_reconnect=True,
+                                                reconnect_attempts=2, max_backoff=0.05)
+        await client.connect()
+        await server.stop()
+        try:
+            with pytest.raises(ConnectionError):
+                await client.send_request("c:ping", b"lost")
+        finally:
+            await client.disconnect()
+
+    asyncio.run(main())
+
+
+def test_heartbeat_registers_player_again_after_reconnect():
+    async def main():
+        server = await start_server(player_timeout=None)
+        client = F_Client.AsyncFloroldingClient("guest", 2, "Guest", server_port=server.server_port, heartbeat_interval=30, auto_reconnect=True)
+        await client.connect()
+        try:
+            await asyncio.wait_for(wait_for_changes(server, 1), 5)
+            drop_connections(server)
+            # 心跳间隔为30秒, 重连后立即发送的心跳使玩家重新加入
+            await asyncio.wait_for(wait_for_changes(server, 3), 5)
+            return [kind for _, _, kind in server.players_changes], server.players["guest"]["name"]
+        finally:
+            await client.disconnect()
+            await server.stop()
+
+    assert asyncio.run(main()) == (["join", "leave", "join"], "Guest")
+
+
+async def wait_for_changes(server: F_Server.AsyncFloroldingServer, count: int):
+    while len(server.players_changes) < count:
+        await asyncio.sleep(0.01)
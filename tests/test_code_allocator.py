@@ -0,0 +1,73 @@
+import asyncio
+import os
+from Florolding import CodeAllocator, RoomManager, Scaffolding
+
+
+def test_allocate_claim_release():
+    allocator = CodeAllocator.CodeAllocator(reserve_size=8)
+    assert allocator.reserve() == 8
+    codes = allocator.allocate_block(20)
+    assert len(set(codes)) == 20 and all(Scaffolding.validate_code(code) for code in codes)
+    assert all(code in allocator for code in codes)
+    assert not allocator.claim(codes[0])
+    assert not allocator.claim("U/1000-0000-0000-0000")
+    code = Scaffolding.generate_code()
+    assert allocator.claim(code) and code in allocator
+    allocator.release(code)
+    assert code not in allocator and allocator.claim(code)
+
+
+def test_claimed_reserve_code_is_skipped():
+    allocator = CodeAllocator.CodeAllocator(reserve_size=2)
+    allocator.reserve()
+    first = allocator.reserved[0]
+    assert allocator.claim(first)
+    assert allocator.allocate() != first
+
+
+def test_bloom_filter():
+    bloom = CodeAllocator.BloomFilter(1000, 0.01)
+    codes = Scaffolding.generate_codes(1000)
+    for code in codes:
+        bloom.add(code)
+    assert all(code in bloom for code in codes)
+    false_positives = sum(code in bloom for code in Scaffolding.generate_codes(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_round_trip(tmp_path):
+    path = str(tmp_path / "codes.bloom")
+    bloom = CodeAllocator.BloomFilter(100)
+    bloom.add("U/0000-0000-0000-0000")
+    bloom.save(path)
+    loaded = CodeAllocator.BloomFilter.load(path)
+    assert "U/0000-0000-0000-0000" in loaded and (loaded.size, loaded.hash_count) == (bloom.size, bloom.hash_count)
+    with open(path, "ab") as f:
+        f.write(b"x")
+    # 文件损坏时重新开始记录
+    assert "U/0000-0000-0000-0000" not in CodeAllocator.CodeAllocator(bloom_path=path).bloom
+
+
+def test_released_code_is_not_reissued_after_restart(tmp_path):
+    path = str(tmp_path / "codes.bloom")
+    allocator = CodeAllocator.CodeAllocator(bloom_path=path)
+    code = allocator.allocate()
+    assert not os.path.exists(path)
+    allocator.release(code)
+    assert os.path.exists(path)
+    restarted = CodeAllocator.CodeAllocator(bloom_path=path)
+    assert code in restarted.bloom
+    assert restarted.claim(code)  # 外部指定的房间码不受限制
+    assert code not in restarted.allocate_block(10)
+
+
+def test_room_manager_saves_codes_on_shutdown(tmp_path):
+    path = str(tmp_path / "codes.bloom")
+
+    async def main():
+        async with RoomManager.RoomManager(server_host="127.0.0.1", code_allocator=CodeAllocator.CodeAllocator(bloom_path=path)) as manager:
+            room = await manager.create_room()
+            return room.code
+
+    code = asyncio.run(main())
+    assert code in CodeAllocator.BloomFilter.load(path)
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from Florolding import Downloader
+
+CHUNK = 1024
+DATA = os.urandom(CHUNK * 8 + 100)
+
+
+class AssetServer(ThreadingHTTPServer):
+    r"""
+    模拟GitHub Release: /asset重定向到每次都不同的签名地址, 签名地址支持Range
+    fail_after: 成功响应这么多个Range请求后, 之后的Range请求返回500
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), AssetHandler)
+        self.redirects = 0
+        self.ranges = []
+        self.fail_after = None
+        self.lock = threading.Lock()
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def __headers(self, status: int, length: int):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+    def __route(self) -> bool:
+        if self.path == "/asset":
+            with self.server.lock:
+                self.server.redirects += 1
+                signature = self.server.redirects
+            self.send_response(302)
+            self.send_header("Location", f"/signed?sig={signature}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return False
+        return True
+
+    def do_HEAD(self):
+        if self.__route():
+            self.__headers(200, len(DATA))
+
+    def do_GET(self):
+        if not self.__route():
+            return
+        start, end = (int(value) for value in self.headers.get("Range")[len("bytes="):].split("-"))
+        with self.server.lock:
+            failed = self.server.fail_after is not None and len(self.server.ranges) >= self.server.fail_after
+            if not failed:
+                self.server.ranges.append(start)
+        if failed:
+            self.__headers(500, 0)
+            return
+        self.__headers(206, end - start + 1)
+        self.wfile.write(DATA[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    server = AssetServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_resume_through_changing_redirect(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_address[1]}/asset"
+    path = str(tmp_path / "easytier.zip")
+    downloader = Downloader.ChunkedDownloader(chunk_size=CHUNK, workers=1, retries=1)
+
+    server.fail_after = 3
+    with pytest.raises(requests.HTTPError):
+        downloader.download(url, path)
+    assert not os.path.exists(path)
+    assert os.path.exists(f"{path}.part.json")
+
+    # 第二次被重定向到不同的签名地址, 仍应只下载剩余的块
+    server.fail_after = None
+    server.ranges.clear()
+    assert downloader.download(url, path, hashlib.sha256(DATA).hexdigest()) == path
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert sorted(server.ranges) == list(range(3 * CHUNK, len(DATA), CHUNK))
+    assert not os.path.exists(f"{path}.part.json")
+    assert server.redirects == 2
+
+
+def test_sha256_mismatch_removes_part(server, tmp_path):
+    url = f"http://127.0.0.1:{server.server_address[1]}/asset"
+    path = str(tmp_path / "easytier.zip")
+    with pytest.raises(ValueError):
+        Downloader.ChunkedDownloader(chunk_size=CHUNK).download(url, path, "0" * 64)
+    assert not os.path.exists(f"{path}.part")
+
+
+def test_install_keeps_windows_dlls(tmp_path):
+    url = "https://example.invalid/v2.4.5/easytier-windows-x86_64-v2.4.5.zip"
+    archive_path = tmp_path / "downloads" / "easytier-windows-x86_64-v2.4.5.zip"
+    archive_path.parent.mkdir()
+    files = ["easytier-core.exe", "easytier-cli.exe", "easytier-web.exe", "wintun.dll", "Packet.dll"]
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("easytier-windows-x86_64/", "")
+        for name in files:
+            archive.writestr(f"easytier-windows-x86_64/{name}", name)
+    install_dir = Downloader.install_easytier(cache_dir=str(tmp_path), url=url)
+    assert install_dir == str(tmp_path / "easytier" / "2.4.5")
+    assert sorted(os.listdir(install_dir)) == sorted(files)
+    with open(os.path.join(install_dir, "wintun.dll")) as f:
+        assert f.read() == "wintun.dll"
+    # 已安装时不再读取压缩包
+    os.remove(archive_path)
+    assert Downloader.install_easytier(cache_dir=str(tmp_path), url=url) == install_dir
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import shutil
+import socket
+import pytest
+from conftest import start_socks5_proxy, FAKE_EASYTIER_DIR, read_log
+from Florolding import Florolding, F_Server, Scaffolding, Supervisor
+
+
+def port_open(port: int) -> bool:
+    with socket.socket() as sock:
+        return sock.connect_ex(("127.0.0.1", port)) == 0
+
+
+def test_create_room_rejects_invalid_code(fake_easytier):
+    assert asyncio.run(Florolding.async_create_room(FAKE_EASYTIER_DIR, code="U/not-a-code", server_host="127.0.0.1")) is None
+    assert read_log(fake_easytier["log"]) == []
+
+
+def test_create_room_stops_server_when_launch_fails(fake_easytier, monkeypatch, tmp_path):
+    # easytier-core不可执行, 启动时抛出PermissionError
+    (tmp_path / "easytier-core").write_text("")
+    shutil.copy(fake_easytier["cli"], tmp_path / "easytier-cli")
+    ports = []
+    original_listen = F_Server.AsyncFloroldingServer.listen
+
+    async def listen(self, sock=None):
+        await original_listen(self, sock)
+        ports.append(self.server_port)
+
+    monkeypatch.setattr(F_Server.AsyncFloroldingServer, "listen", listen)
+    with pytest.raises(OSError):
+        asyncio.run(Florolding.async_create_room(str(tmp_path), server_host="127.0.0.1"))
+    assert ports and not port_open(ports[0])
+
+
+def test_create_room_restarts_crashed_core(fake_easytier, monkeypatch):
+    monkeypatch.setenv("FAKE_ET_EXIT_AFTER", "0.3")
+    monkeypatch.setenv("FAKE_ET_PEERS", json.dumps([{"id": 42, "cost": "Local", "hostname": "host", "ipv4": "10.0.0.1"}]))
+
+    async def main():
+        session = await Florolding.async_create_room(FAKE_EASYTIER_DIR, server_host="127.0.0.1", supervisor_options={"min_backoff": 0.05, "health_interval": 10})
+        try:
+            assert isinstance(session.easytier, Supervisor.EasyTierSupervisor)
+            while session.easytier.restarts < 2 or len(read_log(fake_easytier["log"])) < 3:
+                await asyncio.sleep(0.05)
+            # 每次重启后都重新获取easytier_id
+            while len([entry for entry in read_log(fake_easytier["cli_log"]) if "peer" in entry]) < 3:
+                await asyncio.sleep(0.05)
+            return session.server.players[session.server.machine_id]["easytier_id"], session.easytier.process
+        finally:
+            await session.close()
+
+    easytier_id, process = asyncio.run(main())
+    assert easytier_id == 42
+    assert len(read_log(fake_easytier["log"])) >= 3
+    # 关闭房间后easytier-core已结束
+    assert process.returncode is not None
+
+
+def test_join_room_fails_when_port_forward_fails(fake_easytier, monkeypatch):
+    async def main():
+        server = F_Server.AsyncFloroldingServer(None, 7, "host", "127.0.0.1", 0, 25565)
+        await server.listen()
+        monkeypatch.setenv("FAKE_ET_PEERS", json.dumps([{"id": 42, "cost": "Local", "hostname": "guest", "ipv4": "10.0.0.2"}, {"id": 7, "cost": "p2p", "hostname": f"scaffolding-mc-server-{server.server_port}", "ipv4": "127.0.0.1"}]))
+        monkeypatch.setenv("FAKE_ET_FORWARD_FAIL", "1")
+        try:
+            return await Florolding.async_join_room(FAKE_EASYTIER_DIR, Scaffolding.generate_code(), discover_timeout=5)
+        finally:
+            await server.stop()
+
+    assert asyncio.run(main()) is None
+    # easytier-core已启动并在失败后被终止
+    assert len(read_log(fake_easytier["log"])) == 1
+    assert any("port-forward" in args for args in read_log(fake_easytier["cli_log"]))
+
+
+def test_join_room_restores_port_forward_after_restart(fake_easytier, monkeypatch):
+    async def main():
+        server = F_Server.AsyncFloroldingServer("host", 7, "host", "127.0.0.1", 0, 25565)
+        await server.listen()
+        monkeypatch.setenv("FAKE_ET_PEERS", json.dumps([{"id": 42, "cost": "Local", "hostname": "guest", "ipv4": "10.0.0.2"}, {"id": 7, "cost": "p2p", "hostname": f"scaffolding-mc-server-{server.server_port}", "ipv4": "127.0.0.1"}]))
+        # 替身不会真的转发, 让客户端直接连接到服务器端口
+        monkeypatch.setattr(Florolding, "get_available_port", lambda: server.server_port)
+        session = await Florolding.async_join_room(FAKE_EASYTIER_DIR, Scaffolding.generate_code(), discover_timeout=5, heartbeat_interval=None,
+                                                   supervisor_options={"min_backoff": 0.05, "health_interval": 10})
+        try:
+            assert session is not None
+            session.easytier.process.kill()
+            while session.easytier.restarts < 1 or sum("port-forward" in args for args in read_log(fake_easytier["cli_log"])) < 2:
+                await asyncio.sleep(0.05)
+            return [args for args in read_log(fake_easytier["cli_log"]) if "port-forward" in args]
+        finally:
+            await session.close()
+            await server.stop()
+
+    forwards = asyncio.run(main())
+    assert len(forwards) == 2 and forwards[0] == forwards[1]
+    assert len(read_log(fake_easytier["log"])) == 2
+
+
+def test_join_room_relays_through_easytier_socks5(fake_easytier, monkeypatch):
+    targets = []
+
+    async def main():
+        server = F_Server.AsyncFloroldingServer("host", 7, "host", "127.0.0.1", 0, 25565)
+        await server.listen()
+        monkeypatch.setenv("FAKE_ET_PEERS", json.dumps([{"id": 42, "cost": "Local", "hostname": "guest", "ipv4": "10.0.0.2/24"}, {"id": 7, "cost": "p2p", "hostname": f"scaffolding-mc-server-{server.server_port}", "ipv4": "10.0.0.1/24"}]))
+        # 替身不提供SOCKS5代理, 由测试代理把虚拟IP换成本机
+        proxy = await start_socks5_proxy(targets)
+        proxy_port = proxy.sockets[0].getsockname()[1]
+        monkeypatch.setattr(Florolding, "get_available_port", lambda: proxy_port)
+        session = await Florolding.async_join_room(FAKE_EASYTIER_DIR, Scaffolding.generate_code(), discover_timeout=5, relay=True, heartbeat_interval=None)
+        try:
+            assert session is not None
+            return proxy_port, server.server_port, {name: relay.info() for name, relay in session.relays.items()}
+        finally:
+            await session.close()
+            await server.stop()
+            proxy.close()
+            await proxy.wait_closed()
+
+    proxy_port, server_port, relays = asyncio.run(main())
+    args = read_log(fake_easytier["log"])[0]["args"]
+    # 不需要TUN, 经由easytier-core的SOCKS5代理访问房主
+    assert "--no-tun" in args
+    assert args[args.index("--socks5") + 1] == str(proxy_port)
+    assert targets[0] == ("10.0.0.1", server_port)
+    assert relays["scaffolding"]["proxy"] == relays["minecraft"]["proxy"] == f"127.0.0.1:{proxy_port}"
+    assert relays["minecraft"]["remote"] == "10.0.0.1:25565"
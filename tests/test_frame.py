@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from Florolding import F_Client, F_Frame, F_Server
+
+
+class RecordingWriter:
+    """记录write/writelines调用的StreamWriter替身"""
+
+    def __init__(self):
+        self.calls = []
+
+    def write(self, data):
+        self.calls.append(("write", data))
+
+    def writelines(self, chunks):
+        self.calls.append(("writelines", list(chunks)))
+
+    def data(self) -> bytes:
+        return b"".join(b"".join(data) if name == "writelines" else data for name, data in self.calls)
+
+
+def request_bytes(protocol_type: str, body: bytes = b"") -> bytes:
+    return b"".join(F_Frame.encode_request(protocol_type, body))
+
+
+def test_request_split_across_reads():
+    data = request_bytes("c:player_ping", b"x" * 100)
+    decoder = F_Frame.RequestDecoder()
+    frames = []
+    for index in range(len(data)):
+        frames += decoder.feed(data[index:index + 1])
+        if index < len(data) - 1:
+            assert decoder.pending == index + 1
+    assert frames == [(b"c:player_ping", b"x" * 100)]
+    assert decoder.pending == 0
+
+
+def test_coalesced_frames_with_trailing_partial():
+    first = request_bytes("c:ping", b"hello")
+    second = request_bytes("c:player_profiles_list")
+    third = request_bytes("c:ping", b"world")
+    decoder = F_Frame.RequestDecoder()
+    assert decoder.feed(first + second + third[:4]) == [(b"c:ping", b"hello"), (b"c:player_profiles_list", b"")]
+    assert decoder.pending == 4
+    assert decoder.feed(third[4:]) == [(b"c:ping", b"world")]
+    assert decoder.pending == 0
+
+
+def test_response_decoder():
+    data = b"".join(F_Frame.encode_response(0, b"ok") + F_Frame.encode_response(32, b""))
+    decoder = F_Frame.ResponseDecoder()
+    assert decoder.feed(data[:3]) == []
+    assert decoder.feed(data[3:]) == [(0, b"ok"), (32, b"")]
+
+
+def test_body_over_max_size_raises():
+    decoder = F_Frame.RequestDecoder(max_body_size=16)
+    assert decoder.feed(request_bytes("c:ping", b"x" * 16)) == [(b"c:ping", b"x" * 16)]
+    # 只收到头部就应拒绝, 不等待请求体
+    with pytest.raises(F_Frame.FrameError):
+        decoder.feed(request_bytes("c:ping", b"x" * 17)[:11])
+    with pytest.raises(F_Frame.FrameError):
+        F_Frame.ResponseDecoder(max_body_size=16).feed(b"".join(F_Frame.encode_response(0, b"x" * 17)))
+    assert F_Frame.RequestDecoder(max_body_size=None).feed(request_bytes("c:ping", b"x" * 17)) == [(b"c:ping", b"x" * 17)]
+
+
+def test_abstract_decoder():
+    with pytest.raises(TypeError):
+        F_Frame.FrameDecoder()
+
+
+@pytest.mark.parametrize("scatter", [True, False])
+def test_write_frames(monkeypatch, scatter):
+    monkeypatch.setattr(F_Frame, "_SCATTER_WRITELINES", scatter)
+    large = b"y" * F_Frame.DIRECT_WRITE_SIZE
+    chunks = F_Frame.encode_response(0, b"small") + F_Frame.encode_request("c:ping", large) + F_Frame.encode_response(0)
+    writer = RecordingWriter()
+    F_Frame.write_frames(writer, chunks)
+    assert writer.data() == b"".join(chunks)
+    if scatter:
+        assert writer.calls == [("writelines", chunks)]
+    else:
+        # 小分段合并写入, 大的请求体原样交给write
+        assert [name for name, _ in writer.calls] == ["write", "write", "write"]
+        assert writer.calls[1][1] is large
+
+
+def test_encode_does_not_copy_body():
+    body = b"z" * 100000
+    header, chunk = F_Frame.encode_request("c:ping", body)
+    assert chunk is body and header == b"\x06c:ping" + len(body).to_bytes(4, "big")
+    assert F_Frame.encode_response(0, body)[1] is body
+    assert F_Frame.encode_response(32) == [b"\x20\x00\x00\x00\x00"]
+    with pytest.raises(F_Frame.FrameError):
+        F_Frame.encode_request("c:" + "x" * 254)
+
+
+@pytest.mark.parametrize("scatter", [True, False])
+def test_large_pipelined_bodies_round_trip(monkeypatch, scatter):
+    monkeypatch.setattr(F_Frame, "_SCATTER_WRITELINES", scatter)
+    bodies = [bytes([index]) * size for index, size in enumerate((10, F_Frame.DIRECT_WRITE_SIZE, 300000, 0, 5))]
+
+    async def main():
+        server = F_Server.AsyncFloroldingServer("host", 1, "Host", "127.0.0.1", 0)
+        await server.listen()
+        client = F_Client.AsyncFloroldingClient("guest", 2, server_port=server.server_port, heartbeat_interval=None)
+        await client.connect()
+        try:
+            return await client.send_many([("c:ping", body) for body in bodies])
+        finally:
+            await client.disconnect()
+            await server.stop()
+
+    assert asyncio.run(main()) == [(0, body) for body in bodies]
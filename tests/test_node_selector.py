@@ -0,0 +1,43 @@
+import asyncio
+import socket
+from Florolding import NodeSelector
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_rank_nodes_against_local_listeners():
+    async def main():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        dead = closed_port()
+        addresses = [
+            f"tcp://127.0.0.1:{dead}",
+            f"tcp://127.0.0.1:{port}",
+            f"udp://127.0.0.1:{port}",
+            f"tcp://127.0.0.1:{port}",
+            f"wg://127.0.0.1:{dead}",
+            f"quic://127.0.0.1:{dead}",
+            "not an address"
+        ]
+        try:
+            return port, dead, await NodeSelector.rank_nodes(addresses, timeout=1), await NodeSelector.select_nodes(addresses, top_k=5, timeout=1)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    port, dead, ranked, selected = asyncio.run(main())
+    # 重复地址只测量一次, wg/quic只监听UDP而不测量, 不会被排在最后
+    assert {result["address"] for result in ranked[:2]} == {f"tcp://127.0.0.1:{port}", f"udp://127.0.0.1:{port}"}
+    assert all(result["success"] == 2 and result["rtt"] is not None for result in ranked[:2])
+    assert ranked[2]["address"] == f"tcp://127.0.0.1:{dead}" and ranked[2]["success"] == 0
+    assert len(ranked) == 3
+    assert sorted(selected) == sorted([f"tcp://127.0.0.1:{port}", f"udp://127.0.0.1:{port}"])
+
+
+def test_probe_node_skips_udp_only_schemes():
+    result = asyncio.run(NodeSelector.probe_node("wg://127.0.0.1:11011"))
+    assert result["probed"] is False and result["attempts"] == 0
@@ -0,0 +1,44 @@
+import asyncio
+from Florolding import PeerTable
+
+
+def peer(peer_id, **fields) -> dict:
+    info = {"id": peer_id, "hostname": f"node-{peer_id}", "ipv4": f"10.0.0.{peer_id}/24", "cost": "p2p", "version": "2.4.5",
+            "lat_ms": 12.5, "rx_bytes": 1000, "tx_bytes": 2000, "loss_rate": 0.0}
+    info.update(fields)
+    return info
+
+
+def test_volatile_fields_are_not_updates():
+    table = PeerTable.PeerTable()
+    assert [p["id"] for p in table.update([peer(1), peer(2)])["added"]] == [1, 2]
+    changes = table.update([peer(1, lat_ms=80.1, rx_bytes=5000, tx_bytes=9000, loss_rate=0.2), peer(2, lat_ms=3.0)])
+    assert changes == {"added": [], "updated": [], "removed": []}
+    # 缓存仍换成最新的数据
+    assert table.get(1)["lat_ms"] == 80.1
+
+
+def test_tracked_fields_are_updates():
+    table = PeerTable.PeerTable()
+    table.update([peer(1), peer(2), peer(3), peer(4), peer(5)])
+    changes = table.update([peer(1, hostname="renamed"), peer(2, ipv4="10.0.0.20/24"), peer(3, cost="relay(2)"), peer(4, version="2.5.0"), peer(5, lat_ms=1)])
+    assert sorted(p["id"] for p in changes["updated"]) == [1, 2, 3, 4]
+    assert table.get_by_hostname("renamed")["id"] == 1
+    assert table.get_by_ipv4("10.0.0.20")["id"] == 2
+
+
+def test_refresh_does_not_notify_for_volatile_changes():
+    snapshots = [[peer(1)], [peer(1, lat_ms=99, rx_bytes=1)], [peer(1, cost="relay(2)")]]
+    notified = []
+
+    async def fetch():
+        return snapshots.pop(0)
+
+    async def main():
+        table = PeerTable.PeerTable(fetch=fetch)
+        table.add_listener(notified.append)
+        for _ in range(3):
+            await table.refresh()
+
+    asyncio.run(main())
+    assert [(len(c["added"]), len(c["updated"])) for c in notified] == [(1, 0), (0, 1)]
@@ -0,0 +1,102 @@
+import asyncio
+from Florolding import F_Client, F_Server
+
+
+async def start_server(**options) -> F_Server.AsyncFloroldingServer:
+    server = F_Server.AsyncFloroldingServer("host", 1, "Host", "127.0.0.1", 0, **options)
+    await server.listen()
+    return server
+
+
+async def join(server: F_Server.AsyncFloroldingServer, machine_id: str, name: str | None = None) -> F_Client.AsyncFloroldingClient:
+    client = F_Client.AsyncFloroldingClient(machine_id, 2, name or machine_id, server_port=server.server_port, heartbeat_interval=None)
+    await client.connect()
+    assert (await client.send_request("c:player_ping", client.heartbeat_body()))[0] == 0
+    return client
+
+
+async def wait_left(server: F_Server.AsyncFloroldingServer, machine_id: str):
+    while machine_id in server.players:
+        await asyncio.sleep(0.01)
+
+
+def test_roster_follows_deltas():
+    async def main():
+        server = await start_server()
+        observer = F_Client.AsyncFloroldingClient("observer", 0, server_port=server.server_port, heartbeat_interval=None)
+        await observer.connect()
+        try:
+            steps = [await observer.sync_roster()]
+            alice = await join(server, "alice")
+            steps.append(await observer.sync_roster())
+            # 没有变化时增量为空
+            steps.append(await observer.sync_roster())
+            alice.player_name = "Alice"
+            await alice.send_request("c:player_ping", alice.heartbeat_body())
+            server.set_easytier_id(42)
+            # 同步之间加入又离开的玩家不可见
+            bob = await join(server, "bob")
+            await bob.disconnect()
+            await wait_left(server, "bob")
+            steps.append(await observer.sync_roster())
+            await alice.disconnect()
+            await wait_left(server, "alice")
+            steps.append(await observer.sync_roster())
+            return steps, observer.roster, observer.roster_generation, server.players_generation
+        finally:
+            await observer.disconnect()
+            await server.stop()
+
+    steps, roster, roster_generation, generation = asyncio.run(main())
+    assert [player["machine_id"] for player in steps[0]["added"]] == ["host"]
+    assert [player["machine_id"] for player in steps[1]["added"]] == ["alice"]
+    assert steps[2] == {"added": [], "updated": [], "removed": []}
+    assert sorted((player["machine_id"], player["name"]) for player in steps[3]["updated"]) == [("alice", "Alice"), ("host", "Host")]
+    assert steps[3]["added"] == [] and steps[3]["removed"] == []
+    assert steps[4] == {"added": [], "updated": [], "removed": ["alice"]}
+    assert list(roster) == ["host"] and roster["host"]["easytier_id"] == 42
+    assert roster_generation == generation
+
+
+def test_delta_resets_when_change_log_is_exceeded():
+    async def main():
+        server = await start_server(change_log_size=2)
+        clients = [await join(server, f"guest{index}") for index in range(4)]
+        try:
+            return server.player_profiles_delta(1), server.player_profiles_delta(server.players_generation - 1), server.player_profiles_delta(server.players_generation + 5)
+        finally:
+            for client in clients:
+                await client.disconnect()
+            await server.stop()
+
+    stale, recent, future = asyncio.run(main())
+    assert stale["reset"] and len(stale["added"]) == 5
+    assert not recent["reset"] and [player["machine_id"] for player in recent["added"]] == ["guest3"]
+    assert future["reset"]
+
+
+def test_profiles_list_not_modified():
+    async def main():
+        server = await start_server()
+        client = F_Client.AsyncFloroldingClient("observer", 0, server_port=server.server_port, heartbeat_interval=None)
+        await client.connect()
+        try:
+            generation, players = await client.f_player_profiles_list()
+            snapshot = server.player_profiles_snapshot()
+            cached = server.player_profiles_snapshot() is snapshot
+            unchanged = await client.f_player_profiles_list(generation)
+            guest = await join(server, "guest")
+            changed = await client.f_player_profiles_list(generation)
+            invalid = await client.send_request("f:player_profiles_delta", b"\x00")
+            await guest.disconnect()
+            return generation, players, cached, unchanged, changed, invalid
+        finally:
+            await client.disconnect()
+            await server.stop()
+
+    generation, players, cached, unchanged, changed, invalid = asyncio.run(main())
+    assert [player["machine_id"] for player in players] == ["host"]
+    assert cached
+    assert unchanged == (generation, None)
+    assert changed[0] == generation + 1 and [player["machine_id"] for player in changed[1]] == ["host", "guest"]
+    assert invalid[0] == 255
@@ -0,0 +1,44 @@
+import asyncio
+import socket
+import pytest
+from Florolding import PortAllocator
+
+
+def reuse_socket() -> socket.socket:
+    """与asyncio.start_server默认相同, 设置了SO_REUSEADDR的套接字"""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    return sock
+
+
+def test_pooled_port_cannot_be_taken_before_listen():
+    with PortAllocator.PortAllocator("127.0.0.1", pool_size=8) as allocator:
+        allocator.fill()
+        ports = [sock.getsockname()[1] for sock in allocator.pool]
+        for port in ports:
+            with reuse_socket() as other, pytest.raises(OSError):
+                other.bind(("127.0.0.1", port))
+        sock = allocator.acquire()
+        sock.listen()
+        sock.close()
+
+
+def test_start_server_on_pooled_port_fails():
+    async def main():
+        with PortAllocator.PortAllocator("127.0.0.1") as allocator:
+            allocator.fill()
+            port = allocator.pool[0].getsockname()[1]
+            with pytest.raises(OSError):
+                await asyncio.start_server(lambda reader, writer: writer.close(), "127.0.0.1", port)
+            server = await asyncio.start_server(lambda reader, writer: writer.close(), sock=allocator.acquire())
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_acquire_port_is_free_for_other_process():
+    port = PortAllocator.PortAllocator("127.0.0.1", pool_size=0).acquire_port()
+    with reuse_socket() as other:
+        other.bind(("127.0.0.1", port))
+        other.listen()
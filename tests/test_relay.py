@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from Florolding import Relay
+from conftest import start_socks5_proxy
+
+
+async def start_echo_server() -> asyncio.Server:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+async def echo_through(relay: Relay.TcpRelay, payload: bytes) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", relay.local_port)
+    writer.write(payload)
+    writer.write_eof()
+    received = await asyncio.wait_for(reader.read(), 10)
+    writer.close()
+    return received
+
+
+async def wait_until(predicate, timeout: float = 5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.parametrize("zero_copy", [True, False])
+def test_relay_round_trip_counts_bytes(zero_copy):
+    payload = bytes(range(256)) * 4096
+
+    async def main():
+        async with await start_echo_server() as echo:
+            async with Relay.TcpRelay("127.0.0.1", echo.sockets[0].getsockname()[1], zero_copy=zero_copy) as relay:
+                received = await echo_through(relay, payload)
+                await wait_until(lambda: not relay.connections)
+                return received, relay.info(), relay.metrics.snapshot()
+
+    received, info, metrics = asyncio.run(main())
+    assert received == payload
+    assert info["bytes_up"] == info["bytes_down"] == len(payload)
+    assert info["proxy"] is None
+    assert metrics["counters"]["relay_connections_total"] == 1
+
+
+def test_relay_through_socks5_proxy():
+    targets = []
+    payload = b"scaffolding" * 1000
+
+    async def main():
+        async with await start_echo_server() as echo:
+            echo_port = echo.sockets[0].getsockname()[1]
+            async with await start_socks5_proxy(targets, resolve=lambda host, port: ("127.0.0.1", echo_port)) as proxy:
+                proxy_address = ("127.0.0.1", proxy.sockets[0].getsockname()[1])
+                # 远程地址是虚拟IP, 只有经由代理才能访问
+                async with Relay.TcpRelay("10.126.126.1", 13448, proxy=proxy_address) as relay:
+                    return await echo_through(relay, payload), relay.info()
+
+    received, info = asyncio.run(main())
+    assert received == payload
+    assert targets == [("10.126.126.1", 13448)]
+    assert info["bytes_up"] == len(payload)
+
+
+def test_relay_closes_client_when_proxy_refuses():
+    targets = []
+
+    async def main():
+        async with await start_socks5_proxy(targets, reply=5) as proxy:
+            async with Relay.TcpRelay("10.126.126.1", 13448, proxy=("127.0.0.1", proxy.sockets[0].getsockname()[1])) as relay:
+                # 不发送数据, 避免关闭时仍有未读数据导致连接被重置
+                received = await echo_through(relay, b"")
+                return received, relay.metrics.snapshot()
+
+    received, metrics = asyncio.run(main())
+    assert received == b""
+    assert targets == [("10.126.126.1", 13448)]
+    assert metrics["counters"]["relay_connect_errors"] == 1
+
+
+def test_idle_connection_is_closed():
+    async def main():
+        async with await start_echo_server() as echo:
+            async with Relay.TcpRelay("127.0.0.1", echo.sockets[0].getsockname()[1], idle_timeout=0.2, sweep_interval=0.05) as relay:
+                reader, writer = await asyncio.open_connection("127.0.0.1", relay.local_port)
+                writer.write(b"ping")
+                assert await reader.readexactly(4) == b"ping"
+                # 空闲超时后转发关闭连接, 客户端读到EOF
+                assert await asyncio.wait_for(reader.read(), 5) == b""
+                writer.close()
+                await wait_until(lambda: not relay.connections)
+                return relay.metrics.snapshot()
+
+    assert asyncio.run(main())["counters"]["relay_idle_timeouts"] == 1
+
+
+def test_stop_closes_listener_and_connections():
+    async def main():
+        async with await start_echo_server() as echo:
+            relay = Relay.TcpRelay("127.0.0.1", echo.sockets[0].getsockname()[1])
+            await relay.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", relay.local_port)
+            writer.write(b"ping")
+            assert await reader.readexactly(4) == b"ping"
+            await relay.stop()
+            assert not relay.connections
+            try:
+                assert await asyncio.wait_for(reader.read(), 5) == b""
+            except ConnectionResetError:
+                pass
+            writer.close()
+            with pytest.raises(OSError):
+                await asyncio.open_connection("127.0.0.1", relay.local_port)
+
+    asyncio.run(main())
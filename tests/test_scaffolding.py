@@ -0,0 +1,54 @@
+import pytest
+from Florolding import Scaffolding
+
+CHARSET = "0123456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+
+
+def reference_validate(code: str) -> bool:
+    """协议文档中的原始算法: 16位34进制(小端序)数值能被7整除"""
+    if not code.startswith("U/"):
+        return False
+    parts = code[2:].split("-")
+    if len(parts) != 4 or any(len(part) != 4 for part in parts):
+        return False
+    chars = "".join(parts)
+    if any(char not in CHARSET for char in chars):
+        return False
+    return sum(CHARSET.index(char) * 34 ** i for i, char in enumerate(chars)) % 7 == 0
+
+
+INVALID = [
+    "", "U/", "X/0000-0000-0000-0000", "U/0000-0000-0000-000", "U/0000-0000-0000-00000",
+    "U/0000_0000-0000-0000", "U/000I-0000-0000-0000", "U/000a-0000-0000-0000", "U/000é-0000-0000-0000",
+    "U/1000-0000-0000-0000", None, 7
+]
+
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=pytest.mark.skipif(Scaffolding.numpy is None, reason="NumPy未安装"))])
+def test_generated_codes_are_valid(use_numpy):
+    codes = Scaffolding.generate_codes(2000, use_numpy=use_numpy)
+    assert len(codes) == 2000 and len(set(codes)) == 2000
+    assert all(reference_validate(code) for code in codes)
+    assert Scaffolding.validate_codes(codes, use_numpy=use_numpy) == [True] * 2000
+
+
+@pytest.mark.parametrize("use_numpy", [False, pytest.param(True, marks=pytest.mark.skipif(Scaffolding.numpy is None, reason="NumPy未安装"))])
+def test_validate_codes_matches_reference(use_numpy):
+    valid = Scaffolding.generate_codes(50)
+    # 改动一位后约6/7不再能被7整除
+    mutated = [code[:2] + CHARSET[(CHARSET.index(code[2]) + 1) % 34] + code[3:] for code in valid]
+    codes = valid + mutated + INVALID
+    expected = [isinstance(code, str) and reference_validate(code) for code in codes]
+    assert Scaffolding.validate_codes(codes, use_numpy=use_numpy) == expected
+    assert [Scaffolding.validate_code(code) for code in codes] == expected
+
+
+def test_zero_code_is_valid():
+    assert Scaffolding.validate_code("U/0000-0000-0000-0000")
+
+
+def test_parse_code():
+    code = Scaffolding.generate_code()
+    room_code = Scaffolding.parse_code(code)
+    assert room_code == (code, f"scaffolding-mc-{code[2:11]}", code[12:21])
+    assert Scaffolding.parse_code("U/1000-0000-0000-0000") is None
@@ -0,0 +1,298 @@
+import asyncio
+import json
+import socket
+import pytest
+from Florolding import F_Frame, F_Server, RateLimit, TimerWheel
+
+HOST_ID = "host"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_timer_wheel_schedule_renew_cancel():
+    clock = FakeClock()
+    wheel = TimerWheel.TimerWheel(1, 8, clock)
+    wheel.schedule("a", 3)
+    wheel.schedule("b", 3)
+    wheel.schedule("c", 20)  # 超过一圈的条目
+    clock.now += 2
+    assert wheel.advance() == []
+    wheel.schedule("a", 3)  # 续期
+    assert wheel.cancel("b") and not wheel.cancel("b")
+    clock.now += 2
+    assert wheel.advance() == []
+    clock.now += 2
+    assert wheel.advance() == ["a"]
+    assert "c" in wheel and len(wheel) == 1
+    clock.now += 20
+    assert wheel.advance() == ["c"]
+    assert len(wheel) == 0
+
+
+async def open_client(server: F_Server.AsyncFloroldingServer, local_host: str = "127.0.0.1"):
+    return await asyncio.open_connection("127.0.0.1", server.server_port, local_addr=(local_host, 0))
+
+
+async def request(client, protocol_type: str, body: bytes = b"") -> tuple:
+    reader, writer = client
+    F_Frame.write_frames(writer, F_Frame.encode_request(protocol_type, body))
+    decoder = F_Frame.ResponseDecoder()
+    while True:
+        data = await asyncio.wait_for(reader.read(65536), 5)
+        assert data, "connection closed"
+        frames = decoder.feed(data)
+        if frames:
+            return frames[0]
+
+
+async def ping(client, machine_id: str, name: str = "Guest") -> int:
+    body = json.dumps({"name": name, "machine_id": machine_id, "vendor": "test"}).encode("utf-8")
+    return (await request(client, "c:player_ping", body))[0]
+
+
+def run_server(scenario, **options):
+    async def main():
+        server = F_Server.AsyncFloroldingServer(HOST_ID, 1, "Host", "127.0.0.1", 0, sweep_interval=0.05, **options)
+        await server.listen()
+        try:
+            return await scenario(server)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_expired_player_is_removed_and_connection_closed():
+    async def scenario(server):
+        expired = []
+        server.add_expiry_listener(lambda machine_id, player_info: expired.append(machine_id))
+        reader, writer = client = await open_client(server)
+        assert await ping(client, "guest") == 0
+        assert "guest" in server.players
+        # 不再发送心跳, 超时后服务器移除玩家并主动关闭连接
+        assert await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
+        return expired, server.players, server.player_profiles_delta(0)
+
+    expired, players, delta = run_server(scenario, player_timeout=0.3)
+    assert expired == ["guest"]
+    assert list(players) == [HOST_ID]
+    assert delta["added"] == [] and delta["removed"] == []  # 加入后又离开
+
+
+def test_heartbeats_keep_player():
+    async def scenario(server):
+        client = await open_client(server)
+        for _ in range(8):
+            assert await ping(client, "guest") == 0
+            await asyncio.sleep(0.1)
+        present = "guest" in server.players
+        client[1].close()
+        return present
+
+    assert run_server(scenario, player_timeout=0.3)
+
+
+def test_guest_cannot_use_host_machine_id():
+    async def scenario(server):
+        client = await open_client(server)
+        status = await ping(client, HOST_ID)
+        await asyncio.sleep(0.5)
+        client[1].close()
+        return status, server.players[HOST_ID]["kind"]
+
+    assert run_server(scenario, player_timeout=0.2) == (255, "HOST")
+
+
+def test_machine_id_of_another_connection_is_rejected():
+    async def scenario(server):
+        owner = await open_client(server)
+        assert await ping(owner, "guest", "Owner") == 0
+        other = await open_client(server, "127.0.0.2")
+        status = await ping(other, "guest", "Spoofer")
+        other[1].close()
+        await asyncio.sleep(0.1)
+        # 冒用者断开后玩家仍在, 资料未被替换
+        result = status, server.players.get("guest", {}).get("name")
+        owner[1].close()
+        return result
+
+    assert run_server(scenario) == (255, "Owner")
+
+
+def test_machine_id_cannot_change_on_connection():
+    async def scenario(server):
+        client = await open_client(server)
+        assert await ping(client, "first") == 0
+        status = await ping(client, "second")
+        client[1].close()
+        return status, "second" in server.players
+
+    assert run_server(scenario) == (255, False)
+
+
+def test_reconnect_from_same_address_takes_over():
+    async def scenario(server):
+        old = await open_client(server)
+        assert await ping(old, "guest") == 0
+        new = await open_client(server)
+        assert await ping(new, "guest") == 0
+        # 旧连接被关闭, 且关闭不会移除玩家
+        assert await asyncio.wait_for(old[0].read(), 5) == b""
+        await asyncio.sleep(0.1)
+        present = "guest" in server.players and server.writers["guest"] is not None
+        new[1].close()
+        return present, [kind for _, machine_id, kind in server.players_changes if machine_id == "guest"]
+
+    present, changes = run_server(scenario)
+    assert present
+    assert changes == ["join"]
+
+
+def test_handler_registry_dispatch():
+    async def scenario(server):
+        seen = []
+
+        @server.handler("f:echo_async")
+        async def echo_async(request_body):
+            return 0, request_body[::-1]
+
+        server.register_handler("f:echo_sync", lambda request_body: (0, request_body.upper()))
+
+        def whoami(request_body, connection):
+            seen.append(connection)
+            return 0, str(connection.address[1]).encode("ascii")
+
+        server.register_handler("f:whoami", whoami, needs_connection=True)
+        server.register_handler("f:broken", lambda request_body: 1 / 0)
+        server.register_handler("f:temporary", lambda request_body: (0, b""))
+        assert server.unregister_handler("f:temporary") and not server.unregister_handler("f:temporary")
+        client = await open_client(server)
+        try:
+            results = [
+                await request(client, "f:echo_async", b"abc"),
+                await request(client, "f:echo_sync", b"abc"),
+                await request(client, "f:whoami"),
+                await request(client, "f:broken"),
+                # 处理器异常后连接仍然可用
+                await request(client, "f:whoami"),
+                await request(client, "f:temporary"),
+                await request(client, "c:protocols", b"c:ping"),
+                await request(client, "Bad Type")
+            ]
+        finally:
+            client[1].close()
+        return results, seen
+
+    results, seen = run_server(scenario)
+    port = str(seen[0].address[1]).encode("ascii")
+    assert results[:6] == [(0, b"cba"), (0, b"ABC"), (0, port), (255, b"Internal error: f:broken"), (0, port), (255, b"Unsupported protocol: f:temporary")]
+    assert seen[0] is seen[1]  # 同一连接共享上下文
+    protocols = results[6][1].decode("ascii").split("\0")
+    assert {"c:ping", "c:player_ping", "f:echo_async", "f:whoami"} <= set(protocols) and "f:temporary" not in protocols
+    assert "c:player_easytier_id" not in protocols  # 没有节点表时不注册
+    assert results[7][0] == 255
+
+
+@pytest.mark.parametrize("protocol_type", ["echo", "F:echo", "f:echo-x", "f:" + "x" * 254])
+def test_register_handler_rejects_invalid_names(protocol_type):
+    server = F_Server.AsyncFloroldingServer(HOST_ID, 1)
+    with pytest.raises(ValueError):
+        server.register_handler(protocol_type, lambda request_body: (0, b""))
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = RateLimit.TokenBucket(2, 3, clock)
+    assert [bucket.consume() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5
+    assert bucket.consume() and not bucket.consume()
+    clock.now += 10
+    assert [bucket.consume() for _ in range(4)] == [True, True, True, False]
+    assert RateLimit.TokenBucket(0.5).burst == 1
+
+
+def test_max_connections():
+    async def scenario(server):
+        first = await open_client(server)
+        second = await open_client(server)
+        closed = await asyncio.wait_for(second[0].read(), 5)
+        second[1].close()
+        status = (await request(first, "c:ping", b"x"))[0]
+        first[1].close()
+        return closed, status, server.metrics.counters.get("connections_rejected")
+
+    assert run_server(scenario, max_connections=1) == (b"", 0, 1)
+
+
+def test_idle_connection_is_closed():
+    async def scenario(server):
+        idle = await open_client(server)
+        active = await open_client(server)
+        for _ in range(6):
+            assert (await request(active, "c:ping", b"x"))[0] == 0
+            await asyncio.sleep(0.05)
+        closed = await asyncio.wait_for(idle[0].read(), 5)
+        status = (await request(active, "c:ping", b"x"))[0]
+        idle[1].close()
+        active[1].close()
+        return closed, status
+
+    assert run_server(scenario, idle_timeout=0.2) == (b"", 0)
+
+
+def test_connection_rate_limit():
+    async def scenario(server):
+        client = await open_client(server)
+        statuses = [(await request(client, "c:ping", b"x"))[0] for _ in range(4)]
+        client[1].close()
+        return statuses, server.metrics.counters.get("rate_limited_connection")
+
+    assert run_server(scenario, rate_limit=0.01, rate_burst=3) == ([0, 0, 0, 255], 1)
+
+
+def test_player_rate_limit_survives_reconnect():
+    async def scenario(server):
+        old = await open_client(server)
+        assert await ping(old, "guest") == 0
+        statuses = [(await request(old, "c:ping", b"x"))[0] for _ in range(3)]
+        # 同一玩家的新连接共享令牌桶
+        new = await open_client(server)
+        assert await ping(new, "guest") == 0
+        statuses.append((await request(new, "c:ping", b"x"))[0])
+        old[1].close()
+        new[1].close()
+        return statuses
+
+    # 登记玩家前的第一次心跳不计入玩家限流
+    assert run_server(scenario, player_rate_limit=0.01, player_rate_burst=3) == [0, 0, 0, 255]
+
+
+def test_slow_reader_waits_for_drain():
+    body = b"d" * 65536
+
+    async def scenario(server):
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("127.0.0.1", server.server_port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        writer.write(b"".join(chunk for _ in range(128) for chunk in F_Frame.encode_request("c:ping", body)))
+        # 不读取响应, 服务器的发送缓冲区超过高水位后应暂停处理
+        await asyncio.sleep(0.3)
+        waits = server.metrics.counters.get("drain_waits", 0)
+        decoder = F_Frame.ResponseDecoder(None)
+        responses = []
+        while len(responses) < 128:
+            responses += decoder.feed(await asyncio.wait_for(reader.read(1 << 20), 5))
+        writer.close()
+        return waits, responses
+
+    waits, responses = run_server(scenario, write_high_water=65536)
+    assert waits > 0
+    assert responses == [(0, body)] * 128
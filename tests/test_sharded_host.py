@@ -0,0 +1,63 @@
+import asyncio
+import os
+import signal
+import pytest
+from Florolding import ShardedHost
+from conftest import read_log
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "killpg"), reason="进程组仅POSIX可用")
+
+
+def alive(pid: int) -> bool:
+    """进程是否存活, 僵尸进程视为已结束"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+async def wait_until(predicate, timeout: float = 10):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline
+        await asyncio.sleep(0.05)
+
+
+def test_worker_crash_leaves_no_orphaned_core(fake_easytier):
+    events = []
+
+    async def main():
+        host = ShardedHost.ShardedRoomHost(workers=1, use_uvloop=False, launcher_options={
+            "et_core_path": fake_easytier["core"], "et_cli_path": fake_easytier["cli"], "health_interval": 60
+        })
+        host.add_listener(lambda event, info: events.append(event))
+        await host.start()
+        try:
+            room = await host.create_room()
+            await wait_until(lambda: len(read_log(fake_easytier["log"])) == 1)
+            first_core = read_log(fake_easytier["log"])[0]["pid"]
+            assert alive(first_core)
+            os.kill(host.workers[0].process.pid, signal.SIGKILL)
+            await wait_until(lambda: "room_moved" in events)
+            await wait_until(lambda: len(read_log(fake_easytier["log"])) == 2)
+            second_core = read_log(fake_easytier["log"])[1]["pid"]
+            # 迁移后只剩新工作进程上的easytier-core
+            assert not alive(first_core)
+            assert alive(second_core)
+            assert [code for code in host.rooms] == [room["code"]]
+        finally:
+            await host.stop()
+        return [entry["pid"] for entry in read_log(fake_easytier["log"])]
+
+    pids = asyncio.run(main())
+    assert events.count("worker_started") == 2
+    assert not any(alive(pid) for pid in pids)
@@ -0,0 +1,115 @@
+import asyncio
+import os
+import signal
+from conftest import read_log
+from Florolding import RoomManager, Scaffolding, Supervisor
+
+
+def checked_portals(fake_easytier) -> set:
+    return {args[args.index("-p") + 1] for args in read_log(fake_easytier["cli_log"])}
+
+
+def test_room_launcher_gives_each_room_its_own_rpc_portal_and_listeners(fake_easytier):
+    async def main():
+        launcher = Supervisor.room_launcher(fake_easytier["core"], fake_easytier["cli"], health_interval=0.1)
+        async with RoomManager.RoomManager(server_host="127.0.0.1", launcher=launcher) as manager:
+            rooms = [await manager.create_room() for _ in range(3)]
+            portals = [room.easytier.rpc_portal for room in rooms]
+            listeners = [room.easytier.listen_addresses for room in rooms]
+            # 等待每个房间至少完成一次健康检查
+            for _ in range(100):
+                if checked_portals(fake_easytier) == set(portals):
+                    break
+                await asyncio.sleep(0.05)
+        return portals, listeners
+
+    portals, listeners = asyncio.run(main())
+    assert len(set(portals)) == 3
+    # 每个easytier-core以自己的RPC地址与监听端口启动, 健康检查也只查询该地址
+    started = [entry["args"] for entry in read_log(fake_easytier["log"])]
+    assert sorted(args[args.index("--rpc-portal") + 1] for args in started) == sorted(portals)
+    assert sorted([args[index + 1] for index, arg in enumerate(args) if arg == "-l"] for args in started) == sorted(listeners)
+    ports = {listener.rsplit(":", 1)[1] for room_listeners in listeners for listener in room_listeners}
+    assert len(ports) == 3 and "11010" not in ports
+    assert all("--no-listener" not in args for args in started)
+    assert checked_portals(fake_easytier) == set(portals)
+
+
+def test_empty_listeners_disable_listening():
+    supervisor = Supervisor.EasyTierSupervisor("easytier-core", Scaffolding.generate_code(), True, listen_addresses=[])
+    assert "--no-listener" in supervisor.params and "-l" not in supervisor.params
+    assert "-l" not in Supervisor.EasyTierSupervisor("easytier-core", Scaffolding.generate_code(), True).params
+
+
+def run_supervisor(fake_easytier, scenario, **options) -> list:
+    r"""
+    启动守护, 执行scenario(supervisor)后停止
+    :return: 事件列表[(事件, 信息)]
+    """
+    async def main():
+        events = []
+        supervisor = Supervisor.EasyTierSupervisor(
+            fake_easytier["core"], Scaffolding.generate_code(), True, 3939, et_cli_path=fake_easytier["cli"],
+            min_backoff=0.05, max_backoff=0.1, **options
+        )
+        supervisor.add_listener(lambda event, info: events.append((event, info)))
+        await supervisor.start()
+        try:
+            await scenario(supervisor)
+        finally:
+            await supervisor.stop()
+        return events
+
+    return asyncio.run(main())
+
+
+def test_restarts_crashed_core_with_same_params(fake_easytier, monkeypatch):
+    monkeypatch.setenv("FAKE_ET_EXIT_AFTER", "0.1")
+
+    async def scenario(supervisor):
+        for _ in range(100):
+            if supervisor.supervise_task.done():
+                break
+            await asyncio.sleep(0.05)
+
+    events = run_supervisor(fake_easytier, scenario, max_restarts=2, health_interval=10)
+    names = [event for event, _ in events]
+    assert names.count("started") == 3
+    assert names.count("exited") == 3
+    assert ("failed", {"error": "too many restarts"}) in events
+    launches = [entry["args"] for entry in read_log(fake_easytier["log"])]
+    assert len(launches) == 3 and launches[0] == launches[1] == launches[2]
+
+
+def test_restarts_unhealthy_core(fake_easytier):
+    async def scenario(supervisor):
+        first_pid = supervisor.pid
+        open(fake_easytier["unhealthy"], "w").close()
+        for _ in range(100):
+            if supervisor.pid != first_pid and supervisor.is_running():
+                break
+            await asyncio.sleep(0.05)
+        os.remove(fake_easytier["unhealthy"])
+        assert supervisor.pid != first_pid
+
+    events = run_supervisor(fake_easytier, scenario, health_interval=0.05, max_health_failures=2)
+    names = [event for event, _ in events]
+    assert names.index("unhealthy") < names.index("restarting")
+    assert names[-1] == "stopped"
+
+
+def test_stop_kills_core_that_ignores_sigterm(fake_easytier, monkeypatch):
+    monkeypatch.setenv("FAKE_ET_IGNORE_TERM", "1")
+    processes = []
+
+    async def scenario(supervisor):
+        # 等待替身设置好信号处理
+        while not read_log(fake_easytier["log"]):
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.1)
+        processes.append(supervisor.process)
+
+    events = run_supervisor(fake_easytier, scenario, health_interval=10, stop_timeout=0.3)
+    assert processes[0].returncode == -signal.SIGKILL
+    assert [event for event, _ in events][-1] == "stopped"
+    assert "restarting" not in [event for event, _ in events]